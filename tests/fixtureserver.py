@@ -0,0 +1,107 @@
+#  kittykernel
+#
+#  Copyright (C) 2017 by Sven Kochmann, available at Github:
+#  <https://www.github.com/Schallaven/kittykernel/>
+#
+#  This program is free software;  you can redistribute it and/or modify
+#  it under the terms of the  GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  This program is  distributed in the hope that it  will be useful, but
+#  WITHOUT  ANY   WARRANTY;  without   even  the  implied   warranty  of
+#  MERCHANTABILITY  or FITNESS FOR  A PARTICULAR  PURPOSE.  See  the GNU
+#  General Public License for more details.
+#
+#  You should  have received  a copy of  the GNU General  Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#  Local HTTP server standing in for the mainline archive and package
+#  mirrors in the tests
+#
+
+import os
+import sys
+import hashlib
+import threading
+import http.server
+import email.utils
+
+# The modules of kittykernel are not a package; make them importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "usr", "lib", "kittykernel"))
+
+# Directory with the fixture files
+fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+# Serves the files of a directory; directories are answered with their index.html. ETag and Last-Modified are sent
+# and conditional requests (If-None-Match, If-Modified-Since) are answered with 304. Range requests ("bytes=N-") get
+# a 206, unless ranges is False (then the whole file is sent with 200, like servers without range support) or 'wrong'
+# (206 with the whole file, i.e. a Content-Range other than asked for). Every request is recorded in requests as tuple
+# (path, status).
+class FixtureServer:
+
+    def __init__(self, root, ranges = True):
+        self.root = root
+        self.ranges = ranges
+        self.requests = []
+
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def log_message(self, format, *args):
+                pass
+
+            def send(self, status, headers = {}, body = b""):
+                server.requests.append((self.path, status))
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                path = os.path.join(server.root, self.path.split("?", 1)[0].lstrip("/"))
+                if os.path.isdir(path):
+                    path = os.path.join(path, "index.html")
+
+                if not os.path.isfile(path):
+                    return self.send(404)
+
+                with open(path, "rb") as f:
+                    data = f.read()
+
+                etag = '"%s"' % hashlib.sha256(data).hexdigest()[:16]
+                modified = email.utils.formatdate(int(os.stat(path).st_mtime), usegmt=True)
+                headers = {'ETag': etag, 'Last-Modified': modified}
+
+                if self.headers.get('If-None-Match') == etag:
+                    return self.send(304, headers)
+
+                if self.headers.get('If-None-Match') is None and self.headers.get('If-Modified-Since') == modified:
+                    return self.send(304, headers)
+
+                if server.ranges and (self.headers.get('Range') or "").startswith("bytes="):
+                    start = int(self.headers['Range'][6:].split("-")[0]) if server.ranges != 'wrong' else 0
+                    headers['Content-Range'] = "bytes %d-%d/%d" % (start, len(data) - 1, len(data))
+                    return self.send(206, headers, data[start:])
+
+                self.send(200, headers, data)
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%d/" % self.httpd.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    # Returns the statuses of the requests for a path
+    def statuses(self, path):
+        return [status for requested, status in self.requests if requested == path]
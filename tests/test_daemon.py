@@ -0,0 +1,66 @@
+#  kittykernel
+#
+#  Copyright (C) 2017 by Sven Kochmann, available at Github:
+#  <https://www.github.com/Schallaven/kittykernel/>
+#
+#  This program is free software;  you can redistribute it and/or modify
+#  it under the terms of the  GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  This program is  distributed in the hope that it  will be useful, but
+#  WITHOUT  ANY   WARRANTY;  without   even  the  implied   warranty  of
+#  MERCHANTABILITY  or FITNESS FOR  A PARTICULAR  PURPOSE.  See  the GNU
+#  General Public License for more details.
+#
+#  You should  have received  a copy of  the GNU General  Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#  Tests of the requests the daemon (running as root) accepts
+#
+
+import unittest
+
+# Makes the modules of kittykernel importable
+import fixtureserver
+
+# Needs python-apt
+try:
+    import kittykedaemon
+except ImportError:
+    kittykedaemon = None
+
+
+@unittest.skipIf(kittykedaemon is None, "python-apt is not installed")
+class DaemonRequestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.kernels = kittykedaemon.inventory['kernels']
+        self.mtimes = kittykedaemon.inventory['mtimes']
+
+        kittykedaemon.inventory['kernels'] = [{'package': "linux-image-6.8.0-31-generic", 'fullname': "linux-image-6.8.0-31-generic:amd64", 'abi': "6.8.0-31-generic"}]
+        kittykedaemon.inventory['mtimes'] = kittykedaemon.get_inventory_mtimes()
+
+    def tearDown(self):
+        kittykedaemon.inventory['kernels'] = self.kernels
+        kittykedaemon.inventory['mtimes'] = self.mtimes
+
+    def test_kernel_operations(self):
+        operations = [["purge", "linux-image-6.8.0-31-generic"], ["purge", "linux-modules-6.8.0-31-generic"], ["purge", "linux-headers-6.8.0-31-generic"]]
+
+        self.assertEqual(kittykedaemon.check_operations(operations), [tuple(operation) for operation in operations])
+
+    def test_other_packages(self):
+        for operation in [["remove", "openssh-server"], ["install", "linux-image-6.9.0-10-generic"], ["remove", "linux-generic"],
+                          ["hold", "linux-image-6.8.0-31-generic"], ["remove"], "remove sudo"]:
+            with self.assertRaises(ValueError):
+                kittykedaemon.check_operations([operation])
+
+    def test_changelog(self):
+        with self.assertRaises(ValueError):
+            kittykedaemon.KittykeRequestHandler.execute(None, {'command': 'changelog', 'fullname': "openssh-server"}, 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+#  kittykernel
+#
+#  Copyright (C) 2017 by Sven Kochmann, available at Github:
+#  <https://www.github.com/Schallaven/kittykernel/>
+#
+#  This program is free software;  you can redistribute it and/or modify
+#  it under the terms of the  GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  This program is  distributed in the hope that it  will be useful, but
+#  WITHOUT  ANY   WARRANTY;  without   even  the  implied   warranty  of
+#  MERCHANTABILITY  or FITNESS FOR  A PARTICULAR  PURPOSE.  See  the GNU
+#  General Public License for more details.
+#
+#  You should  have received  a copy of  the GNU General  Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#  Tests of the downloads into the local store (resuming, servers
+#  without range support, checksums) against a local HTTP server
+#
+
+import os
+import hashlib
+import tempfile
+import threading
+import unittest
+
+from fixtureserver import FixtureServer
+
+# Needs python-apt (kittykecore)
+try:
+    import kittykedownload
+except ImportError:
+    kittykedownload = None
+
+
+@unittest.skipIf(kittykedownload is None, "python-apt is not installed")
+class DownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.served = os.path.join(self.directory.name, "served")
+        self.store = os.path.join(self.directory.name, "store")
+        os.makedirs(self.served)
+
+        # Package of 300 KiB (several chunks)
+        self.data = bytes(range(256)) * 1200
+        self.sha256 = hashlib.sha256(self.data).hexdigest()
+
+        with open(os.path.join(self.served, "package.deb"), "wb") as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # Leaves the first half of the package as interrupted download in the store
+    def interrupt(self):
+        partial = os.path.join(self.store, "partial", self.sha256 + ".part")
+        os.makedirs(os.path.dirname(partial))
+
+        with open(partial, "wb") as f:
+            f.write(self.data[:len(self.data)//2])
+
+    def download(self, server):
+        path = kittykedownload.download_file(server.url + "package.deb", self.sha256, self.store)
+
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+
+        self.assertFalse(os.listdir(os.path.join(self.store, "partial")))
+
+    def test_concurrent(self):
+        with FixtureServer(self.served) as server:
+            paths = []
+            threads = [threading.Thread(target=lambda: paths.append(kittykedownload.download_file(server.url + "package.deb", self.sha256, self.store)))
+                       for n in range(4)]
+
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            # Only one download; the others waited for it and found the file in the store
+            self.assertEqual(len(set(paths)), 1)
+            self.assertEqual(len(paths), 4)
+            self.assertEqual(server.statuses("/package.deb"), [200])
+            self.assertFalse(os.listdir(os.path.join(self.store, "partial")))
+
+    def test_download(self):
+        with FixtureServer(self.served) as server:
+            self.download(server)
+
+            # In the store already; nothing is downloaded again
+            self.download(server)
+            self.assertEqual(server.statuses("/package.deb"), [200])
+
+    def test_resume(self):
+        self.interrupt()
+
+        with FixtureServer(self.served) as server:
+            self.download(server)
+            self.assertEqual(server.statuses("/package.deb"), [206])
+
+    def test_server_ignores_range(self):
+        self.interrupt()
+
+        with FixtureServer(self.served, ranges = False) as server:
+            self.download(server)
+            self.assertEqual(server.statuses("/package.deb"), [200])
+
+    def test_wrong_content_range(self):
+        self.interrupt()
+
+        with FixtureServer(self.served, ranges = 'wrong') as server:
+            self.download(server)
+            self.assertEqual(server.statuses("/package.deb"), [206, 200])
+
+    def test_checksum_mismatch(self):
+        with FixtureServer(self.served) as server:
+            with self.assertRaises(ValueError):
+                kittykedownload.download_file(server.url + "package.deb", "0" * 64, self.store)
+
+        # Only the lock file is left
+        self.assertEqual(os.listdir(os.path.join(self.store, "partial")), ["0" * 64 + ".part.lock"])
+
+    def test_parse_checksums(self):
+        checksums = kittykedownload.parse_checksums("# Checksums-Sha1:\n%s  package.deb\n# Checksums-Sha256:\n%s  package.deb\n" % ("1" * 40, self.sha256))
+        self.assertEqual(checksums, {'package.deb': self.sha256})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+#  kittykernel
+#
+#  Copyright (C) 2017 by Sven Kochmann, available at Github:
+#  <https://www.github.com/Schallaven/kittykernel/>
+#
+#  This program is free software;  you can redistribute it and/or modify
+#  it under the terms of the  GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  This program is  distributed in the hope that it  will be useful, but
+#  WITHOUT  ANY   WARRANTY;  without   even  the  implied   warranty  of
+#  MERCHANTABILITY  or FITNESS FOR  A PARTICULAR  PURPOSE.  See  the GNU
+#  General Public License for more details.
+#
+#  You should  have received  a copy of  the GNU General  Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#  Tests of recognizing the image packages of the kernel families
+#
+
+import unittest
+
+# Makes the modules of kittykernel importable
+import fixtureserver
+
+# Needs python-apt
+try:
+    import kittykecore
+except ImportError:
+    kittykecore = None
+
+
+@unittest.skipIf(kittykecore is None, "python-apt is not installed")
+class KernelMatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.matcher, self.families = kittykecore.get_kernel_matcher()
+
+    def match(self, name):
+        match = self.matcher.match(name)
+        return (self.families[match.group('prefix')], match.group('abi'), match.group('major')) if match else None
+
+    def test_families(self):
+        self.assertEqual(self.match("linux-image-6.8.0-31-generic"), ("generic", "6.8.0-31-generic", "6.8"))
+        self.assertEqual(self.match("linux-image-unsigned-6.8.0-31-lowlatency"), ("unsigned", "6.8.0-31-lowlatency", "6.8"))
+        self.assertEqual(self.match("linux-signed-image-4.4.0-210-generic"), ("signed", "4.4.0-210-generic", "4.4"))
+
+    def test_no_kernels(self):
+        self.assertIsNone(self.match("linux-image-generic"))
+        self.assertIsNone(self.match("linux-image-unsigned-6.8.0-31-generic-dbgsym"))
+        self.assertIsNone(self.match("linux-image-6.8.0-31-generic-dbgsym"))
+        self.assertIsNone(self.match("linux-image-4.4.0-210-generic-dbg"))
+
+
+# Returns a kernel dictionary as returned by kittykecore.get_kernels
+def make_kernel(version, active = False, protected_by = [], dkms_modules = []):
+    return {'package': "linux-image-%s-generic" % version, 'fullname': "linux-image-%s-generic:amd64" % version, 'abi': version + "-generic",
+            'version': version.replace("-", "."), 'version_major': ".".join(version.split(".")[:2]), 'pkg_version': version + ".1",
+            'origins': (), 'installed_size': 0, 'active': active, 'installed': True, 'downloaded': True,
+            'protected_by': protected_by, 'dkms_modules': dkms_modules}
+
+
+@unittest.skipIf(kittykecore is None, "python-apt is not installed")
+class RetentionTest(unittest.TestCase):
+
+    def setUp(self):
+        # DKMS modules were built for every kernel; only the meta-package keeps 6.8.0-31
+        self.kernels = [make_kernel("6.8.0-35", active = True, dkms_modules = ["nvidia/535.154.05"]),
+                        make_kernel("6.8.0-31", protected_by = ["linux-generic"], dkms_modules = ["nvidia/535.154.05"]),
+                        make_kernel("6.8.0-28", dkms_modules = ["nvidia/535.154.05"])]
+
+    def test_dkms_modules(self):
+        rules = {'keep_newest': 1, 'keep_supported': False, 'purge_leftovers': True, 'verb': 'remove'}
+        decision = kittykecore.evaluate_retention_policy(self.kernels, rules, {})
+
+        self.assertEqual([(kernel['package'], reason) for kernel, reason in decision['keep']],
+                         [("linux-image-6.8.0-35-generic", 'active'), ("linux-image-6.8.0-31-generic", 'protected')])
+        self.assertEqual([kernel['package'] for kernel, reason in decision['remove']], ["linux-image-6.8.0-28-generic"])
+
+    def test_boot_cleanup(self):
+        usage = {"6.8.0-35-generic": 100, "6.8.0-31-generic": 100, "6.8.0-28-generic": 100}
+        plan = kittykecore.plan_boot_cleanup(self.kernels, 1000, 0, 'purge', usage, 0)
+
+        self.assertEqual([kernel['package'] for kernel in plan['kernels']], ["linux-image-6.8.0-28-generic"])
+
+
+# Stands in for the APT cache: knows the packages with the given names; as in python-apt, the name of a package has its
+# architecture only if it is a foreign one
+class OperationsCache:
+
+    def __init__(self, names):
+        self.names = names
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __getitem__(self, name):
+        class Package:
+            pass
+
+        package = Package()
+        package.name = name
+        package.shortname = name.split(":")[0]
+
+        return package
+
+
+@unittest.skipIf(kittykecore is None, "python-apt is not installed")
+class KernelOperationsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = kittykecore.cache
+        self.get_cache = kittykecore.get_cache
+        kittykecore.cache = OperationsCache(["linux-image-6.8.0-31-generic", "linux-modules-6.8.0-31-generic",
+                                             "linux-image-6.8.0-31-generic:i386", "linux-modules-6.8.0-31-generic:i386",
+                                             "linux-headers-6.8.0-31-generic:i386"])
+        kittykecore.get_cache = lambda: kittykecore.cache
+
+    def tearDown(self):
+        kittykecore.cache = self.cache
+        kittykecore.get_cache = self.get_cache
+
+    def test_native(self):
+        self.assertEqual(kittykecore.get_kernel_operations(["linux-image-6.8.0-31-generic"], 'remove'),
+                         [('remove', "linux-image-6.8.0-31-generic"), ('remove', "linux-modules-6.8.0-31-generic")])
+
+    def test_foreign_architecture(self):
+        # The native packages must not be touched
+        self.assertEqual(kittykecore.get_kernel_operations(["linux-image-6.8.0-31-generic:i386"], 'purge'),
+                         [('purge', "linux-image-6.8.0-31-generic:i386"), ('purge', "linux-modules-6.8.0-31-generic:i386"),
+                          ('purge', "linux-headers-6.8.0-31-generic:i386")])
+
+    def test_package_names(self):
+        kernel = make_kernel("6.8.0-31")
+        kernel['package'] = "linux-image-6.8.0-31-generic:i386"
+
+        self.assertEqual(kittykecore.get_kernel_package_names(kernel)[:3], ["linux-image-6.8.0-31-generic:i386", "linux-modules-6.8.0-31-generic:i386",
+                                                                            "linux-headers-6.8.0-31-generic:i386"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#  kittykernel
+#
+#  Copyright (C) 2017 by Sven Kochmann, available at Github:
+#  <https://www.github.com/Schallaven/kittykernel/>
+#
+#  This program is free software;  you can redistribute it and/or modify
+#  it under the terms of the  GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  This program is  distributed in the hope that it  will be useful, but
+#  WITHOUT  ANY   WARRANTY;  without   even  the  implied   warranty  of
+#  MERCHANTABILITY  or FITNESS FOR  A PARTICULAR  PURPOSE.  See  the GNU
+#  General Public License for more details.
+#
+#  You should  have received  a copy of  the GNU General  Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#  Tests of the mainline archive listing parser and the conditional
+#  refetch against a fixture tree (tests/fixtures/mainline)
+#
+
+import os
+import tempfile
+import unittest
+
+from fixtureserver import FixtureServer, fixtures
+
+# Needs python-apt (kittykecore)
+try:
+    import kittykemainline
+except ImportError:
+    kittykemainline = None
+
+
+mainline = os.path.join(fixtures, "mainline")
+
+
+@unittest.skipIf(kittykemainline is None, "python-apt is not installed")
+class ListingParserTest(unittest.TestCase):
+
+    # Feeds a fixture page in small parts, as it comes in from the network
+    def parse(self, path, size = 7):
+        with open(os.path.join(mainline, path), "r") as f:
+            page = f.read()
+
+        parser = kittykemainline.ListingParser()
+        for start in range(0, len(page), size):
+            parser.feed(page[start:start+size])
+        parser.close()
+
+        return {entry['name']: entry for entry in parser.entries}
+
+    def test_apache_listing(self):
+        entries = self.parse("index.html")
+
+        self.assertEqual(sorted(entries), ["daily/", "v6.5/", "v6.6-rc1/"])
+        self.assertEqual(entries["v6.5/"]['date'], "2023-08-28 01:02")
+
+    def test_nginx_listing(self):
+        entries = self.parse(os.path.join("v6.5", "amd64", "index.html"))
+
+        self.assertEqual(entries["CHECKSUMS"]['size'], int(1.2 * 1024))
+        self.assertEqual(entries["linux-modules-6.5.0-060500-generic_6.5.0-060500.202308271831_amd64.deb"]['size'], 105 * 1024**2)
+        self.assertEqual(entries["linux-modules-6.5.0-060500-generic_6.5.0-060500.202308271831_amd64.deb"]['date'], "28-Aug-2023 01:02")
+
+
+@unittest.skipIf(kittykemainline is None, "python-apt is not installed")
+class ConditionalFetchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.index_file = kittykemainline.index_file
+        kittykemainline.index_file = os.path.join(self.directory.name, "mainline.json")
+
+    def tearDown(self):
+        kittykemainline.index_file = self.index_file
+        self.directory.cleanup()
+
+    def test_etag(self):
+        with FixtureServer(mainline) as server:
+            listing = kittykemainline.fetch_listing(server.url)
+            self.assertTrue(listing['etag'])
+
+            self.assertIs(kittykemainline.fetch_listing(server.url, listing), listing)
+            self.assertEqual(server.statuses("/"), [200, 304])
+
+    def test_if_modified_since(self):
+        with FixtureServer(mainline) as server:
+            listing = kittykemainline.fetch_listing(server.url)
+            listing['etag'] = ''
+
+            self.assertIs(kittykemainline.fetch_listing(server.url, listing), listing)
+            self.assertEqual(server.statuses("/"), [200, 304])
+
+    def test_update_index(self):
+        with FixtureServer(mainline) as server:
+            index = kittykemainline.update_index(server.url, architecture = "amd64")
+
+            self.assertEqual(sorted(index['versions']), ["v6.5/", "v6.6-rc1/"])
+            self.assertEqual(len(index['versions']["v6.5/"]['files']), 4)
+            self.assertEqual(index['versions']["v6.5/"]['checksums'], server.url + "v6.5/amd64/CHECKSUMS")
+
+            # Nothing changed: only the main listing is revalidated
+            del server.requests[:]
+            kittykemainline.update_index(server.url, architecture = "amd64")
+
+            self.assertEqual(server.requests, [("/", 304)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+#  kittykernel
+#
+#  Copyright (C) 2017 by Sven Kochmann, available at Github:
+#  <https://www.github.com/Schallaven/kittykernel/>
+#
+#  This program is free software;  you can redistribute it and/or modify
+#  it under the terms of the  GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  This program is  distributed in the hope that it  will be useful, but
+#  WITHOUT  ANY   WARRANTY;  without   even  the  implied   warranty  of
+#  MERCHANTABILITY  or FITNESS FOR  A PARTICULAR  PURPOSE.  See  the GNU
+#  General Public License for more details.
+#
+#  You should  have received  a copy of  the GNU General  Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#  Tests of the OVAL parser against a fixture file (tests/fixtures/oval)
+#
+
+import os
+import tempfile
+import unittest
+
+from fixtureserver import fixtures
+
+# Needs python-apt (kittykecore)
+try:
+    import kittykeoval
+except ImportError:
+    kittykeoval = None
+
+
+@unittest.skipIf(kittykeoval is None, "python-apt is not installed")
+class ParseOvalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fixes = kittykeoval.parse_oval(os.path.join(fixtures, "oval", "kernels.xml"))
+
+    def test_name(self):
+        self.assertEqual(self.fixes["linux"], {"CVE-2023-0001": "5.4.0-150.167"})
+
+    def test_constant_variable(self):
+        self.assertEqual(self.fixes["linux-image-5.4.0-150-generic"], {"CVE-2023-0002": "5.4.0-151.168"})
+        self.assertEqual(self.fixes["linux-image-5.4.0-150-lowlatency"], {"CVE-2023-0002": "5.4.0-151.168"})
+        self.assertNotIn("firmware-sof-signed", self.fixes)
+
+    def test_skipped_objects(self):
+        self.assertEqual(kittykeoval.skipped_objects, 1)
+
+
+@unittest.skipIf(kittykeoval is None, "python-apt is not installed")
+class CountUnfixedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.index_file = kittykeoval.index_file
+        kittykeoval.index_file = os.path.join(self.directory.name, "oval.json")
+        kittykeoval.import_oval(os.path.join(fixtures, "oval", "kernels.xml"))
+        self.index = kittykeoval.load_index()
+
+    def tearDown(self):
+        kittykeoval.index_file = self.index_file
+        self.directory.cleanup()
+
+    def kernel(self, source, flavour, pkg_version):
+        return {'source': source, 'package': "linux-image-5.4.0-150-" + flavour, 'abi': "5.4.0-150-" + flavour, 'pkg_version': pkg_version}
+
+    def test_source_and_binary(self):
+        # CVE-2023-0001 (source linux) is fixed in this version, CVE-2023-0002 (binary packages) is not
+        self.assertEqual(kittykeoval.count_unfixed(self.index, self.kernel("linux", "generic", "5.4.0-150.167")), 1)
+        self.assertEqual(kittykeoval.count_unfixed(self.index, self.kernel("linux", "generic", "5.4.0-149.166")), 2)
+        self.assertEqual(kittykeoval.count_unfixed(self.index, self.kernel("linux", "generic", "5.4.0-151.168")), 0)
+
+    def test_binary_only(self):
+        # Only the binary package is listed for the source package linux-lowlatency
+        self.assertEqual(kittykeoval.count_unfixed(self.index, self.kernel("linux-lowlatency", "lowlatency", "5.4.0-150.167")), 1)
+
+    def test_unknown(self):
+        self.assertIsNone(kittykeoval.count_unfixed(self.index, self.kernel("linux-azure", "azure", "5.4.0-150.167")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+#  kittykernel
+#
+#  Copyright (C) 2017 by Sven Kochmann, available at Github:
+#  <https://www.github.com/Schallaven/kittykernel/>
+#
+#  This program is free software;  you can redistribute it and/or modify
+#  it under the terms of the  GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  This program is  distributed in the hope that it  will be useful, but
+#  WITHOUT  ANY   WARRANTY;  without   even  the  implied   warranty  of
+#  MERCHANTABILITY  or FITNESS FOR  A PARTICULAR  PURPOSE.  See  the GNU
+#  General Public License for more details.
+#
+#  You should  have received  a copy of  the GNU General  Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#  Tests of choosing the kernels to prefetch and of the limits of
+#  prefetching (with a cache standing in for the APT cache)
+#
+
+import contextlib
+import tempfile
+import unittest
+
+# Makes the modules of kittykernel importable
+import fixtureserver
+
+# Needs python-apt
+try:
+    import apt
+    import apt_pkg
+    import kittykecore
+    import kittykeprefetch
+except ImportError:
+    kittykeprefetch = None
+
+
+# Returns a kernel dictionary as returned by kittykecore.get_kernels
+def make_kernel(version, installed = False, mainline = False):
+    return {'package': "linux-image-%s-generic" % version, 'fullname': "linux-image-%s-generic:amd64" % version, 'version': version.replace("-", "."),
+            'version_major': ".".join(version.split(".")[:2]), 'pkg_version': version + ".1", 'origins': (("Ubuntu", "jammy-updates", "archive.ubuntu.com", True),),
+            'installed': installed, 'downloaded': False, 'mainline': mainline}
+
+
+# Stands in for the APT cache: each kernel package needs the given number of bytes; fetch_archives records the packages
+# marked when it was called
+class PrefetchCache:
+
+    def __init__(self, sizes):
+        self.sizes = sizes
+        self.marked = []
+        self.fetched = []
+        self.error = None
+
+    def __getitem__(self, name):
+        cache = self
+
+        class Package:
+            def mark_install(self):
+                cache.marked.append(name)
+
+        return Package()
+
+    def actiongroup(self):
+        return contextlib.nullcontext()
+
+    @property
+    def required_download(self):
+        return sum([self.sizes[name] for name in self.marked])
+
+    def fetch_archives(self):
+        if self.error is not None:
+            raise self.error
+
+        self.fetched.append(list(self.marked))
+
+    def clear(self):
+        self.marked = []
+
+
+@unittest.skipIf(kittykeprefetch is None, "python-apt is not installed")
+class PrefetchKernelsTest(unittest.TestCase):
+
+    def test_choice(self):
+        kernels = [make_kernel("6.5.0-20"), make_kernel("6.5.0-21"), make_kernel("6.2.0-39"), make_kernel("5.19.0-50"),
+                   make_kernel("6.8.0-31", installed = True), make_kernel("6.9.0-060900", mainline = True)]
+        support_times = {("Ubuntu", "6.5"): 6, ("Ubuntu", "5.19"): -3, ("Ubuntu", "6.8"): 30}
+
+        # 6.2 has no support info and is prefetched as well; 5.19 is expired and 6.8 installed already
+        chosen = kittykeprefetch.get_prefetch_kernels(kernels, support_times)
+
+        self.assertEqual([kernel['package'] for kernel in chosen], ["linux-image-6.5.0-21-generic", "linux-image-6.2.0-39-generic"])
+
+    def setUp(self):
+        self.get_cache = kittykecore.get_cache
+        self.get_kernel_operations = kittykecore.get_kernel_operations
+        kittykecore.get_kernel_operations = lambda fullnames, verb: [('install', name) for name in fullnames]
+
+    def tearDown(self):
+        kittykecore.get_cache = self.get_cache
+        kittykecore.get_kernel_operations = self.get_kernel_operations
+
+    def test_limits(self):
+        kernels = [make_kernel("6.5.0-21"), make_kernel("6.2.0-39"), make_kernel("6.1.0-10")]
+        cache = PrefetchCache({kernels[0]['fullname']: 300, kernels[1]['fullname']: 800, kernels[2]['fullname']: 0})
+        kittykecore.get_cache = lambda: cache
+
+        with tempfile.TemporaryDirectory() as archives:
+            fetched, skipped, error = kittykeprefetch.prefetch_kernels(kernels, archives, rate = 2048, maxsize = 1000, reserve = 0)
+
+            # The archive directory and the bandwidth are only set during the download
+            self.assertNotEqual(apt_pkg.config.find("Dir::Cache::Archives"), archives)
+            self.assertNotEqual(apt_pkg.config.find("Acquire::http::Dl-Limit"), "2")
+
+        self.assertIsNone(error)
+        self.assertEqual([(kernel['package'], size) for kernel, size in fetched], [("linux-image-6.5.0-21-generic", 300)])
+        self.assertEqual([(kernel['package'], reason) for kernel, reason in skipped], [("linux-image-6.2.0-39-generic", "size limit")])
+        self.assertEqual(cache.fetched, [[kernels[0]['fullname']]])
+        self.assertEqual(cache.marked, [])
+
+    def test_locked(self):
+        kernels = [make_kernel("6.5.0-21"), make_kernel("6.2.0-39")]
+        cache = PrefetchCache({kernels[0]['fullname']: 300, kernels[1]['fullname']: 800})
+        cache.error = apt.cache.LockFailedException("Failed to lock the download directory")
+        kittykecore.get_cache = lambda: cache
+
+        with tempfile.TemporaryDirectory() as archives:
+            fetched, skipped, error = kittykeprefetch.prefetch_kernels(kernels, archives, reserve = 0)
+
+        # The remaining kernels are not tried anymore
+        self.assertEqual(error, "Failed to lock the download directory")
+        self.assertEqual(fetched, [])
+        self.assertEqual([reason for kernel, reason in skipped], ["APT failed", "APT failed"])
+        self.assertEqual(cache.marked, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+#  kittykernel
+#
+#  Copyright (C) 2017 by Sven Kochmann, available at Github:
+#  <https://www.github.com/Schallaven/kittykernel/>
+#
+#  This program is free software;  you can redistribute it and/or modify
+#  it under the terms of the  GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  This program is  distributed in the hope that it  will be useful, but
+#  WITHOUT  ANY   WARRANTY;  without   even  the  implied   warranty  of
+#  MERCHANTABILITY  or FITNESS FOR  A PARTICULAR  PURPOSE.  See  the GNU
+#  General Public License for more details.
+#
+#  You should  have received  a copy of  the GNU General  Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#  Tests of scanning alternate root directories (chroots, mounted disks)
+#
+
+import os
+import tempfile
+import unittest
+
+# Makes the modules of kittykernel importable
+import fixtureserver
+
+# Needs python-apt
+try:
+    import kittykecore
+except ImportError:
+    kittykecore = None
+
+
+@unittest.skipIf(kittykecore is None, "python-apt is not installed")
+class RootTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = self.directory.name
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_default_kernel_boot(self):
+        os.mkdir(os.path.join(self.root, "boot"))
+        os.symlink("vmlinuz-6.8.0-31-generic", os.path.join(self.root, "boot", "vmlinuz"))
+
+        self.assertEqual(kittykecore.get_default_kernel(self.root), "6.8.0-31-generic")
+
+    def test_default_kernel_root_link(self):
+        os.symlink("boot/vmlinuz-4.4.0-21-generic", os.path.join(self.root, "vmlinuz"))
+
+        self.assertEqual(kittykecore.get_default_kernel(self.root), "4.4.0-21-generic")
+
+    def test_default_kernel_unknown(self):
+        self.assertEqual(kittykecore.get_default_kernel(self.root), "unknown")
+
+    def test_dkms_kernels(self):
+        dkms = os.path.join(self.root, "var", "lib", "dkms")
+        os.makedirs(os.path.join(dkms, "nvidia", "535.154.05", "6.5.0-21-generic", "x86_64", "module"))
+        os.makedirs(os.path.join(dkms, "nvidia", "535.154.05", "build"))
+        os.makedirs(os.path.join(dkms, "zfs", "2.2.2", "6.5.0-21-generic", "x86_64"))
+        os.makedirs(os.path.join(dkms, "zfs", "2.2.2", "6.2.0-39-generic", "x86_64"))
+        os.symlink("/usr/src/zfs-2.2.2", os.path.join(dkms, "zfs", "2.2.2", "source"))
+        os.symlink("2.2.2/6.2.0-39-generic/x86_64", os.path.join(dkms, "zfs", "kernel-6.2.0-39-generic-x86_64"))
+
+        self.assertEqual(kittykecore.get_dkms_kernels(self.root), {"6.5.0-21-generic": {"nvidia/535.154.05", "zfs/2.2.2"},
+                                                                   "6.2.0-39-generic": {"zfs/2.2.2"}})
+
+    def test_missing_root(self):
+        missing = os.path.join(self.root, "missing")
+        scans = list(kittykecore.scan_roots([self.root, missing], 2))
+
+        self.assertEqual(sorted([scan['root'] for scan in scans]), sorted([self.root, missing]))
+        self.assertTrue(all('error' in scan for scan in scans))
+
+        # Nothing was created in the roots
+        self.assertEqual(os.listdir(self.root), [])
+        self.assertFalse(os.path.exists(missing))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#  kittykernel
+#
+#  Copyright (C) 2017 by Sven Kochmann, available at Github:
+#  <https://www.github.com/Schallaven/kittykernel/>
+#
+#  This program is free software;  you can redistribute it and/or modify
+#  it under the terms of the  GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  This program is  distributed in the hope that it  will be useful, but
+#  WITHOUT  ANY   WARRANTY;  without   even  the  implied   warranty  of
+#  MERCHANTABILITY  or FITNESS FOR  A PARTICULAR  PURPOSE.  See  the GNU
+#  General Public License for more details.
+#
+#  You should  have received  a copy of  the GNU General  Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#  Tests of exporting snapshots and summarizing them for a fleet
+#
+
+import os
+import tempfile
+import unittest
+
+# Makes the modules of kittykernel importable
+import fixtureserver
+
+# Needs python-apt
+try:
+    import kittykesnapshot
+except ImportError:
+    kittykesnapshot = None
+
+
+# Returns a kernel dictionary as returned by kittykecore.get_kernels
+def make_kernel(version, active = False, protected_by = []):
+    return {'package': "linux-image-%s-generic" % version, 'fullname': "linux-image-%s-generic:amd64" % version, 'abi': version + "-generic",
+            'version': version.replace("-", "."), 'version_major': ".".join(version.split(".")[:2]), 'pkg_version': version + ".1",
+            'origins': (), 'installed_size': 0, 'active': active, 'installed': True, 'downloaded': True, 'protected_by': protected_by}
+
+
+@unittest.skipIf(kittykesnapshot is None, "python-apt is not installed")
+class SnapshotTest(unittest.TestCase):
+
+    def test_reclaimable(self):
+        kernels = [make_kernel("6.8.0-35", active = True), make_kernel("6.8.0-31", protected_by = ["linux-generic"]), make_kernel("6.8.0-28"),
+                   make_kernel("6.8.0-20")]
+        usage = {"6.8.0-35-generic": 1000, "6.8.0-31-generic": 200, "6.8.0-28-generic": 30, "6.8.0-20-generic": 4}
+        rules = {'keep_newest': 1, 'keep_supported': False, 'purge_leftovers': True, 'verb': 'remove'}
+
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, "host.jsonl"), "w") as f:
+                kittykesnapshot.export_snapshot(f, kernels, (0, 0), usage, {}, "host", rules)
+
+            fleet = kittykesnapshot.aggregate_snapshots(directory)
+
+        # Neither the active nor the protected kernel count
+        self.assertEqual(fleet['hosts'], 1)
+        self.assertEqual(fleet['reclaimable'], 34)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+#!/usr/bin/python3
+
+#  kittykernel
+#
+#  Copyright (C) 2017 by Sven Kochmann, available at Github:
+#  <https://www.github.com/Schallaven/kittykernel/>
+#
+#  This program is free software;  you can redistribute it and/or modify
+#  it under the terms of the  GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  This program is  distributed in the hope that it  will be useful, but
+#  WITHOUT  ANY   WARRANTY;  without   even  the  implied   warranty  of
+#  MERCHANTABILITY  or FITNESS FOR  A PARTICULAR  PURPOSE.  See  the GNU
+#  General Public License for more details.
+#
+#  You should  have received  a copy of  the GNU General  Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#  Index of the kernel changelogs: CVE IDs, Launchpad bug numbers, and
+#  keywords are mapped to the first version of each source package that
+#  mentions them, so that the kernels fixing a CVE are found without
+#  reading the changelogs again
+#
+#
+#  Warning: Don't read this  source file if  you are annoyed by too many
+#           comments. Read source code  of other FOSS projects  instead.
+#
+
+import os
+import sys
+import re
+import json
+import tempfile
+import apt_pkg
+
+import kittykecore
+
+
+# Path of the index on disk
+index_file = os.path.expanduser("~/.cache/kittykernel/changelog-index.json")
+
+# Version of the index format; an index with a different version is built again
+index_version = 1
+
+# Header line of a changelog entry, e.g. "linux (4.15.0-112.113) bionic; urgency=medium"
+entry_header = re.compile(r"^(\S+) \(([^)]+)\) [^;]*;", re.MULTILINE)
+
+# Terms found in the changelogs: CVE IDs, Launchpad bugs ("LP: #1234567", also several in one: "LP: #1, #2"), and words
+cve_term = re.compile(r"\bCVE-(\d{4})-(\d{4,})\b", re.IGNORECASE)
+lp_term = re.compile(r"\bLP:\s*((?:#\d+(?:,\s*)?)+)", re.IGNORECASE)
+lp_number = re.compile(r"#(\d+)")
+word_term = re.compile(r"\b[a-z][a-z0-9_]{3,31}\b")
+
+# Search terms given by the user, e.g. "cve-2020-1234", "LP: #1234567", "lp#1234567", or "LP:1234567"
+query_cve = re.compile(r"^\s*CVE-(\d{4})-(\d{4,})\s*$", re.IGNORECASE)
+query_lp = re.compile(r"^\s*LP:?\s*#?(\d+)\s*$", re.IGNORECASE)
+
+
+# Loads the index from disk; returns an empty index if there is none (or it is of another version). The index has the
+# entries (versions) already indexed per source package and the terms, each mapped to {source: first version}.
+def load_index():
+    try:
+        with open(index_file, "r") as f:
+            index = json.load(f)
+
+        if index.get('version') == index_version:
+            return index
+
+    except Exception as e:
+        if kittykecore.debugmode:
+            print (e)
+
+    return {'version': index_version, 'entries': {}, 'terms': {}}
+
+# Saves the index to disk
+def save_index(index):
+    os.makedirs(os.path.dirname(index_file), exist_ok=True)
+
+    # Write to temporary file first, so that an interrupted write does not destroy the index; each writer (e.g. the GUI
+    # and kittykecli fixes --update at the same time) has its own temporary file
+    with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(index_file), prefix=os.path.basename(index_file) + ".", suffix=".tmp", delete=False) as f:
+        try:
+            json.dump(index, f, separators=(',', ':'))
+        except Exception:
+            os.remove(f.name)
+            raise
+
+    os.replace(f.name, index_file)
+
+
+# Returns the set of terms of the text of a changelog entry: CVE IDs ("CVE-2020-1234"), Launchpad bugs ("LP:1234567"),
+# and lower-case words
+def get_terms(text):
+    terms = set(["CVE-%s-%s" % match for match in cve_term.findall(text)])
+
+    for bugs in lp_term.findall(text):
+        terms |= set(["LP:" + number for number in lp_number.findall(bugs)])
+
+    terms |= set(word_term.findall(text.lower()))
+
+    return terms
+
+# Turns a search given by the user into a term of the index, e.g. "lp #123" into "LP:123"; words are just lower-cased.
+# Returns None for searches with more than one word.
+def normalize_term(query):
+    match = query_cve.match(query)
+    if match:
+        return "CVE-%s-%s" % match.groups()
+
+    match = query_lp.match(query)
+    if match:
+        return "LP:" + match.group(1)
+
+    if len(query.split()) != 1:
+        return None
+
+    return query.strip().lower()
+
+# Returns True if the search is a CVE ID or a Launchpad bug, i.e. it should be looked up in the changelog index
+def is_bug_query(query):
+    return query_cve.match(query) is not None or query_lp.match(query) is not None
+
+
+# Adds a changelog of the given source package to the index and returns the number of new entries. The entries are
+# newest first, so reading stops at the first entry already indexed; i.e. only the new part of a changelog is read.
+def index_changelog(index, source, changelog):
+    known = set(index['entries'].get(source, []))
+    added = []
+
+    headers = list(entry_header.finditer(changelog))
+
+    for number, header in enumerate(headers):
+        version = header.group(2)
+
+        if version in known:
+            break
+
+        # Text of the entry is everything up to the next header
+        end = headers[number+1].start() if number+1 < len(headers) else len(changelog)
+
+        for term in get_terms(changelog[header.end():end]):
+            sources = index['terms'].setdefault(term, {})
+
+            # Keep the first version mentioning the term; older entries come later in the changelog
+            if source not in sources or apt_pkg.version_compare(version, sources[source]) < 0:
+                sources[source] = version
+
+        added.append(version)
+
+    index['entries'][source] = index['entries'].get(source, []) + added
+
+    return len(added)
+
+# Adds the changelog of a kernel to the index on disk (if it has new entries); returns the number of new entries. If an
+# index is given (e.g. kept in memory by the GUI), it is updated and saved instead of the one loaded from disk.
+def update_index(kernel, changelog, index = None):
+    if not kernel.get('source') or not changelog:
+        return 0
+
+    try:
+        if index is None:
+            index = load_index()
+
+        added = index_changelog(index, kernel['source'], changelog)
+
+        if added > 0:
+            save_index(index)
+
+        return added
+
+    except Exception as e:
+        if kittykecore.debugmode:
+            print (e)
+        return 0
+
+# Returns the newest kernel (by package version) of each source package; the changelog of this kernel contains those of
+# all older kernels of the source package
+def get_newest_kernels(kernels):
+    newest = {}
+
+    for kernel in kernels:
+        if kernel.get('source') and kernel['pkg_version'] and (kernel['source'] not in newest or apt_pkg.version_compare(kernel['pkg_version'], newest[kernel['source']]['pkg_version']) > 0):
+            newest[kernel['source']] = kernel
+
+    return list(newest.values())
+
+# Returns the kernels of the list which contain the fix (or change) the term stands for, i.e. whose package version is
+# at least the first version of their source package that mentions the term
+def find_kernels(index, kernels, term):
+    sources = index['terms'].get(term, {})
+
+    return [kernel for kernel in kernels if kernel.get('source') in sources and kernel['pkg_version'] and
+            apt_pkg.version_compare(kernel['pkg_version'], sources[kernel['source']]) >= 0]
+
+
+# Script file is run directly... then let's have some test outputs here; a changelog file and a term can be given
+if __name__ == '__main__':
+    print("Script was called directly. Testing...")
+
+    kittykecore.debugmode = True
+
+    index = {'version': index_version, 'entries': {}, 'terms': {}}
+
+    with open(sys.argv[1], "r") as f:
+        print("New entries: ", index_changelog(index, "linux", f.read()))
+
+    print("Terms: ", len(index['terms']))
+
+    if len(sys.argv) > 2:
+        print(normalize_term(sys.argv[2]), index['terms'].get(normalize_term(sys.argv[2])))
@@ -0,0 +1,461 @@
+#!/usr/bin/python3
+
+#  kittykernel
+#
+#  Copyright (C) 2017 by Sven Kochmann, available at Github:
+#  <https://www.github.com/Schallaven/kittykernel/>
+#
+#  This program is free software;  you can redistribute it and/or modify
+#  it under the terms of the  GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  This program is  distributed in the hope that it  will be useful, but
+#  WITHOUT  ANY   WARRANTY;  without   even  the  implied   warranty  of
+#  MERCHANTABILITY  or FITNESS FOR  A PARTICULAR  PURPOSE.  See  the GNU
+#  General Public License for more details.
+#
+#  You should  have received  a copy of  the GNU General  Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#  Command line interface of kittykernel, e.g. for listing kernels without
+#  the GUI
+#
+#
+#  Warning: Don't read this  source file if  you are annoyed by too many
+#           comments. Read source code  of other FOSS projects  instead.
+#
+
+import os
+import sys
+import gettext
+import argparse
+
+import kittykecore
+import kittykesnapshot
+import kittykechangelog
+import kittykeoval
+import kittykeprefetch
+
+_ = gettext.gettext
+
+
+# Returns the flags of a kernel as short string, e.g. "active, installed"
+def kernel_flags(kernel):
+    flags = [flag for flag in ['active', 'installed', 'downloaded'] if kernel[flag]]
+
+    if kernel['installed'] and kernel.get('protected_by'):
+        flags.append(_("needed by %s") % " ".join(kernel['protected_by']))
+
+    if kernel['installed'] and kernel.get('dkms_modules'):
+        flags.append(_("DKMS modules %s") % " ".join(kernel['dkms_modules']))
+
+    return ", ".join(flags)
+
+
+# Returns a progress function for transactions waiting for the dpkg lock (see kittykecore.wait_for_dpkg_lock); it tells
+# once per process holding the lock that the transaction waits
+def lock_progress():
+    holders = []
+
+    def progress(waited, timeout, holder):
+        if holder not in holders:
+            holders.append(holder)
+            print(_("Waiting for %s to release the dpkg lock (at most %d s)...") % (holder, timeout), flush=True)
+        return True
+
+    return progress
+
+# Prints the time needed for each phase of a transaction (see kittykecore.perform_deferred), if there was one
+def print_timings(timings):
+    if timings:
+        print(_("Transaction: %.1f s, initramfs: %.1f s, GRUB: %.1f s") % (timings['transaction'], timings['initramfs'], timings['grub']))
+
+
+# Lists all kernels (with blacklist applied) including their /boot footprint; with --arch, the kernels of a foreign
+# architecture (e.g. i386 on a multi-arch amd64 system) are listed instead
+def command_list(args):
+    if args.arch is not None:
+        native, foreign = kittykecore.get_architectures()
+
+        if args.arch not in [native] + foreign:
+            print(_("Unknown architecture %s (known: %s).") % (args.arch, " ".join([native] + foreign)))
+            return 1
+
+        kernels = kittykecore.get_kernels(architecture = args.arch)
+    else:
+        kernels = kittykecore.load_kernels()
+
+    if not args.all:
+        kernels = kittykecore.apply_blacklist(kernels, kittykecore.load_blacklist())
+
+    usage = kittykecore.get_boot_usage()
+
+    for kernel in kernels:
+        print("%-45s %-20s %10s  %s" % (kernel['package'], kernel['pkg_version'], kittykecore.sizeof_fmt(kittykecore.get_kernel_boot_size(usage, kernel)), kernel_flags(kernel)))
+
+    return 0
+
+
+# Shows the size of /boot and the kernel files in it; kernels, which could be removed, are ranked by the bytes freed
+def command_boot(args):
+    sizeofboot = kittykecore.sizeof_boot()
+    usage = kittykecore.get_boot_usage()
+
+    print(_("/boot: %s of %s free.") % (kittykecore.sizeof_fmt(sizeofboot[0]), kittykecore.sizeof_fmt(sizeofboot[1])))
+    print()
+
+    # Files per ABI version, largest first
+    for abi in sorted(usage, key=lambda abi: usage[abi], reverse=True):
+        print("%-40s %10s" % (abi, kittykecore.sizeof_fmt(usage[abi])))
+
+    # Cleanup candidates
+    candidates = kittykecore.rank_kernels_by_boot_usage(kittykecore.load_kernels(), usage)
+
+    if len(candidates) > 0:
+        print()
+        print(_("Removing these kernels would free space on /boot:"))
+
+        for kernel in candidates:
+            print("%-45s %10s" % (kernel['package'], kittykecore.sizeof_fmt(kittykecore.get_kernel_boot_size(usage, kernel))))
+
+    return 0
+
+
+# Shows which kernels would have to be removed or purged to reach the given amount of free space on /boot
+def command_plan(args):
+    config = kittykecore.load_config()
+
+    # Values from config file, if not given
+    bootfree = args.free if args.free is not None else int(config['Cleanup']['bootfree'])
+    keep = args.keep if args.keep is not None else int(config['Cleanup']['keeppergroup'])
+
+    kernels = kittykecore.apply_blacklist(kittykecore.load_kernels(), kittykecore.load_blacklist())
+    plan = kittykecore.plan_boot_cleanup(kernels, bootfree, keep, args.verb)
+
+    for kernel in plan['kernels']:
+        print("%s %s" % (args.verb, kernel['package']))
+
+    print(_("Frees %s on /boot; %s free afterwards.") % (kittykecore.sizeof_fmt(plan['freed']), kittykecore.sizeof_fmt(plan['free_after'])))
+
+    # Return an error if the target cannot be reached
+    if not plan['sufficient']:
+        print(_("Not enough kernels can be removed to free %s on /boot.") % kittykecore.sizeof_fmt(bootfree))
+        return 1
+
+    return 0
+
+
+# Applies the retention policy from the config file, e.g. from a systemd timer; only shows what would happen in dry-run mode
+def command_cleanup(args):
+    rules = kittykecore.get_retention_rules(kittykecore.load_config())
+
+    kernels = kittykecore.apply_blacklist(kittykecore.load_kernels(), kittykecore.load_blacklist())
+    decision, result = kittykecore.apply_retention_policy(kernels, rules, args.dry_run, progress = lock_progress())
+
+    for verb in ['keep', 'remove', 'purge']:
+        for kernel, reason in decision[verb]:
+            print("%-7s %-45s (%s)" % (verb, kernel['package'], reason))
+
+    if result == kittykecore.transaction_locked:
+        print(_("Cleanup failed: the dpkg lock did not become free."))
+        return 1
+
+    if result != 0:
+        print(_("Cleanup failed (error code %d).") % result)
+        return 1
+
+    print_timings(kittykecore.transaction_timings)
+
+    return 0
+
+
+# Scans alternate root directories (chroots, mounted disks of VMs, ...) and lists their kernels
+def command_scan(args):
+    result = 0
+
+    for scan in kittykecore.scan_roots(args.roots, args.jobs):
+        print("%s:" % scan['root'])
+
+        if 'error' in scan:
+            print("    " + _("Scan failed: %s") % scan['error'])
+            result = 1
+            continue
+
+        print("    " + _("/boot: %s of %s free.") % (kittykecore.sizeof_fmt(scan['boot'][0]), kittykecore.sizeof_fmt(scan['boot'][1])))
+
+        for kernel in scan['kernels']:
+            print("    %-45s %-20s %10s  %s" % (kernel['package'], kernel['pkg_version'], kittykecore.sizeof_fmt(kittykecore.get_kernel_boot_size(scan['boot_usage'], kernel)), kernel_flags(kernel)))
+
+    return result
+
+
+# Exports a snapshot of the kernels of this system (JSON Lines) to a file or stdout
+def command_export(args):
+    kernels = kittykecore.apply_blacklist(kittykecore.load_kernels(), kittykecore.load_blacklist())
+    boot = kittykecore.sizeof_boot()
+    usage = kittykecore.get_boot_usage()
+    support_times = kittykecore.get_kernel_support_times()
+
+    if args.output == "-":
+        kittykesnapshot.export_snapshot(sys.stdout, kernels, boot, usage, support_times)
+    else:
+        # Write to temporary file first, so that collectors never see half a snapshot
+        with open(args.output + ".tmp", "w") as f:
+            kittykesnapshot.export_snapshot(f, kernels, boot, usage, support_times)
+        os.replace(args.output + ".tmp", args.output)
+
+    return 0
+
+
+# Aggregates the snapshots of many systems in a directory
+def command_fleet(args):
+    # List the hosts whose active kernel is not supported anymore
+    if args.expired:
+        for summary in kittykesnapshot.summarize_snapshots(args.directory):
+            if 'error' not in summary and summary['support'] is not None and summary['support'] < 0:
+                print("%-40s %-45s %s" % (summary['host'], summary['active'], _("support expired %d month(s) ago") % -summary['support']))
+        return 0
+
+    fleet = kittykesnapshot.aggregate_snapshots(args.directory)
+
+    print(_("Hosts: %d") % fleet['hosts'])
+    print(_("Hosts with expired support: %d") % fleet['expired'])
+    print(_("Reclaimable in /boot: %s") % kittykecore.sizeof_fmt(fleet['reclaimable']))
+
+    if fleet['errors'] > 0:
+        print(_("Unreadable snapshots: %d") % fleet['errors'])
+
+    return 0
+
+
+# Lists the kernels whose changelog mentions a CVE ID, a bug (e.g. "LP: #1234567"), or a keyword, i.e. the kernels having
+# the fix; only changelogs read before are searched unless --update is given
+def command_fixes(args):
+    term = kittykechangelog.normalize_term(args.term)
+
+    if term is None:
+        print(_("Only one word can be searched."))
+        return 2
+
+    kernels = kittykecore.apply_blacklist(kittykecore.load_kernels(), kittykecore.load_blacklist())
+    index = kittykechangelog.load_index()
+
+    # The changelog of the newest kernel of each source package contains those of all older ones
+    if args.update:
+        for kernel in kittykechangelog.get_newest_kernels(kernels):
+            kittykechangelog.update_index(kernel, kittykecore.load_kernel_changelog(kernel['fullname']), index)
+
+    fixed = kittykechangelog.find_kernels(index, kernels, term)
+
+    for kernel in fixed:
+        print("%-45s %-20s %s" % (kernel['package'], kernel['pkg_version'], kernel_flags(kernel)))
+
+    # Return an error if no kernel has the fix
+    return 0 if len(fixed) > 0 else 1
+
+
+# Imports Ubuntu CVE OVAL data (if a file is given) and lists the number of CVEs not fixed in each kernel
+def command_oval(args):
+    if args.file is not None:
+        packages, cves = kittykeoval.import_oval(args.file)
+        print(_("Imported %d CVEs of %d kernel source packages.") % (cves, packages))
+
+        if kittykeoval.skipped_objects > 0:
+            print(_("Warning: %d objects were skipped, since their package names could not be resolved; their CVEs are missing.") % kittykeoval.skipped_objects)
+
+    index = kittykeoval.load_index()
+
+    if len(index) == 0:
+        print(_("No OVAL data imported."))
+        return 1
+
+    kernels = kittykecore.apply_blacklist(kittykecore.load_kernels(), kittykecore.load_blacklist())
+
+    for kernel in kernels:
+        unfixed = kittykeoval.count_unfixed(index, kernel)
+        print("%-45s %-20s %s" % (kernel['package'], kernel['pkg_version'], ["?" if unfixed is None else _("%d unfixed CVE(s)") % unfixed][0]))
+
+    return 0
+
+
+# Updates the package lists (needs root); with --progress, the progress is written as "<fraction>\t<text>" lines for the
+# GUI, which cancels the update by creating the file given with --cancel-file (or by closing the pipe)
+def command_update(args):
+    def progress(fraction, text):
+        if args.cancel_file and os.path.exists(args.cancel_file):
+            return False
+
+        try:
+            if args.progress:
+                print("%.3f\t%s" % (fraction, text), flush=True)
+            else:
+                print("%3.0f%%  %s" % (fraction*100, text), flush=True)
+            return True
+
+        # Nobody reads the progress anymore; cancel
+        except BrokenPipeError:
+            return False
+
+    result = kittykecore.update_package_lists(progress, args.kernel_sources)
+
+    if not args.progress:
+        if result == 1:
+            print(_("Update cancelled."))
+        elif result == -1:
+            print(_("No sources provide kernel packages."))
+        elif result != 0:
+            print(_("Update failed (error code %d).") % result)
+
+    if result == 0:
+        return 0
+
+    return 1 if result == 1 else 2
+
+
+# Downloads the packages of the newest kernel of each supported group into the APT archive cache (needs root), if
+# prefetching is enabled in the config file; limits are taken from there unless given
+def command_prefetch(args):
+    config = kittykecore.load_config()
+
+    if config['Prefetch']['enabled'] != 'ok' and not args.force:
+        print(_("Prefetching is not enabled."))
+        return 0
+
+    rate = args.rate if args.rate is not None else int(config['Prefetch']['rate'])
+    maxsize = args.max_size if args.max_size is not None else int(config['Prefetch']['maxsize'])
+
+    kernels = kittykecore.apply_blacklist(kittykecore.get_kernels(), kittykecore.load_blacklist())
+    kernels = kittykeprefetch.get_prefetch_kernels(kernels, kittykecore.get_kernel_support_times())
+
+    try:
+        fetched, skipped, error = kittykeprefetch.prefetch_kernels(kernels, args.archives, rate, maxsize, int(config['Prefetch']['reserve']), dry_run = args.dry_run)
+    except Exception as e:
+        print(_("Prefetching failed: %s") % e)
+        return 1
+
+    for kernel, size in fetched:
+        print("%-45s %10s" % (kernel['package'], kittykecore.sizeof_fmt(size)))
+
+    for kernel, reason in skipped:
+        print("%-45s %s" % (kernel['package'], _("skipped (%s)") % reason))
+
+    if error is not None:
+        print(_("Prefetching failed: %s") % error)
+        return 1
+
+    return 0
+
+
+# Performs the operations of a selections file ("<package>\t<verb>" per line, see kittykecore.pkg_perform_operations) in
+# one transaction (needs root); update-grub and update-initramfs only run once at the end. With --synaptic, the
+# transaction is done by synaptic (the GUI calls this via gksudo).
+def command_batch(args):
+    try:
+        with open(args.file, "r") as f:
+            operations = [(verb, name) for name, verb in [line.split() for line in f if len(line.split()) == 2]]
+    except OSError as e:
+        print(_("Cannot read %s: %s") % (args.file, e))
+        return 1
+
+    if args.synaptic:
+        result = kittykecore.perform_deferred(kittykecore.synaptic_perform_selections, args.file, args.xid)
+    else:
+        result = kittykecore.apt_queue.submit(operations, lock_progress())
+
+    if result == kittykecore.transaction_locked:
+        print(_("Transaction failed: the dpkg lock did not become free."))
+        return 1
+
+    if result != 0:
+        print(_("Transaction failed (error code %d).") % result)
+        return 1
+
+    print_timings(kittykecore.transaction_timings)
+
+    return 0
+
+
+# Parses the command line and calls the respective command function
+def main(argv):
+    parser = argparse.ArgumentParser(prog="kittykernel-cli", description=_("Kernel manager"))
+    parser.add_argument("--debug", action="store_true", help=_("show debug output"))
+
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    command = commands.add_parser("list", help=_("list kernels"))
+    command.add_argument("--all", action="store_true", help=_("do not apply the blacklist"))
+    command.add_argument("--arch", help=_("list the kernels of another architecture APT knows"))
+    command.set_defaults(function=command_list)
+
+    command = commands.add_parser("boot", help=_("show the kernel files in /boot"))
+    command.set_defaults(function=command_boot)
+
+    command = commands.add_parser("plan", help=_("plan which kernels to remove to free space on /boot"))
+    command.add_argument("--free", type=int, help=_("required free space on /boot in bytes"))
+    command.add_argument("--keep", type=int, help=_("number of installed kernels to keep per group"))
+    command.add_argument("--verb", choices=['remove', 'purge'], default='purge', help=_("remove or purge kernels"))
+    command.set_defaults(function=command_plan)
+
+    command = commands.add_parser("cleanup", help=_("remove old kernels according to the retention policy (needs root)"))
+    command.add_argument("--dry-run", action="store_true", help=_("only show what would be done"))
+    command.set_defaults(function=command_cleanup)
+
+    command = commands.add_parser("scan", help=_("list the kernels of other root directories (e.g. chroots)"))
+    command.add_argument("roots", nargs="+", help=_("root directories"))
+    command.add_argument("--jobs", type=int, help=_("number of roots scanned at once"))
+    command.set_defaults(function=command_scan)
+
+    command = commands.add_parser("export", help=_("export a snapshot of the kernels (JSON Lines)"))
+    command.add_argument("-o", "--output", default="-", help=_("output file (default: stdout)"))
+    command.set_defaults(function=command_export)
+
+    command = commands.add_parser("fleet", help=_("aggregate the snapshots in a directory"))
+    command.add_argument("directory", help=_("directory with snapshots"))
+    command.add_argument("--expired", action="store_true", help=_("list hosts whose active kernel is not supported anymore"))
+    command.set_defaults(function=command_fleet)
+
+    command = commands.add_parser("fixes", help=_("list the kernels whose changelog mentions a CVE, bug, or keyword"))
+    command.add_argument("term", help=_("CVE ID (e.g. CVE-2020-1234), bug (e.g. LP:1234567), or keyword"))
+    command.add_argument("--update", action="store_true", help=_("read the changelogs from the archive first"))
+    command.set_defaults(function=command_fixes)
+
+    command = commands.add_parser("oval", help=_("import Ubuntu CVE OVAL data and count the unfixed CVEs of each kernel"))
+    command.add_argument("file", nargs="?", help=_("OVAL file (e.g. com.ubuntu.bionic.cve.oval.xml.bz2)"))
+    command.set_defaults(function=command_oval)
+
+    command = commands.add_parser("update", help=_("update the package lists (needs root)"))
+    command.add_argument("--kernel-sources", action="store_true", help=_("only update the sources providing kernel packages"))
+    command.add_argument("--progress", action="store_true", help=_("show the progress in a machine-readable format"))
+    command.add_argument("--cancel-file", metavar="FILE", help=_("cancel the update as soon as this file exists"))
+    command.set_defaults(function=command_update)
+
+    command = commands.add_parser("prefetch", help=_("download the newest kernels into the APT archive cache (needs root)"))
+    command.add_argument("--force", action="store_true", help=_("prefetch even if not enabled in the config file"))
+    command.add_argument("--dry-run", action="store_true", help=_("only show what would be downloaded"))
+    command.add_argument("--rate", type=int, help=_("bandwidth limit in bytes per second (0 for no limit)"))
+    command.add_argument("--max-size", type=int, help=_("maximum number of bytes to download"))
+    command.add_argument("--archives", help=_("archive directory (default: the one of APT)"))
+    command.set_defaults(function=command_prefetch)
+
+    command = commands.add_parser("batch", help=_("install/remove the packages of a selections file in one transaction (needs root)"))
+    command.add_argument("file", help=_("selections file with one \"<package> <verb>\" per line"))
+    command.add_argument("--synaptic", action="store_true", help=_("let synaptic do the transaction"))
+    command.add_argument("--xid", type=int, default=0, help=_("X window id of the parent window for synaptic"))
+    command.set_defaults(function=command_batch)
+
+    args = parser.parse_args(argv)
+
+    kittykecore.debugmode = args.debug
+
+    return args.function(args)
+
+
+# Script file is run directly
+if __name__ == '__main__':
+    # Load the language-definitions (i18n) for kittykernel
+    gettext.install("kittykernel", "/usr/share/kittykernel/locale")
+
+    sys.exit(main(sys.argv[1:]))
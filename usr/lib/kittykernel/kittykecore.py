@@ -29,24 +29,35 @@
 import os
 import subprocess
 import apt
+import apt_pkg
 import sys
-import platform
 import tempfile
 import gettext
 import re
 import datetime
 import configparser
+import threading
+import gc
+import time
+import shutil
+import shlex
+import socket
+import json
+import multiprocessing
+import urllib.parse
+import apt.progress.base
+import aptsources.sourceslist
 _ = gettext.gettext
 
 
 # Debug mode; show exception data when set to True
 debugmode = False
 
-# APT Cache object
-cache = apt.Cache()
+# APT Cache object; it is opened on first use (see get_cache), since clients of the kittykernel daemon do not need it
+cache = None
 
-# Architecture of platform; 64bit?
-platformis64bit = (platform.architecture()[0] == "64bit")
+# Path of the socket of the kittykernel daemon (see kittykedaemon.py)
+daemon_socket = "/run/kittykernel/socket"
 
 # Default config
 config_default = {
@@ -58,7 +69,26 @@ config_default = {
          'expired': '#600000',
          'toexpire': '#606000'},
     'Checks':
-        {'kittywarning': ''}
+        {'kittywarning': '',
+         'releasecache': ''},
+    'Cleanup':
+        {'bootfree': '80000000',
+         'keeppergroup': '1'},
+    'Policy':
+        {'keepnewest': '2',
+         'keepsupported': 'ok',
+         'purgeleftovers': 'ok',
+         'verb': 'remove'},
+    'Mainline':
+        {'url': 'https://kernel.ubuntu.com/mainline/',
+         'versions': '50',
+         'connections': '4',
+         'store': ''},
+    'Prefetch':
+        {'enabled': '',
+         'rate': '0',
+         'maxsize': '1000000000',
+         'reserve': '500000000'}
     }
 
 
@@ -75,11 +105,11 @@ def sizeof_fmt(num, suffix='B'):
 
 # This function returns the size in bytes of the /boot directory/partition
 # as tuple: (free, total); returns (0, 0) when something went wrong
-def sizeof_boot():
+def sizeof_boot(bootdir = "/boot"):
     global debugmode
     try:
         # call df to get the size of /boot
-        output_lines = subprocess.check_output("df -B 1 /boot", shell = True).decode("utf-8").strip().split('\n')
+        output_lines = subprocess.check_output("df -B 1 %s" % shlex.quote(bootdir), shell = True).decode("utf-8").strip().split('\n')
 
         # Should be at least two lines
         if len(output_lines) < 2:
@@ -101,6 +131,69 @@ def sizeof_boot():
             print (e)
         return (0, 0)
 
+# Files a kernel places in /boot; the rest of the file name is the ABI version of the kernel, e.g. "vmlinuz-4.15.0-112-generic"
+boot_file_prefixes = ("vmlinuz-", "initrd.img-", "System.map-", "config-")
+
+# Results of the last /boot analyses per directory (e.g. of this system and alternate roots); an analysis is only redone
+# when the modification time of the directory changes. At most boot_cache_size directories are kept. The lock is
+# necessary since the analysis usually runs in a background thread.
+boot_cache = {}
+boot_cache_size = 8
+boot_cache_lock = threading.Lock()
+
+# Returns the actual size in bytes of the kernel files in /boot as dictionary, which maps each ABI version
+# (e.g. "4.15.0-112-generic") to the total size of its files; returns an empty dictionary when something went wrong
+def get_boot_usage(bootdir = "/boot"):
+    global boot_cache, debugmode
+    try:
+        with boot_cache_lock:
+            # Modification time of the directory; files are added, replaced, or removed when kernels change
+            mtime = os.stat(bootdir).st_mtime
+
+            # Nothing changed? Then, return the previous analysis
+            if bootdir in boot_cache and boot_cache[bootdir]['mtime'] == mtime:
+                return boot_cache[bootdir]['usage']
+
+            usage = {}
+
+            # Check each file in the directory; scandir gives us the stat data without extra calls for most file systems
+            with os.scandir(bootdir) as entries:
+                for entry in entries:
+                    if not entry.name.startswith(boot_file_prefixes) or not entry.is_file(follow_symlinks = False):
+                        continue
+
+                    # Remove prefix to get the ABI version; ignore old images saved by update-initramfs etc.
+                    abi = entry.name.split('-', 1)[1]
+                    if abi.endswith((".bak", ".old-dkms", ".dpkg-bak")):
+                        continue
+
+                    usage[abi] = usage.get(abi, 0) + entry.stat(follow_symlinks = False).st_size
+
+            # Forget the directory analysed first, if there are too many (dictionaries keep the order of insertion)
+            boot_cache.pop(bootdir, None)
+            if len(boot_cache) >= boot_cache_size:
+                del boot_cache[next(iter(boot_cache))]
+
+            boot_cache[bootdir] = {'mtime': mtime, 'usage': usage}
+
+            return usage
+
+    # When something went really wrong...
+    except Exception as e:
+        if debugmode:
+            print (e)
+        return {}
+
+# Returns the size of the files of a specific kernel in /boot using the dictionary returned by get_boot_usage
+def get_kernel_boot_size(usage, kernel):
+    return usage.get(kernel['abi'], 0)
+
+# Returns the kernels, which could be removed (i.e. not active, but have files in /boot), sorted by the number of bytes
+# removing them would free on /boot (largest first)
+def rank_kernels_by_boot_usage(kernels, usage):
+    candidates = [kernel for kernel in kernels if not kernel['active'] and get_kernel_boot_size(usage, kernel) > 0]
+    return sorted(candidates, key=lambda kernel: get_kernel_boot_size(usage, kernel), reverse=True)
+
 # Opens and loads the config file from ~/.config/kittykernel/config and returns its entries as dictionaries; will return a dictionary with defaults if no file exists
 def load_config():
     global debugmode
@@ -153,20 +246,168 @@ def compare_versions(version1, version2):
         
     return compare(normalize(version1), normalize(version2))
 
-# Updates and reopens the cache; this version uses synaptic
-def refresh_cache(xwindow_id = 0):
+# The APT cache is not thread-safe; all functions using it hold this lock (see with_cache_lock)
+cache_lock = threading.RLock()
+
+# Decorator for functions using the APT cache, which may be called from different threads
+def with_cache_lock(function):
+    def locked_function(*args, **kwargs):
+        with cache_lock:
+            return function(*args, **kwargs)
+    return locked_function
+
+# Returns the APT cache; opens it first, if necessary
+@with_cache_lock
+def get_cache():
     global cache
-    # Starting synaptic with all the necessary parameters
-    cmd = ["gksudo", "--", "/usr/sbin/synaptic", "--hide-main-window", "--update-at-startup", "--non-interactive", "--parent-window-id", "%d" % xwindow_id]
-    comnd = subprocess.Popen(' '.join(cmd), shell=True)
-    comnd.wait()
+    if cache is None:
+        cache = apt.Cache()
+    return cache
+
+# Releases the APT cache to save memory (e.g. after the list of kernels was read); it is opened again by get_cache
+# when it is needed the next time
+@with_cache_lock
+def release_cache():
+    global cache
+    cache = None
+
+    # The cache has reference cycles; free it now, not at some point later
+    gc.collect()
+
+# Opens the APT cache in a background thread, so that it is ready when it is needed (e.g. when a menu was opened)
+def preload_cache():
+    if cache is None:
+        threading.Thread(target=get_cache, daemon=True).start()
+
+# Returns the resident memory (RSS) of this process in bytes; 0 if unknown
+def get_rss():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception as e:
+        if debugmode:
+            print (e)
+        return 0
+
+# Progress of updating the package lists (see update_package_lists); callback is called with the fraction done (0 to 1)
+# and a text for each pulse and may return False to cancel the update
+class KittykeAcquireProgress(apt.progress.base.AcquireProgress):
+
+    def __init__(self, callback):
+        apt.progress.base.AcquireProgress.__init__(self)
+        self.callback = callback
+        self.cancelled = False
+
+    # Called regularly while downloading; returning False cancels the download
+    def pulse(self, owner):
+        apt.progress.base.AcquireProgress.pulse(self, owner)
+
+        total = self.total_bytes + self.total_items
+        fraction = float(self.current_bytes + self.current_items) / total if total > 0 else 0.0
+
+        if self.callback(min(fraction, 1.0), _("Downloading package lists (%d of %d)...") % (self.current_items, self.total_items)) is False:
+            self.cancelled = True
+
+        return not self.cancelled
+
+# Returns a line in the one-line format of sources.list for a sources entry (also for entries of .sources files)
+def get_sources_line(entry):
+    # Entries of sources.list just keep their line
+    if not hasattr(entry, 'section'):
+        return entry.line.split('#')[0].strip()
+
+    options = []
+
+    if entry.architectures:
+        options.append("arch=" + ",".join(entry.architectures))
+
+    # Only key files can be given in one line, not embedded keys
+    signedby = entry.section.get('Signed-By', '').strip()
+    if signedby and "\n" not in signedby:
+        options.append("signed-by=" + signedby)
+
+    return " ".join([entry.type] + (["[" + " ".join(options) + "]"] if options else []) + [entry.uri, entry.dist] + entry.comps)
+
+# Writes a sources list with only the sources, which provide kernel packages (i.e. have the site and archive or codename
+# of an origin of one of the kernels), to a temporary file and returns its path; returns None if there are no such sources
+def write_kernel_sources_list(kernels):
+    origins = set()
+    for kernel in kernels:
+        for origin in kernel['origins']:
+            origins.add((origin[2], origin[1]))
+
+            if origin in origin_codenames:
+                origins.add((origin[2], origin_codenames[origin]))
+
+    # Newer versions of python-apt can read .sources files as well
+    try:
+        sources = aptsources.sourceslist.SourcesList(deb822 = True)
+    except TypeError:
+        sources = aptsources.sourceslist.SourcesList()
+
+    lines = []
+    for entry in sources.list:
+        if entry.invalid or entry.disabled or entry.type != "deb":
+            continue
+
+        if (urllib.parse.urlparse(entry.uri).hostname, entry.dist) in origins:
+            line = get_sources_line(entry)
+            if line not in lines:
+                lines.append(line)
+
+    if len(lines) == 0:
+        return None
+
+    handle, path = tempfile.mkstemp(prefix="kittykernel-", suffix=".list")
+    with os.fdopen(handle, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+    return path
+
+# Updates the package lists with APT (has to be run as root); the sources are downloaded in parallel. progress is called
+# with the fraction done and a text, and may return False to cancel (see KittykeAcquireProgress). If kernel_sources is
+# True, only the sources providing kernel packages are updated. Returns 0 on success, 1 if cancelled, and another error
+# code otherwise.
+@with_cache_lock
+def update_package_lists(progress = None, kernel_sources = False):
+    global debugmode
+
+    fetch_progress = KittykeAcquireProgress(progress or (lambda fraction, text: True))
+    sources_list = None
 
-    # Reopens the list; necessary after updating
-    cache.open(None)
+    try:
+        if kernel_sources:
+            sources_list = write_kernel_sources_list(get_kernels())
+
+            if sources_list is None:
+                return -1
+
+        get_cache().update(fetch_progress, sources_list = sources_list)
+
+        if fetch_progress.cancelled:
+            return 1
+
+        # Reopen the list; necessary after updating
+        reopen_cache()
+
+        return 0
+
+    # If something is wrong (or the update was cancelled), return error code
+    except Exception as e:
+        if debugmode:
+            print (e)
+
+        return 1 if fetch_progress.cancelled else -2
 
-# Just rereads the cache (reopens)
+    finally:
+        if sources_list is not None:
+            os.remove(sources_list)
+
+# Just rereads the cache (reopens), if it was opened; the daemon rereads its own cache when dpkg or APT change something
+@with_cache_lock
 def reopen_cache():
-    cache.open(None)
+    if cache is not None:
+        cache.open(None)
 
 # Returns the current kernel as string in the format "4.10.0-28-generic"; "unknown" is returned if an exception occurred
 def get_current_kernel():
@@ -179,6 +420,55 @@ def get_current_kernel():
             print (e)
         return "unknown"
 
+# Returns the default kernel of an alternate root directory (e.g. a chroot or a mounted disk of a VM), which is the
+# kernel the /boot/vmlinuz link (or the /vmlinuz link of older releases) points to, in the same format as
+# get_current_kernel; "unknown" is returned if there is no such link
+def get_default_kernel(rootdir):
+    global debugmode
+    for link in [os.path.join(rootdir, "boot", "vmlinuz"), os.path.join(rootdir, "vmlinuz")]:
+        try:
+            return os.path.basename(os.readlink(link)).split('-', 1)[1]
+        except Exception as e:
+            if debugmode:
+                print (e)
+    return "unknown"
+
+# Opens the APT cache of an alternate root directory with the root's configuration, status, and package lists; nothing
+# is written into the root (apt.Cache(rootdir=...) would create missing directories and files there), the caches of APT
+# are kept in memory or go to cachedir (e.g. a temporary directory). Raises an exception if the root has no readable
+# dpkg status (e.g. because it does not exist), since APT would just show no packages then. The configuration of APT
+# belongs to the whole process, so each root should be opened in its own process (see scan_roots).
+def open_root_cache(rootdir, cachedir):
+    rootdir = os.path.abspath(rootdir)
+
+    with open(os.path.join(rootdir, "var", "lib", "dpkg", "status"), "rb"):
+        pass
+
+    # Start with the configuration of this system; a root opened before in this process must not leave anything behind
+    apt_pkg.init_config()
+
+    if os.path.isfile(os.path.join(rootdir, "etc", "apt", "apt.conf")):
+        apt_pkg.read_config_file(apt_pkg.config, os.path.join(rootdir, "etc", "apt", "apt.conf"))
+    if os.path.isdir(os.path.join(rootdir, "etc", "apt", "apt.conf.d")):
+        apt_pkg.read_config_dir(apt_pkg.config, os.path.join(rootdir, "etc", "apt", "apt.conf.d"))
+
+    apt_pkg.config.set("Dir", rootdir)
+    apt_pkg.config.set("Dir::State::status", os.path.join(rootdir, "var", "lib", "dpkg", "status"))
+    apt_pkg.config.set("Dir::bin::dpkg", os.path.join(rootdir, "usr", "bin", "dpkg"))
+    apt_pkg.config.set("Dir::Cache", cachedir)
+    apt_pkg.config.set("Dir::Cache::pkgcache", "")
+    apt_pkg.config.set("Dir::Cache::srcpkgcache", "")
+    apt_pkg.init_system()
+
+    return apt.Cache(memonly = True)
+
+# Returns the path of a data file of kittykernel for an alternate root directory: the root's own file is used, if
+# it has one, and the file of this system otherwise
+def get_root_file(rootdir, path):
+    if rootdir is not None and os.path.isfile(os.path.join(rootdir, path.lstrip("/"))):
+        return os.path.join(rootdir, path.lstrip("/"))
+    return path
+
 # Returns the current kernel as major version in the format "4.10"; "unknown" is returned if an exception occurred
 def get_current_kernel_major():
     global debugmode
@@ -207,76 +497,291 @@ def strip_kernel_version(version, maxsubversion = 10):
     return ".".join(intversions)
 
 
-# Downloads and returns a list of kernels; an empty string is returned if an exception occurred
-def get_kernels():
-    global cache, debugmode, platformis64bit
+# Pool of origin tuples (label, archive, site, trusted); all kernels from the same archive share one tuple
+origin_pool = {}
+
+# Returns the shared origin tuple for the given origin data (creates it, if necessary)
+def intern_origin(label, archive, site, trusted):
+    origin = (sys.intern(label or ""), sys.intern(archive or ""), sys.intern(site or ""), bool(trusted))
+    return origin_pool.setdefault(origin, origin)
+
+# Codenames of the origins found by get_kernels (origin tuple -> codename, e.g. bookworm for the archive stable); sources
+# lists may name either of them
+origin_codenames = {}
+
+# Formats a tuple of origins for display, e.g. "Ubuntu (bionic-updates, archive.ubuntu.com, trusted)"
+def format_origins(origins):
+    return ", ".join(["%s (%s, %s, %s)" % (label, archive, site, [_("trusted") if trusted else _("not trusted")][0]) for label, archive, site, trusted in origins])
+
+
+# Path of the kernel families file provided with kittykernel
+families_file = "/usr/lib/kittykernel/kernel_families"
+
+# Families (name, prefix of the image packages) used if the families file cannot be read
+families_default = [('generic', "linux-image-"), ('unsigned', "linux-image-unsigned-"), ('signed', "linux-signed-image-")]
+
+# Compiled matchers by path of the families file (see get_kernel_matcher); only compiled again when the modification time
+# of the file changes
+families_cache = {}
+
+# Reads a kernel families file; returns a list of tuples (family, prefix), e.g. ('unsigned', "linux-image-unsigned-")
+def load_kernel_families(path):
+    families = []
+
+    with open(path, "r") as f:
+        for entry in f.read().splitlines():
+            # Ignore empty lines and comments
+            if len(entry) == 0 or entry.startswith("#"):
+                continue
+
+            # Split lines into 2 elements separated by ','; ignore all lines for which that is not possible
+            fields = entry.split(',', 1)
+            if len(fields) != 2 or len(fields[1].strip()) == 0:
+                continue
+
+            families.append( (fields[0].strip(), fields[1].strip()) )
+
+    return families
+
+# Returns the matcher for kernel image packages as tuple of a regular expression and a dictionary mapping the prefixes to
+# their families. The expression matches the image packages of all families at once and gives the 'prefix', the 'abi'
+# (e.g. 6.8.0-31-generic), and the 'major' version (e.g. 6.8) of a package name; meta-packages like linux-image-generic
+# do not match. An alternate root directory may have its own families file.
+def get_kernel_matcher(rootdir = None):
+    global families_cache, debugmode
+
+    path = get_root_file(rootdir, families_file)
+
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        mtime = None
+
+    # Nothing changed? Then, just return the matcher compiled before
+    if path in families_cache and mtime == families_cache[path]['mtime']:
+        return families_cache[path]['matcher']
+
+    families = families_default
+
+    if mtime is not None:
+        try:
+            families = load_kernel_families(path) or families_default
+        except Exception as e:
+            if debugmode:
+                print (e)
+
+    prefixes = {prefix: family for family, prefix in families}
+
+    # Longer prefixes first, so that linux-image-unsigned- is tried before linux-image-; debug symbols (e.g.
+    # linux-image-unsigned-6.8.0-31-generic-dbgsym) are not kernels
+    expression = re.compile(r"^(?P<prefix>%s)(?P<abi>(?P<major>\d+\.\d+)\.\d+[^:]*)(?<!-dbgsym)(?<!-dbg)$" %
+                            "|".join([re.escape(prefix) for prefix in sorted(prefixes, key=len, reverse=True)]))
+
+    families_cache[path] = {'mtime': mtime, 'matcher': (expression, prefixes)}
+
+    return families_cache[path]['matcher']
+
+# Returns the names of the packages belonging to the kernel with the given ABI besides its image: modules, headers (if
+# headers is True), and extras (if extras is True; older kernels have linux-image-extra-*, newer linux-modules-extra-*)
+def get_kernel_companions(abi, headers = True, extras = True):
+    names = ["linux-modules-" + abi]
+
+    if headers:
+        names.append("linux-headers-" + abi)
+
+    if extras:
+        names.extend(["linux-image-extra-" + abi, "linux-modules-extra-" + abi])
+
+    return names
+
+# Packages belonging to a specific kernel, e.g. linux-image-4.15.0-112-generic or linux-headers-4.15.0-112
+kernel_package_name = re.compile(r"^linux-(image|image-unsigned|signed-image|image-extra|modules|modules-extra|headers)-\d")
+
+# Returns True if an installed package could pin kernels, i.e. a meta-package (e.g. linux-generic-hwe-18.04); only
+# these are checked for dependencies on kernel packages. DKMS packages only depend on the generic meta-packages; the
+# modules they built for each kernel are found by get_dkms_kernels.
+def is_kernel_protector(name):
+    return name.startswith("linux-") and not kernel_package_name.match(name)
+
+# Adds the kernel packages an installed package depends on to the reverse-dependency index protected (package name ->
+# set of installed packages depending on it). Dependencies with alternatives (A | B) are skipped, since APT can keep the
+# package installed by choosing another alternative.
+def add_kernel_protector(protected, pkg):
+    for dependency in pkg.installed.dependencies:
+        names = set([alternative.name for alternative in dependency])
+
+        if len(names) == 1:
+            name = names.pop()
+            if kernel_package_name.match(name):
+                protected.setdefault(name, set()).add(pkg.name)
+
+# Directory where DKMS keeps its modules: <module>/<version>/<kernel ABI>/<architecture>/ for each kernel a module was
+# built for (plus "source" and "build" in each version and "kernel-..." links to the versions)
+dkms_dir = "/var/lib/dkms"
+
+# Returns the DKMS modules built for each kernel as dictionary {kernel ABI: set of "<module>/<version>"}; rootdir is
+# an alternate root directory (see get_kernels). Returns an empty dictionary if DKMS is not installed.
+def get_dkms_kernels(rootdir = None):
+    global debugmode
+
+    directory = os.path.join(rootdir, dkms_dir.lstrip("/")) if rootdir is not None else dkms_dir
+    modules = {}
+
+    try:
+        for module in os.listdir(directory):
+            for version in os.listdir(os.path.join(directory, module)):
+                path = os.path.join(directory, module, version)
+
+                if os.path.islink(path) or not os.path.isdir(path):
+                    continue
+
+                for abi in os.listdir(path):
+                    if abi not in ["source", "build"] and os.path.isdir(os.path.join(path, abi)):
+                        modules.setdefault(abi, set()).add("%s/%s" % (module, version))
+
+    except Exception as e:
+        if debugmode:
+            print (e)
+
+    return modules
+
+# Returns the architecture qualifier of a package name, e.g. ":i386" for linux-image-6.8.0-31-generic:i386 (packages of
+# foreign architectures) and "" for packages of the native architecture
+def get_architecture_qualifier(name):
+    return name[len(name.split(":")[0]):]
+
+# Returns the names of all packages of a kernel (image, modules, extras, headers) as in get_kernel_operations; the
+# companions of a kernel of a foreign architecture have the same architecture
+def get_kernel_package_names(kernel):
+    qualifier = get_architecture_qualifier(kernel['package'])
+
+    return [kernel['package']] + [name + qualifier for name in get_kernel_companions(kernel['abi'])]
+
+# Returns the architectures APT knows as tuple of the native architecture (e.g. amd64 or arm64) and the list of foreign
+# architectures (added with dpkg --add-architecture, e.g. ['i386']); the APT config has to be loaded (see get_cache)
+def get_architectures():
+    architectures = apt_pkg.get_architectures()
+    native = apt_pkg.config.find("APT::Architecture") or architectures[0]
+
+    return (native, [architecture for architecture in architectures if architecture != native])
+
+# Downloads and returns a list of kernels; an empty string is returned if an exception occurred. If rootdir is given,
+# the kernels of this alternate root directory (e.g. a chroot) are returned; the default kernel of the root counts as
+# the active one then and exceptions are raised (e.g. if the root cannot be read), since the caller has to tell that
+# apart from a root without kernels. 'protected_by' lists the installed meta-packages, which depend on a package of the
+# kernel (i.e. which APT would have to remove together with the kernel), and 'dkms_modules' the DKMS modules built for
+# the kernel (these do not keep the kernel; DKMS removes them together with it). Only the kernels of the native
+# architecture are returned, unless another one of the architectures APT knows (see get_architectures) is given.
+@with_cache_lock
+def get_kernels(rootdir = None, architecture = None):
+    global cache, debugmode
+
+    # Caches of APT for an alternate root are written here
+    cachedir = tempfile.TemporaryDirectory() if rootdir is not None else None
+
     try:
         # First, get the current version
-        current_version = get_current_kernel()        
+        current_version = get_current_kernel() if rootdir is None else get_default_kernel(rootdir)
+
+        # The alternate root has its own APT cache (and config)
+        pkgcache = get_cache() if rootdir is None else open_root_cache(rootdir, cachedir.name)
+
+        # Native and foreign architectures; kernels of foreign architectures cannot be booted here
+        native, foreign = get_architectures()
+
+        if architecture is None:
+            architecture = native
 
         # DEBUG only
         if debugmode:
-            print("Current architecture of system (True if 64bit): ", platform.architecture()[0], platformis64bit)
+            print("Architectures of system (native, foreign): ", native, foreign, "; listing kernels for", architecture)
+
+        # Matcher for the image packages of all kernel families
+        matcher, families = get_kernel_matcher(rootdir)
 
         # Create empty list to return
         kernel_list = []
 
+        # Reverse dependencies of the kernel packages (see add_kernel_protector); collected in the same pass
+        protected = {}
+
         # Check the packages in the cache
-        for pkg in cache:
-            # Pkg is 64bit?
-            pkgis64bit = (pkg.architecture() == "amd64")
+        for pkg in pkgcache:
+            # Name without architecture (foreign packages have names like linux-image-...:i386)
+            name = pkg.shortname
+
+            # Meta-packages may be of another architecture (e.g. all)
+            if is_kernel_protector(name) and pkg.is_installed:
+                add_kernel_protector(protected, pkg)
+
+            # Kernel image package of any family? The name is checked first, since it is the cheapest check
+            match = matcher.match(name)
+            if match is None:
+                continue
 
             # If the package has not the right architecture... we will just go on
-            if pkgis64bit != platformis64bit:
+            if pkg.architecture() != architecture:
                 continue
 
-            # Create an empty dictionary object
-            kernel = { 'version_major': '', 'version': '', 'package': pkg.name, 'pkg_version': '',
+            # Create an empty dictionary object; the package name keeps the architecture of a foreign kernel (e.g.
+            # linux-image-...:i386), since APT would take the native package for the short name
+            kernel = { 'version_major': '', 'version': '', 'package': name if architecture == native else pkg.fullname, 'abi': '', 'family': '', 'architecture': architecture, 'pkg_version': '', 'source': '',
                        'size': 0, 'installed_size': 0, 'origins': [], 'fullname': pkg.fullname,
-                       'active': False, 'installed': False, 'downloaded': False }
+                       'active': False, 'installed': False, 'downloaded': False, 'protected_by': [], 'dkms_modules': [] }
 
-            # Kernel package? Check for versions 1 to 5 (the 6 is exclusive!) here
-            if kernel['package'].startswith( tuple(["linux-image-"+str(x) for x in range(1,6)]) ):
+            # Print name and version in debug mode
+            if debugmode:
+                print(kernel['package'], match.group('abi'), architecture)
 
-                # Print name and version in debug mode
-                if debugmode:
-                    print(kernel['package'], strip_kernel_version(kernel['package']), pkg.architecture() )
-
-                # Save full version and major version of package
-                kernel['version'] = strip_kernel_version(kernel['package'])
-                if len(kernel['version'].split('.')) > 2:
-                    kernel['version_major'] = kernel['version'].split('.')[0] + "." + kernel['version'].split('.')[1]
-                else:
-                    # This is probably a generic image; ignore it for now
-                    continue
+            # ABI version of kernel; that is also the version uname and the files in /boot use
+            kernel['abi'] = match.group('abi')
+            kernel['family'] = families[match.group('prefix')]
 
-                # Get all the flags
-                kernel['active'] = (kernel['package'].replace("linux-image-", "") == current_version)
-                kernel['installed'] = pkg.is_installed
-                kernel['downloaded'] = pkg.has_config_files
+            # Save full version and major version of package
+            kernel['version'] = strip_kernel_version(kernel['abi'])
+            kernel['version_major'] = match.group('major')
 
-                # Package version is either the version installed or the candidate version; no pkg_version means = not available
-                if kernel['installed']:
-                    kernel['pkg_version'] = pkg.installed.version                    
-                elif pkg.candidate and pkg.candidate.downloadable:
-                    kernel['pkg_version'] = pkg.candidate.version
+            # Get all the flags; images of other families (e.g. the unsigned one) have the same ABI, but only the installed
+            # image is the active kernel
+            kernel['installed'] = pkg.is_installed
+            kernel['active'] = kernel['installed'] and (kernel['abi'] == current_version)
+            kernel['downloaded'] = pkg.has_config_files
 
-                # Sizes of package
-                if pkg.candidate:
-                    kernel['size'] = pkg.candidate.size
-                    kernel['installed_size'] = pkg.candidate.installed_size
+            # Package version is either the version installed or the candidate version; no pkg_version means = not available
+            if kernel['installed']:
+                kernel['pkg_version'] = pkg.installed.version                    
+            elif pkg.candidate and pkg.candidate.downloadable:
+                kernel['pkg_version'] = pkg.candidate.version
 
-                # Copy the origins
-                for origin in pkg.candidate.origins:
-                    # Ignore "now" archives
-                    if origin.archive != "now":
-                        kernel['origins'].append("%s (%s, %s, %s)" % (origin.label, origin.archive, origin.site, [_("trusted") if origin.trusted else _("not trusted")][0]) )
+            # Source package (e.g. "linux" or "linux-hwe"); the changelog belongs to it
+            if pkg.installed or pkg.candidate:
+                kernel['source'] = (pkg.installed or pkg.candidate).source_name
 
-                # Join in single string
-                kernel['origins'] = ", ".join(kernel['origins'])
+            # Sizes of package
+            if pkg.candidate:
+                kernel['size'] = pkg.candidate.size
+                kernel['installed_size'] = pkg.candidate.installed_size
 
-                # Add kernel dictionary to list
-                kernel_list.append(kernel)
+            # Copy the origins as (label, archive, site, trusted) tuples; identical origins are shared between kernels
+            for origin in pkg.candidate.origins:
+                # Ignore "now" archives
+                if origin.archive != "now":
+                    kernel['origins'].append(intern_origin(origin.label, origin.archive, origin.site, origin.trusted))
+
+                    if origin.codename:
+                        origin_codenames[kernel['origins'][-1]] = sys.intern(origin.codename)
+
+            kernel['origins'] = tuple(kernel['origins'])
+
+            # Add kernel dictionary to list
+            kernel_list.append(kernel)
+
+        # Look up which packages depend on each kernel and which DKMS modules were built for it
+        dkms = get_dkms_kernels(rootdir)
+
+        for kernel in kernel_list:
+            kernel['protected_by'] = sorted(set().union(*[protected.get(name.split(":")[0], set()) for name in get_kernel_package_names(kernel)]))
+            kernel['dkms_modules'] = sorted(dkms.get(kernel['abi'], set()))
 
         # Sort list by version and return it
         return sorted(kernel_list, key=lambda item: list(map(str, item['version'].split('.'))), reverse=True) 
@@ -289,14 +794,325 @@ def get_kernels():
             exc_type, exc_obj, exc_tb = sys.exc_info()
             fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
             print(exc_type, fname, exc_tb.tb_lineno)
+        if rootdir is not None:
+            raise
         return []
 
+    finally:
+        if cachedir is not None:
+            cachedir.cleanup()
+
+# Sends a request to the kittykernel daemon and returns the result; the protocol is one JSON object per line in each
+# direction, e.g. {"command": "kernels"} and {"result": [...]}. Raises FileNotFoundError or ConnectionRefusedError if
+# the daemon does not run, PermissionError if it does not allow the request, and RuntimeError for other errors. timeout
+# is in seconds (None for no timeout).
+def daemon_request(command, timeout = 600, **arguments):
+    request = dict(arguments)
+    request['command'] = command
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(daemon_socket)
+        client.sendall((json.dumps(request) + "\n").encode("utf-8"))
+
+        with client.makefile("r", encoding="utf-8") as f:
+            response = json.loads(f.readline() or "{\"error\": \"No response\"}")
+
+    if 'error' in response:
+        if response.get('type') == 'PermissionError':
+            raise PermissionError(response['error'])
+        raise RuntimeError(response['error'])
+
+    return response['result']
+
+# Converts a kernel dictionary received from the daemon back, i.e. the origins become shared tuples again
+def kernel_from_json(kernel):
+    kernel['origins'] = tuple([intern_origin(*origin) for origin in kernel['origins']])
+    return kernel
+
+# Returns the list of kernels (see get_kernels) from the kittykernel daemon, if it runs, or from the APT cache otherwise
+def load_kernels():
+    try:
+        return [kernel_from_json(kernel) for kernel in daemon_request('kernels')]
+    except Exception as e:
+        if debugmode:
+            print (e)
+        return get_kernels()
+
+# Returns the changelog of a kernel (see get_kernel_changelog) from the kittykernel daemon, if it runs, or from the
+# APT cache otherwise
+def load_kernel_changelog(fullname):
+    try:
+        return daemon_request('changelog', fullname = fullname)
+    except Exception as e:
+        if debugmode:
+            print (e)
+        return get_kernel_changelog(fullname)
+
+# Returns the operations for kernels (see get_kernel_operations) from the kittykernel daemon, if it runs, or from the APT
+# cache otherwise; so, clients of the daemon do not need to open the APT cache themselves
+def load_kernel_operations(fullnames, verb, headers = True, extras = True):
+    try:
+        return [tuple(operation) for operation in daemon_request('operations', fullnames = fullnames, verb = verb, headers = headers, extras = extras)]
+    except Exception as e:
+        if debugmode:
+            print (e)
+        return get_kernel_operations(fullnames, verb, headers, extras)
+
+# Performs operations (see pkg_perform_operations) by the kittykernel daemon, if it runs and allows it, or by synaptic
+# otherwise; if another program holds the dpkg lock, it waits for it (see KittykeTransactionQueue, progress is called
+# while waiting). A transaction of the daemon may take long, so there is no timeout; if it fails, it is not tried again
+# with synaptic. Returns 0 on success and an error code otherwise (-4 if the dpkg lock did not become free).
+def perform_operations(operations, xwindow_id = 0, progress = None):
+    try:
+        return daemon_request('perform', None, operations = operations)
+
+    # Daemon does not run or does not allow transactions for this user: nothing was done, so synaptic does it
+    except (FileNotFoundError, ConnectionRefusedError, PermissionError) as e:
+        if debugmode:
+            print (e)
+        return synaptic_queue.submit(operations, progress, xwindow_id)
+
+    # Daemon failed (or the connection broke) during the transaction
+    except Exception as e:
+        if debugmode:
+            print (e)
+        return -3
+
+
+# Lock files of dpkg; apt, synaptic, unattended-upgrades, etc. hold lock-frontend, dpkg itself holds lock
+dpkg_lock_files = ["/var/lib/dpkg/lock-frontend", "/var/lib/dpkg/lock"]
+
+# Error code of a transaction, which was not performed since the dpkg lock did not become free
+transaction_locked = -4
+
+# Returns the process holding one of the dpkg locks as text (e.g. "unattended-upgr (1234)") or None if the locks are
+# free. Instead of trying to take the lock (which needs root), the locks of the kernel in /proc/locks are compared with the
+# inodes of the lock files; only the inode is compared, since the device numbers differ on some file systems (btrfs).
+def get_dpkg_lock_holder(lock_files = None):
+    inodes = set()
+
+    for path in lock_files or dpkg_lock_files:
+        try:
+            inodes.add(os.stat(path).st_ino)
+        except OSError:
+            continue
+
+    try:
+        with open("/proc/locks", "r") as f:
+            locks = f.read().splitlines()
+    except OSError as e:
+        if debugmode:
+            print (e)
+        return None
+
+    # e.g. "1: POSIX  ADVISORY  WRITE 1234 08:01:1835099 0 EOF"; waiting processes have "->" after the number
+    for entry in locks:
+        fields = entry.split()
+
+        if len(fields) < 6 or fields[1] == "->":
+            continue
+
+        try:
+            if int(fields[5].rsplit(":", 1)[1]) not in inodes:
+                continue
+        except (IndexError, ValueError):
+            continue
+
+        # Name of the process (unknown, e.g. for processes of other PID namespaces)
+        try:
+            with open("/proc/%s/comm" % fields[4], "r") as f:
+                return "%s (%s)" % (f.read().strip(), fields[4])
+        except OSError:
+            return _("process %s") % fields[4]
+
+    return None
+
+# Waits until the dpkg locks are free; the locks are checked with increasing delays (delay doubles up to maxdelay) for at
+# most timeout seconds. progress is called about every second with the seconds waited, timeout, and the holder of the lock
+# (see get_dpkg_lock_holder) and may return False to stop waiting. Returns True if the locks are free.
+def wait_for_dpkg_lock(progress = None, timeout = 300, delay = 0.5, maxdelay = 15.0):
+    start = time.monotonic()
+
+    while True:
+        holder = get_dpkg_lock_holder()
+
+        if holder is None:
+            return True
+
+        if debugmode:
+            print("dpkg lock held by", holder)
+
+        if time.monotonic() - start >= timeout:
+            return False
+
+        # Sleep in steps of at most one second, so that the progress is shown regularly
+        check = min(time.monotonic() + delay, start + timeout)
+
+        while True:
+            if progress is not None and progress(time.monotonic() - start, timeout, holder) is False:
+                return False
+
+            if time.monotonic() >= check:
+                break
+
+            time.sleep(max(0.0, min(1.0, check - time.monotonic())))
+
+            if time.monotonic() >= check:
+                break
+
+        delay = min(delay * 2, maxdelay)
+
+# Merges lists of operations into one: each package appears once, at its first position, with the verb requested last;
+# a purge is not turned into a remove, though
+def merge_operations(operations):
+    merged = {}
+
+    for verb, name in operations:
+        if name in merged and merged[name] == 'purge' and verb == 'remove':
+            continue
+
+        merged[name] = verb
+
+    return [(verb, name) for name, verb in merged.items()]
+
+# Queue for transactions (e.g. of several threads of the daemon or of a fleet-wide cleanup): when the dpkg lock is held by
+# another program, the operations are not given up but wait for the lock (see wait_for_dpkg_lock). Everything queued in
+# the meantime is merged and performed in one transaction by perform, which is called with the merged operations and the
+# arguments of the first submission.
+class KittykeTransactionQueue:
+
+    def __init__(self, perform):
+        self.perform = perform
+        self.lock = threading.Lock()
+        self.committing = threading.Lock()
+        self.pending = []
+
+    # Queues operations and waits until they were performed; returns the result of perform (transaction_locked if the
+    # dpkg lock did not become free)
+    def submit(self, operations, progress = None, *arguments):
+        ticket = {'operations': operations, 'arguments': arguments, 'done': threading.Event(), 'result': transaction_locked}
+
+        with self.lock:
+            self.pending.append(ticket)
+
+        # One transaction at a time; the operations may have been performed together with others in the meantime
+        with self.committing:
+            if ticket['done'].is_set():
+                return ticket['result']
+
+            if not wait_for_dpkg_lock(progress):
+                with self.lock:
+                    self.pending.remove(ticket)
+                return transaction_locked
+
+            with self.lock:
+                batch = self.pending
+                self.pending = []
+
+            if debugmode and len(batch) > 1:
+                print("Merging %d queued transactions" % len(batch))
+
+            try:
+                result = self.perform(merge_operations([operation for entry in batch for operation in entry['operations']]), *ticket['arguments'])
+            except Exception as e:
+                if debugmode:
+                    print (e)
+                result = -3
+
+            for entry in batch:
+                entry['result'] = result
+                entry['done'].set()
+
+        return ticket['result']
+
+
+# Compares two lists of kernels and returns the differences as dictionary with the lists 'added', 'removed', and 'changed'
+# (kernels of the new list whose flags or package version are different); an empty dictionary means no differences
+def diff_kernels(old, new):
+    def state(kernel):
+        return (kernel['active'], kernel['installed'], kernel['downloaded'], kernel['pkg_version'])
+
+    old_kernels = {kernel['package']: kernel for kernel in old}
+    new_kernels = {kernel['package']: kernel for kernel in new}
+
+    diff = {'added': [kernel for package, kernel in new_kernels.items() if package not in old_kernels],
+            'removed': [kernel for package, kernel in old_kernels.items() if package not in new_kernels],
+            'changed': [kernel for package, kernel in new_kernels.items() if package in old_kernels and state(kernel) != state(old_kernels[package])]}
+
+    if len(diff['added']) + len(diff['removed']) + len(diff['changed']) == 0:
+        return {}
+
+    return diff
+
+
+# Length of the longest parts of words kept in the search index; longer search terms are looked up by their parts
+search_gram_length = 3
+
+# Returns the words of a kernel a search looks at: the full package name (which contains the version, ABI, and flavour,
+# e.g. "linux-image-4.15.0-112-lowlatency:amd64"), the package version, and the origins
+def get_kernel_search_words(kernel):
+    words = [kernel['fullname'], kernel['pkg_version']]
+
+    for label, archive, site, trusted in kernel['origins']:
+        words += [label, archive, site]
+
+    return set([word.lower() for text in words for word in text.split() if word])
+
+# Builds the search index for a list of kernels (once per refresh); every part of every word up to search_gram_length
+# characters is mapped to the set of indices of the kernels having it. The words themselves are kept for checking the
+# matches of longer search terms.
+def build_search_index(kernels):
+    grams = {}
+    words = []
+
+    # Parts of each word; many words (e.g. origins) are the same for all kernels
+    word_grams = {}
+
+    for index, kernel in enumerate(kernels):
+        kernel_words = get_kernel_search_words(kernel)
+        words.append(" ".join(kernel_words))
+
+        kernel_grams = set()
+        for word in kernel_words:
+            if word not in word_grams:
+                word_grams[word] = set([word[start:start+length] for length in range(1, search_gram_length+1) for start in range(len(word) - length + 1)])
+            kernel_grams |= word_grams[word]
+
+        for gram in kernel_grams:
+            grams.setdefault(gram, set()).add(index)
+
+    return {'grams': grams, 'words': words}
+
+# Searches the index for kernels matching all whitespace-separated terms of query (case-insensitive substrings of their
+# words); returns the sorted list of indices of the matching kernels
+def search_kernels(index, query):
+    result = None
+
+    for term in query.lower().split():
+        if len(term) <= search_gram_length:
+            matches = index['grams'].get(term, set())
+        else:
+            # Kernels having all parts of the term; start with the rarest part and check the candidates left
+            parts = sorted([index['grams'].get(term[start:start+search_gram_length], set()) for start in range(len(term) - search_gram_length + 1)], key=len)
+            matches = set.intersection(*parts)
+            matches = set([kernel for kernel in matches if term in index['words'][kernel]])
+
+        result = matches if result is None else result & matches
+
+        if not result:
+            return []
+
+    return sorted(result) if result is not None else []
+
+
 # Gets the kernel changelog as unicode string; string is empty, if something went wrong
+@with_cache_lock
 def get_kernel_changelog(fullname):
     global cache
     try:
         # Is package in cache? Then, try to retrieve and return changelog
-        if fullname in cache:
+        if fullname in get_cache():
             return cache[fullname].get_changelog()
         else:
             return ""
@@ -311,34 +1127,77 @@ def get_kernel_changelog(fullname):
             print(exc_type, fname, exc_tb.tb_lineno)
         return ""
 
-# Reads the kernel support file provided with kittykernel to calculate the month a specific kernel is still supported
-# Maybe this can be loaded from the net in future or for some distros. Ubuntu only provides a more or less convenient 
-# Wiki-page (https://wiki.ubuntu.com/Kernel/Support#Ubuntu_Kernel_Support)
-def get_kernel_support_times():
-    # Current date as month
-    now = datetime.datetime.now()
-    now = now.year*12 + now.month
+# Path of the kernel support file provided with kittykernel
+support_file = "/usr/lib/kittykernel/kernel_support"
 
-    # Create empty list
-    supportlist = []
+# Parsed kernel support files by path; each table maps (origin, major version) to the end of support as absolute month
+# (year*12 + month). It is only rebuilt when the modification time of the file changes.
+support_cache = {}
+
+# Reads the kernel support file provided with kittykernel into a lookup table (see support_cache); the file is only
+# parsed again if it was modified since the last call. An alternate root directory may have its own file. Maybe this can
+# be loaded from the net in future or for some distros. Ubuntu only provides a more or less convenient Wiki-page
+# (https://wiki.ubuntu.com/Kernel/Support#Ubuntu_Kernel_Support)
+def load_kernel_support_table(rootdir = None):
+    global support_cache, debugmode
+
+    path = get_root_file(rootdir, support_file)
+
+    # Modification time of the file; an unreadable file results in an empty table
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError as e:
+        if debugmode:
+            print (e)
+        support_cache.pop(path, None)
+        return {}
+
+    # Nothing changed? Then, just return the table parsed before
+    if path in support_cache and mtime == support_cache[path]['mtime']:
+        return support_cache[path]['table']
+
+    # Create empty table
+    table = {}
 
     # Read kernel support file (we use read.splitlines here to get rid of the "\n"; never understood why reading a text file with readlines should save the "\n"...)
-    with open("/usr/lib/kittykernel/kernel_support", "r") as f:
-        supportlist = f.read().splitlines()
+    with open(path, "r") as f:
+        for entry in f.read().splitlines():
+            # Ignore empty lines and comments
+            if len(entry) == 0 or entry.startswith("#"):
+                continue
 
-    # Remove all empty lines from list
-    supportlist = [entry for entry in supportlist if len(entry) > 0]
+            # Split lines into 4 elements separated by ','; ignore all lines for which that is not possible
+            fields = entry.split(',', 3)
+            if len(fields) != 4:
+                continue
 
-    # Remove all comments from list
-    supportlist = [entry for entry in supportlist if not entry.startswith("#")]
+            try:
+                table[(fields[0], fields[1])] = int(fields[2]) + int(fields[3])*12
+            except ValueError:
+                continue
+
+    support_cache[path] = {'mtime': mtime, 'table': table}
+
+    return table
 
-    # Split lines 4 elements separated by ','; ignore all lines for which that is not possible
-    supportlist = [{'origin': entry.split(',', 3)[0], 
-                    'version': entry.split(',', 3)[1], 
-                    'month': int(entry.split(',', 3)[2]) + int(entry.split(',', 4)[3])*12 - now} for entry in supportlist if len(entry.split(',', 3)) == 4]
+# Calculates the months a specific kernel group is still supported; returns a dictionary which maps (origin, major version)
+# to the number of months left (negative if support already expired)
+def get_kernel_support_times(rootdir = None):
+    # Current date as month
+    now = datetime.datetime.now()
+    now = now.year*12 + now.month
 
-    # Return list
-    return supportlist
+    # Return months relative to now
+    return {key: month - now for key, month in load_kernel_support_table(rootdir).items()}
+
+# Returns the number of months a kernel is still supported by looking up its origin labels and major version in the
+# dictionary returned by get_kernel_support_times; returns None if there is no entry for this kernel
+def get_kernel_support_month(support_times, kernel):
+    for label, archive, site, trusted in kernel['origins']:
+        if (label, kernel['version_major']) in support_times:
+            return support_times[(label, kernel['version_major'])]
+
+    return None
 
 
 # Invokes synaptic with gksudo to do something with packages; operations is a list of tuples such as
@@ -376,22 +1235,15 @@ def pkg_perform_operations(operations, xwindow_id = 0):
         # Write everything to the file
         f.flush()
 
-        # Synaptic command with gksudo
-        cmd = ["gksudo", "--", "/usr/sbin/synaptic", "--hide-main-window", "--non-interactive", "--parent-window-id", "%s" % xwindow_id, "-o", "Synaptic::closeZvt=true",
-                                                     "--progress-str", "\"" + _("Installing kernel packages. Please wait, this can take some time.") + "\"", 
-                                                     "--finish-str", "\"" + _("The kernel was installed.") + "\"",
-                                                     "--set-selections-file", f.name]
+        # Synaptic is run by kittykernel-cli as root, which defers update-grub and update-initramfs until synaptic is done
+        cmd = ["gksudo", "--", "/usr/lib/kittykernel/kittykecli.py", "batch", "--synaptic", "--xid", "%s" % xwindow_id, f.name]
 
         out = subprocess.Popen(' '.join(cmd), shell=True)
 
         # get output
         stdout, stderr = out.communicate()
 
-        if debugmode:
-        	print(stdout.read())
-        	print(stderr.read())
-
-        return 0
+        return out.returncode
         
 
     # If something is wrong, return error code
@@ -405,38 +1257,240 @@ def pkg_perform_operations(operations, xwindow_id = 0):
         return -3
 
 
-# Installs/Removes/Purges a list of kernels with extra package (if available) and headers
-def perform_kernels(fullnames, verb, xwindow_id = 0, headers = True, extras = True):
+# Runs synaptic (as root) with a selections file (see pkg_perform_operations); returns the exit code of synaptic. The
+# PATH of dpkg set by perform_deferred is passed on, since synaptic reads its own APT configuration.
+def synaptic_perform_selections(selections_file, xwindow_id = 0):
+    cmd = ["/usr/sbin/synaptic", "--hide-main-window", "--non-interactive", "--parent-window-id", "%s" % xwindow_id, "-o", "Synaptic::closeZvt=true",
+           "--progress-str", _("Installing kernel packages. Please wait, this can take some time."),
+           "--finish-str", _("The kernel was installed."),
+           "--set-selections-file", selections_file]
+
+    if apt_pkg.config.find("DPkg::Path"):
+        cmd.extend(["-o", "DPkg::Path=" + apt_pkg.config.find("DPkg::Path")])
+
+    return subprocess.call(cmd)
+
+
+# Directory with the stand-ins for update-grub and update-initramfs, which only note that they were called (see
+# perform_deferred)
+deferhooks_dir = "/usr/lib/kittykernel/deferhooks"
+
+# Time needed for each phase of the last transaction performed with perform_deferred (in seconds)
+transaction_timings = {}
+
+# Runs the noted calls of update-initramfs (in the order of the calls, each only once) and update-grub (once) after a
+# transaction; initramfs images are not created for kernels, which were removed later in the same transaction
+def run_deferred_hooks(state_dir, timings):
+    start = time.monotonic()
+
+    try:
+        with open(os.path.join(state_dir, "initramfs"), "r") as f:
+            calls = f.read().splitlines()
+    except OSError:
+        calls = []
+
+    done = []
+    for call in calls:
+        arguments = call.split()
+
+        if call in done or len(arguments) == 0:
+            continue
+        done.append(call)
+
+        # Kernel is gone? Then, there is nothing to create or update
+        if '-k' in arguments and '-d' not in arguments and arguments.index('-k') + 1 < len(arguments):
+            version = arguments[arguments.index('-k') + 1]
+            if version != 'all' and not os.path.exists("/boot/vmlinuz-" + version):
+                continue
+
+        subprocess.call(["/usr/sbin/update-initramfs"] + arguments)
+
+    timings['initramfs'] = time.monotonic() - start
+    start = time.monotonic()
+
+    if os.path.exists(os.path.join(state_dir, "grub")):
+        subprocess.call(["/usr/sbin/update-grub"])
+
+    timings['grub'] = time.monotonic() - start
+
+# Performs a transaction (function called with arguments; has to be run as root) with update-grub and update-initramfs
+# deferred: the kernel hooks of the packages call the stand-ins in deferhooks_dir, which only note the calls, and these
+# are run once at the end. So, removing ten kernels regenerates the GRUB menu once, not ten times. Returns the result of
+# function; the time needed for each phase ('transaction', 'initramfs', 'grub') is saved in transaction_timings.
+def perform_deferred(function, *arguments):
+    global transaction_timings, debugmode
+
+    timings = {'transaction': 0.0, 'initramfs': 0.0, 'grub': 0.0}
+    state_dir = tempfile.mkdtemp(prefix="kittykernel-defer-")
+
+    # The environment is inherited by dpkg and the maintainer scripts; APT sets the PATH for dpkg from DPkg::Path, though
+    environment = {key: os.environ.get(key) for key in ['PATH', 'KITTYKERNEL_DEFER_DIR']}
+    os.environ['PATH'] = deferhooks_dir + ":" + os.environ.get('PATH', "/usr/sbin:/usr/bin:/sbin:/bin")
+    os.environ['KITTYKERNEL_DEFER_DIR'] = state_dir
+
+    dpkg_path = apt_pkg.config.find("DPkg::Path")
+    apt_pkg.config.set("DPkg::Path", deferhooks_dir + ":" + (dpkg_path or "/usr/sbin:/usr/bin:/sbin:/bin"))
+
+    try:
+        start = time.monotonic()
+        result = function(*arguments)
+        timings['transaction'] = time.monotonic() - start
+
+    finally:
+        for key, value in environment.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+        if dpkg_path:
+            apt_pkg.config.set("DPkg::Path", dpkg_path)
+        else:
+            apt_pkg.config.clear("DPkg::Path")
+
+        # Even a failed transaction may have changed some kernels
+        run_deferred_hooks(state_dir, timings)
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+        transaction_timings = timings
+
+        if debugmode:
+            print("Transaction timings: ", timings)
+
+    return result
+
+
+# Installs local .deb files (e.g. downloaded mainline kernels) with dpkg via gksudo after waiting for the dpkg lock (see
+# wait_for_dpkg_lock for progress); returns 0 on success and an error code otherwise
+def install_deb_files(paths, xwindow_id = 0, progress = None):
+    global debugmode
+
+    if debugmode:
+        print("install_deb_files: ", paths)
+
+    if len(paths) == 0:
+        return -1
+
+    # dpkg does not wait for the lock itself
+    if not wait_for_dpkg_lock(progress):
+        return transaction_locked
+
+    try:
+        # dpkg command with gksudo
+        cmd = ["gksudo", "--", "/usr/bin/dpkg", "-i"] + [shlex.quote(path) for path in paths]
+
+        return subprocess.call(' '.join(cmd), shell=True)
+
+    # If something is wrong, return error code
+    except Exception as e:
+        if debugmode:
+            print (e)
+        return -3
+
+
+# Performs operations (see pkg_perform_operations) directly with APT, i.e. without synaptic and without any window;
+# this is meant for unattended use and has to be run as root. Returns 0 on success and an error code otherwise.
+@with_cache_lock
+def apt_perform_operations(operations):
     global cache, debugmode
+
+    if debugmode:
+        print("apt_perform_operations: ", operations)
+
+    if type(operations) is not list:
+        return -1
+
+    if len(operations) > 0 and type(operations[0]) is not tuple:
+        return -2
+
     try:
-        if debugmode:        
-            print("Perform_kernels:", fullnames, verb)
+        # Mark each package in the cache; packages of a foreign architecture are given with it (see get_kernel_operations),
+        # since a short name is the package of the native architecture
+        with get_cache().actiongroup():
+            for verb, name in operations:
+                if name not in cache:
+                    continue
+
+                if verb == 'install':
+                    cache[name].mark_install()
+                elif verb in ['remove', 'purge']:
+                    cache[name].mark_delete(purge = (verb == 'purge'))
+
+        # Download and install/remove everything in one transaction; update-grub and update-initramfs run once at the end
+        if cache.get_changes():
+            perform_deferred(cache.commit)
+
+        # Reread the cache afterwards
+        cache.open(None)
+
+        return 0
+
+    # If something is wrong, return error code
+    except Exception as e:
+        if debugmode:
+            print (e)
+            print(sys.exc_info())
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            print(exc_type, fname, exc_tb.tb_lineno)
+
+        # Undo the marks; the cache is not there if it could not be opened
+        if cache is not None:
+            cache.clear()
+        return -3
+
+
+# Queues of the transactions performed by synaptic (via gksudo) and directly by APT (as root)
+synaptic_queue = KittykeTransactionQueue(pkg_perform_operations)
+apt_queue = KittykeTransactionQueue(apt_perform_operations)
+
+
+# Returns the list of operations for installing/removing/purging a list of kernels with extra package (if available) and
+# headers, e.g. [('purge', 'linux-image-4.15.0-20-generic'), ('purge', 'linux-modules-4.15.0-20-generic'), ...]; the
+# packages of a foreign architecture keep it (e.g. linux-image-4.15.0-20-generic:i386)
+@with_cache_lock
+def get_kernel_operations(fullnames, verb, headers = True, extras = True):
+    global cache
 
-        # Our operation list
-        operations = []
+    # Our operation list
+    operations = []
 
-        # For each package name check if headers and extras are available and add to list
-        for pkg in fullnames:
+    get_cache()
 
-            # Is package in cache? Then, ask synaptic to install it
-            if pkg in cache:
-                # Create list of packages to install including headers, modules, extras
-                pkg_list = [cache[pkg].name, cache[pkg].name.replace("-image-", "-modules-")]
+    matcher, families = get_kernel_matcher()
 
-                if headers:
-                    pkg_list.append(cache[pkg].name.replace("-image-", "-headers-"))
+    # For each package name check if headers and extras are available and add to list
+    for pkg in fullnames:
 
-                if extras:
-                    pkg_list.append(cache[pkg].name.replace("-image-", "-image-extra-"))
-                    pkg_list.append(cache[pkg].name.replace("-image-", "-modules-extra-"))
+        # Is package in cache? Then, ask synaptic to install it
+        if pkg in cache:
+            # Create list of packages to install including headers, modules, extras; these are derived from the ABI. The
+            # name of a package has its architecture only if it is a foreign one.
+            pkg_list = [cache[pkg].name]
 
-                # Add to operations
-                for entry in pkg_list:
-                    if entry in cache:
-                        operations.append( (verb, entry) )
+            match = matcher.match(cache[pkg].shortname)
+            if match is not None:
+                qualifier = get_architecture_qualifier(cache[pkg].name)
+                pkg_list.extend([name + qualifier for name in get_kernel_companions(match.group('abi'), headers, extras)])
+
+            # Add to operations
+            for entry in pkg_list:
+                if entry in cache:
+                    operations.append( (verb, entry) )
+
+    return operations
+
+
+# Installs/Removes/Purges a list of kernels with extra package (if available) and headers; returns 0 on success and an
+# error code otherwise (see perform_operations)
+def perform_kernels(fullnames, verb, xwindow_id = 0, headers = True, extras = True, progress = None):
+    global debugmode
+    try:
+        if debugmode:        
+            print("Perform_kernels:", fullnames, verb)
 
         # Perform actions
-        return pkg_perform_operations(operations, xwindow_id)         
+        return perform_operations(load_kernel_operations(fullnames, verb, headers, extras), xwindow_id, progress)         
 
     # If something is wrong, return an empty list
     except Exception as e:
@@ -449,10 +1503,158 @@ def perform_kernels(fullnames, verb, xwindow_id = 0, headers = True, extras = Tr
         return -1
 
 
+# Sort key for kernels, which compares the version numbers as numbers (i.e. 4.15.0.112 is newer than 4.15.0.99)
+def kernel_version_key(kernel):
+    return [int(x) for x in kernel['version'].split('.') if x.isdigit()]
+
+# Plans the cleanup of /boot: computes the smallest set of kernels, which have to be removed (verb 'remove') or purged
+# (verb 'purge') to have at least target_free bytes free on /boot. The active kernel and the newest keep_per_group
+# installed kernels of each group are never touched. The kernels freeing the most space in /boot (ties are broken by
+# their installed size) are chosen first, which gives the least number of kernels. usage and free are the results of
+# get_boot_usage and sizeof_boot()[0] and are determined if not given. Returns a dictionary with the chosen kernels,
+# the operations for a single batched transaction, the bytes freed on /boot, the expected free space afterwards, and
+# whether the target can be reached at all.
+def plan_boot_cleanup(kernels, target_free, keep_per_group = 1, verb = 'purge', usage = None, free = None):
+    if usage is None:
+        usage = get_boot_usage()
+
+    if free is None:
+        free = sizeof_boot()[0]
+
+    plan = {'kernels': [], 'operations': [], 'freed': 0, 'free_after': free, 'sufficient': free >= target_free}
+
+    # Nothing to do?
+    if plan['sufficient']:
+        return plan
+
+    # Count the kernels per group from the newest to the oldest and collect everything beyond the ones to keep
+    kept = {}
+    candidates = []
+
+    for kernel in sorted(kernels, key=kernel_version_key, reverse=True):
+        if not (kernel['installed'] or (verb == 'purge' and kernel['downloaded'])):
+            continue
+
+        if kernel['installed'] and kept.get(kernel['version_major'], 0) < keep_per_group:
+            kept[kernel['version_major']] = kept.get(kernel['version_major'], 0) + 1
+            continue
+
+        # The active kernel is _never_ touched, neither are kernels meta-packages depend on; kernels without files in
+        # /boot would not help either
+        if kernel['active'] or kernel.get('protected_by') or get_kernel_boot_size(usage, kernel) == 0:
+            continue
+
+        candidates.append(kernel)
+
+    # Take the kernels freeing most space first until the target is reached
+    candidates.sort(key=lambda kernel: (get_kernel_boot_size(usage, kernel), kernel['installed_size']), reverse=True)
+
+    for kernel in candidates:
+        if plan['free_after'] >= target_free:
+            break
+
+        plan['kernels'].append(kernel)
+        plan['freed'] += get_kernel_boot_size(usage, kernel)
+        plan['free_after'] += get_kernel_boot_size(usage, kernel)
+
+    plan['sufficient'] = plan['free_after'] >= target_free
+
+    # One transaction for all kernels
+    plan['operations'] = load_kernel_operations([kernel['fullname'] for kernel in plan['kernels']], verb)
+
+    return plan
+
+
+# Reads the retention rules for unattended cleanups from the config (see load_config); the rules are:
+#   keep_newest      number of installed kernels to keep per group (the newest ones), also in groups with expired support
+#   keep_supported   additionally keep the newest kernel of each group, which is still supported (or has no entry in the
+#                    support file), even if keep_newest is 0
+#   purge_leftovers  purge kernels, which were removed but still have config files on the system
+#   verb             what to do with all other kernels ('remove' or 'purge')
+# The active kernel and kernels installed meta-packages depend on are always kept.
+def get_retention_rules(config):
+    return {'keep_newest': int(config['Policy']['keepnewest']),
+            'keep_supported': config['Policy']['keepsupported'] == 'ok',
+            'purge_leftovers': config['Policy']['purgeleftovers'] == 'ok',
+            'verb': config['Policy']['verb'] if config['Policy']['verb'] in ['remove', 'purge'] else 'remove'}
+
+# Evaluates the retention rules (see get_retention_rules) for a list of kernels in a single pass; returns a dictionary with
+# the lists 'keep', 'remove', and 'purge', which contain tuples (kernel, reason). Kernels, which are neither installed nor
+# have config files left, do not appear at all.
+def evaluate_retention_policy(kernels, rules, support_times = None):
+    if support_times is None:
+        support_times = get_kernel_support_times()
+
+    decision = {'keep': [], 'remove': [], 'purge': []}
+
+    # Number of kernels kept per group so far
+    kept = {}
+
+    # Go from newest to oldest, so that the first kernels of each group are the ones to keep
+    for kernel in sorted(kernels, key=kernel_version_key, reverse=True):
+        # The active kernel is _never_ touched
+        if kernel['active']:
+            decision['keep'].append( (kernel, 'active') )
+            kept[kernel['version_major']] = kept.get(kernel['version_major'], 0) + 1
+
+        # Removing it would remove the meta-packages as well
+        elif kernel['installed'] and kernel.get('protected_by'):
+            decision['keep'].append( (kernel, 'protected') )
+            kept[kernel['version_major']] = kept.get(kernel['version_major'], 0) + 1
+
+        elif kernel['installed']:
+            # Support expired for this group? Its newest kernels are kept anyway, so that there is always something to boot
+            month = get_kernel_support_month(support_times, kernel)
+            expired = month is not None and month < 0
+
+            if kept.get(kernel['version_major'], 0) < rules['keep_newest']:
+                decision['keep'].append( (kernel, 'newest') )
+                kept[kernel['version_major']] = kept.get(kernel['version_major'], 0) + 1
+            elif rules['keep_supported'] and not expired and kept.get(kernel['version_major'], 0) == 0:
+                decision['keep'].append( (kernel, 'supported') )
+                kept[kernel['version_major']] = 1
+            elif expired:
+                decision[rules['verb']].append( (kernel, 'expired') )
+            else:
+                decision[rules['verb']].append( (kernel, 'old') )
+
+        elif kernel['downloaded'] and rules['purge_leftovers']:
+            decision['purge'].append( (kernel, 'leftover') )
+
+    return decision
+
+# Evaluates the retention rules and performs the resulting operations in one transaction via APT (needs root); nothing
+# is changed in dry-run mode. If the dpkg lock is held (e.g. by unattended-upgrades), the transaction waits for it (see
+# apt_queue; progress is called while waiting). Returns a tuple of the decision (see evaluate_retention_policy) and the
+# return code of apt_perform_operations (0 for dry-runs or if there is nothing to do).
+def apply_retention_policy(kernels, rules, dry_run = True, support_times = None, progress = None):
+    decision = evaluate_retention_policy(kernels, rules, support_times)
+
+    operations = get_kernel_operations([kernel['fullname'] for kernel, reason in decision['remove']], 'remove') \
+               + get_kernel_operations([kernel['fullname'] for kernel, reason in decision['purge']], 'purge')
+
+    if dry_run or len(operations) == 0:
+        return (decision, 0)
+
+    return (decision, apt_queue.submit(operations, progress))
+
+
+# Path of the user's blacklist
+blacklist_file = os.path.expanduser("~/.config/kittykernel/blacklist")
+
+# Returns the modification time of the user's blacklist (None if there is no blacklist); used to notice changes
+def get_blacklist_mtime():
+    try:
+        return os.stat(blacklist_file).st_mtime
+    except OSError:
+        return None
+
 # Opens and loads the filter list from ~/.config/kittykernel/blacklist; will create an empty file if the file does not exist!
-def load_blacklist():
-    # Blacklist path
-    blacklist_file = os.path.expanduser("~/.config/kittykernel/blacklist")
+def load_blacklist(rootdir = None):
+    # An alternate root directory is never changed; its own default blacklist (or ours) is used as it is
+    if rootdir is not None:
+        with open(get_root_file(rootdir, "/usr/lib/kittykernel/blacklist_default"), "r") as f:
+            return parse_blacklist(f.read().splitlines())
 
     # Create directory if it does not exist, yet
     os.makedirs(os.path.dirname(blacklist_file), exist_ok=True)
@@ -476,6 +1678,10 @@ def load_blacklist():
         f.seek(0)
         blacklist = f.read().splitlines()
 
+    return parse_blacklist(blacklist)
+
+# Parses the lines of a blacklist file into a list of dictionaries with 'keyword' and 'pattern'
+def parse_blacklist(blacklist):
     # Remove all empty lines from list
     blacklist = [entry for entry in blacklist if len(entry) > 0]
 
@@ -488,6 +1694,15 @@ def load_blacklist():
     # Return cleaned list
     return blacklist
 
+# Applies a changed blacklist to a kernel list, which was filtered with the old blacklist before; if entries were only
+# added, just the filtered list has to be checked against the new entries. Otherwise, the complete (unfiltered) list is
+# filtered again.
+def reapply_blacklist(kernels, filtered, old_blacklist, new_blacklist):
+    if all([entry in new_blacklist for entry in old_blacklist]):
+        return apply_blacklist(filtered, [entry for entry in new_blacklist if entry not in old_blacklist])
+
+    return apply_blacklist(kernels, new_blacklist)
+
 # Applies a blacklist to a kernel list
 def apply_blacklist(kernels, blacklist):
     global debugmode
@@ -528,6 +1743,30 @@ def apply_blacklist(kernels, blacklist):
     return kernels_filtered
 
 
+# Scans an alternate root directory (e.g. a chroot or a mounted disk of a VM) and returns a dictionary with the root, its
+# kernels (blacklist applied), the size of its /boot (free, total), the kernel files in /boot, and the support times;
+# 'error' is set if something went wrong. This is run in a separate process by scan_roots.
+def scan_root(rootdir):
+    try:
+        kernels = apply_blacklist(get_kernels(rootdir), load_blacklist(rootdir))
+
+        return {'root': rootdir, 'kernels': kernels, 'boot': sizeof_boot(os.path.join(rootdir, "boot")),
+                'boot_usage': get_boot_usage(os.path.join(rootdir, "boot")), 'support_times': get_kernel_support_times(rootdir)}
+
+    except Exception as e:
+        if debugmode:
+            print (e)
+        return {'root': rootdir, 'error': str(e)}
+
+# Scans many alternate root directories at once (see scan_root); reading an APT cache is CPU-bound, so each root is scanned
+# in its own process. Each process only scans one root, since APT keeps its configuration (e.g. from the root's apt.conf)
+# in the process. Yields the results in the order they are finished.
+def scan_roots(rootdirs, max_workers = None):
+    with multiprocessing.Pool(max_workers, maxtasksperchild = 1) as pool:
+        for result in pool.imap_unordered(scan_root, rootdirs):
+            yield result
+
+
 # Script file is run directly... then let's have some test outputs here
 if __name__ == '__main__':
     print("Script was called directly. Testing...")
@@ -541,12 +1780,15 @@ if __name__ == '__main__':
     # Root?
     if os.getuid() == 0:
         print("Script was called as root.")
-        refresh_cache()
+        update_package_lists()
 
     print("Current kernel: ", get_current_kernel())
     print("Size of boot: ", sizeof_boot())
+    print("Kernel files in boot: ", get_boot_usage())
+    print("Resident memory before opening the cache: ", sizeof_fmt(get_rss()))
     kernels = get_kernels()
     print("Kernel list: ", )
+    print("Resident memory with cache: ", sizeof_fmt(get_rss()))
 
     if len(kernels) > 0:
         print("Changelog of first entry %s:" % kernels[0]["fullname"], get_kernel_changelog(kernels[0]["fullname"]))
@@ -562,6 +1804,9 @@ if __name__ == '__main__':
 
     print("Get support list:", get_kernel_support_times())
 
+    release_cache()
+    print("Resident memory after releasing the cache: ", sizeof_fmt(get_rss()))
+
     print("Config parser: ")
     load_config()
 
@@ -0,0 +1,254 @@
+#!/usr/bin/python3
+
+#  kittykernel
+#
+#  Copyright (C) 2017 by Sven Kochmann, available at Github:
+#  <https://www.github.com/Schallaven/kittykernel/>
+#
+#  This program is free software;  you can redistribute it and/or modify
+#  it under the terms of the  GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  This program is  distributed in the hope that it  will be useful, but
+#  WITHOUT  ANY   WARRANTY;  without   even  the  implied   warranty  of
+#  MERCHANTABILITY  or FITNESS FOR  A PARTICULAR  PURPOSE.  See  the GNU
+#  General Public License for more details.
+#
+#  You should  have received  a copy of  the GNU General  Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#  kittykernel daemon; keeps the APT cache and the list of kernels in
+#  memory and answers requests of the GUI and the command line interface
+#  on a UNIX socket (see kittykecore.daemon_request for the protocol)
+#
+#
+#  Warning: Don't read this  source file if  you are annoyed by too many
+#           comments. Read source code  of other FOSS projects  instead.
+#
+
+import os
+import sys
+import grp
+import pwd
+import json
+import struct
+import socket
+import argparse
+import threading
+import socketserver
+
+import kittykecore
+import kittykewatch
+
+
+# The APT cache is not thread-safe, so only one request at a time may use it
+cache_lock = threading.Lock()
+
+# List of kernels as returned by get_kernels and the modification times of the dpkg status and the APT lists it was read
+# with; kept up to date by the watcher (see on_system_changed) and refresh_if_changed
+inventory = {'kernels': [], 'mtimes': None}
+
+# Files whose changes make the inventory outdated
+inventory_files = ["/var/lib/dpkg/status", "/var/lib/apt/lists"]
+
+# Group whose members may perform transactions (besides root); empty if only root may do that
+transaction_group = ""
+
+
+# Returns the modification times of the inventory files
+def get_inventory_mtimes():
+    mtimes = []
+
+    for path in inventory_files:
+        try:
+            mtimes.append(os.stat(path).st_mtime)
+        except OSError:
+            mtimes.append(None)
+
+    return mtimes
+
+# Reads the list of kernels from the (reopened) cache
+def refresh_inventory():
+    with cache_lock:
+        mtimes = get_inventory_mtimes()
+
+        if kittykecore.cache is None:
+            kittykecore.get_cache()
+        else:
+            kittykecore.cache.open(None)
+
+        inventory['kernels'] = kittykecore.get_kernels()
+        inventory['mtimes'] = mtimes
+
+# Rereads the cache before answering a request, if dpkg or APT changed something the watcher did not report yet (it
+# waits until the changes are over)
+def refresh_if_changed():
+    if get_inventory_mtimes() != inventory['mtimes']:
+        refresh_inventory()
+
+# Called by the watcher (in its thread) after dpkg or APT changed something, e.g. a transaction of synaptic
+def on_system_changed(kinds):
+    if 'dpkg' in kinds or 'lists' in kinds:
+        refresh_if_changed()
+
+# Performs operations with APT; the cache must not be reread meanwhile
+def perform_operations(operations):
+    with cache_lock:
+        return kittykecore.apt_perform_operations(operations)
+
+# Transactions of all clients; requests arriving while the dpkg lock is held by another program are merged into one
+transaction_queue = kittykecore.KittykeTransactionQueue(perform_operations)
+
+
+# Verbs of the operations clients may ask for
+allowed_verbs = ['install', 'remove', 'purge']
+
+# Checks the operations of a transaction and returns them as list of tuples (verb, package); only the packages of the
+# kernels in the inventory (image, modules, extras, headers) may be installed, removed, or purged. Raises ValueError
+# for anything else, since the daemon runs as root.
+def check_operations(operations):
+    allowed = set([name for kernel in inventory['kernels'] for name in kittykecore.get_kernel_package_names(kernel)])
+    checked = []
+
+    for operation in operations:
+        if not isinstance(operation, (list, tuple)) or len(operation) != 2:
+            raise ValueError("Invalid operation: %s" % (operation,))
+
+        verb, name = operation
+
+        if verb not in allowed_verbs:
+            raise ValueError("Invalid verb: %s" % verb)
+
+        if not isinstance(name, str) or not kittykecore.kernel_package_name.match(name) or name not in allowed:
+            raise ValueError("Not a package of a known kernel: %s" % name)
+
+        checked.append((verb, name))
+
+    return checked
+
+# Returns True if the user with the given uid may perform transactions
+def may_perform(uid):
+    if uid == 0:
+        return True
+
+    if transaction_group == "":
+        return False
+
+    try:
+        user = pwd.getpwuid(uid)
+        group = grp.getgrnam(transaction_group)
+        return user.pw_gid == group.gr_gid or user.pw_name in group.gr_mem
+    except KeyError:
+        return False
+
+
+# Handles the requests of a single connection; each line is one request
+class KittykeRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        # Who is on the other side?
+        pid, uid, gid = struct.unpack("3i", self.request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")))
+
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode("utf-8"))
+                response = {'result': self.execute(request, uid)}
+            except Exception as e:
+                if kittykecore.debugmode:
+                    print (e)
+                response = {'error': str(e), 'type': type(e).__name__}
+
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+    # Executes a request and returns the result
+    def execute(self, request, uid):
+        command = request.get('command')
+
+        if kittykecore.debugmode:
+            print("Request from %d: " % uid, command)
+
+        if command == 'ping':
+            return 'pong'
+
+        # The unfiltered list of kernels; the blacklist is applied by the client since every user has their own
+        if command == 'kernels':
+            refresh_if_changed()
+            return inventory['kernels']
+
+        # Only the changelogs of the known kernels are downloaded
+        if command == 'changelog':
+            refresh_if_changed()
+
+            if request.get('fullname') not in [kernel['fullname'] for kernel in inventory['kernels']]:
+                raise ValueError("Unknown kernel: %s" % request.get('fullname'))
+
+            with cache_lock:
+                return kittykecore.get_kernel_changelog(request['fullname'])
+
+        # Operations for installing/removing/purging kernels (see kittykecore.get_kernel_operations)
+        if command == 'operations':
+            refresh_if_changed()
+            with cache_lock:
+                return kittykecore.get_kernel_operations(request['fullnames'], request['verb'], request.get('headers', True), request.get('extras', True))
+
+        # Rereads the cache, e.g. after packages were installed
+        if command == 'refresh':
+            refresh_inventory()
+            return len(inventory['kernels'])
+
+        # Installs/removes/purges packages of kernels; operations is a list of [verb, package]
+        if command == 'perform':
+            if not may_perform(uid):
+                raise PermissionError("Not allowed to perform transactions")
+
+            refresh_if_changed()
+            result = transaction_queue.submit(check_operations(request['operations']))
+
+            refresh_inventory()
+            return result
+
+        raise ValueError("Unknown command: %s" % command)
+
+
+# Server, which handles each connection in its own thread
+class KittykeServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+# Script file is run directly; starts the daemon
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog="kittykedaemon", description="kittykernel daemon")
+    parser.add_argument("--socket", default=kittykecore.daemon_socket, help="path of the socket")
+    parser.add_argument("--group", default="", help="group whose members may install and remove kernels")
+    parser.add_argument("--debug", action="store_true", help="show debug output")
+    args = parser.parse_args()
+
+    kittykecore.debugmode = args.debug
+    transaction_group = args.group
+
+    # Load cache and kernels before anybody asks
+    refresh_inventory()
+
+    # Keep them up to date when other programs change packages
+    try:
+        kittykewatch.KittykeWatcher(on_system_changed).start()
+    except OSError as e:
+        if kittykecore.debugmode:
+            print (e)
+
+    # Remove old socket (e.g. after a crash)
+    os.makedirs(os.path.dirname(args.socket), exist_ok=True)
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+
+    server = KittykeServer(args.socket, KittykeRequestHandler)
+
+    # Everybody may ask; transactions are checked per request
+    os.chmod(args.socket, 0o666)
+
+    try:
+        server.serve_forever()
+    finally:
+        os.remove(args.socket)
@@ -0,0 +1,250 @@
+#!/usr/bin/python3
+
+#  kittykernel
+#
+#  Copyright (C) 2017 by Sven Kochmann, available at Github:
+#  <https://www.github.com/Schallaven/kittykernel/>
+#
+#  This program is free software;  you can redistribute it and/or modify
+#  it under the terms of the  GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  This program is  distributed in the hope that it  will be useful, but
+#  WITHOUT  ANY   WARRANTY;  without   even  the  implied   warranty  of
+#  MERCHANTABILITY  or FITNESS FOR  A PARTICULAR  PURPOSE.  See  the GNU
+#  General Public License for more details.
+#
+#  You should  have received  a copy of  the GNU General  Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#  Downloads packages, e.g. the .deb files of mainline kernels, into a
+#  local store, in which each file is saved under its SHA256 checksum
+#
+#
+#  Warning: Don't read this  source file if  you are annoyed by too many
+#           comments. Read source code  of other FOSS projects  instead.
+#
+
+import os
+import sys
+import time
+import fcntl
+import hashlib
+import threading
+import urllib.request
+import urllib.error
+import concurrent.futures
+
+import kittykecore
+
+
+# Default path of the local store; can be shared between machines (e.g. via NFS), so that a package is only
+# downloaded once
+store_dir = os.path.expanduser("~/.cache/kittykernel/store")
+
+# Number of bytes read from the network at once
+chunk_size = 65536
+
+
+# Limits the bandwidth of one or more downloads (e.g. the threads of download_files) to rate bytes per second; every
+# download calls consume after each chunk, which waits until the chunk is within the limit. A rate of 0 means no limit.
+class RateLimiter():
+
+    def __init__(self, rate = 0):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.total = 0
+
+    # Accounts size bytes and waits as long as necessary
+    def consume(self, size):
+        if self.rate <= 0:
+            return
+
+        with self.lock:
+            self.total += size
+            delay = self.start + self.total / float(self.rate) - time.monotonic()
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+# Parses a CHECKSUMS file of the mainline archive and returns a dictionary, which maps the file names to their
+# SHA256 checksums; the file has sections for different checksums, e.g.
+#   # Checksums-Sha1:
+#   <sha1>  <file>
+#   # Checksums-Sha256:
+#   <sha256>  <file>
+def parse_checksums(text):
+    checksums = {}
+    section = ""
+
+    for line in text.splitlines():
+        if line.startswith("#"):
+            section = line.lower()
+            continue
+
+        fields = line.split()
+
+        # SHA256 checksums have 64 hex digits; this works even when the file has no sections at all
+        if len(fields) == 2 and len(fields[0]) == 64 and ("sha256" in section or section == ""):
+            checksums[fields[1].lstrip("*")] = fields[0].lower()
+
+    return checksums
+
+# Downloads a CHECKSUMS file and returns the dictionary of parse_checksums
+def fetch_checksums(url):
+    request = urllib.request.Request(url, headers={'User-Agent': 'kittykernel'})
+
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return parse_checksums(response.read().decode("utf-8", errors="replace"))
+
+
+# Returns the first byte of a Content-Range header (e.g. 500 for "bytes 500-999/1000"); None if there is none
+def get_range_start(content_range):
+    try:
+        return int(content_range.split()[1].split("-")[0])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+# Returns the path of a file with the given SHA256 checksum in the store
+def store_path(sha256, store = None):
+    return os.path.join(store or store_dir, "sha256", sha256[:2], sha256)
+
+# Downloads a single file into the store and returns its path there; nothing is downloaded if the store has the file
+# already. The checksum is calculated while downloading. An interrupted download is resumed with a Range request the
+# next time (unless resume is False). progress is called with the number of new bytes for each chunk; limiter (see
+# RateLimiter) limits the bandwidth. Raises an exception if the download fails or the checksum does not match. Other
+# programs downloading the same file (e.g. the GUI and the prefetch timer) wait until this download finished.
+def download_file(url, sha256, store = None, progress = None, limiter = None, resume = True):
+    target = store_path(sha256, store)
+
+    # Already in store?
+    if os.path.isfile(target):
+        return target
+
+    partial = os.path.join(store or store_dir, "partial", sha256 + ".part")
+    os.makedirs(os.path.dirname(partial), exist_ok=True)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+
+    # The partial file is removed or replaced by a download, so the lock is taken on a file next to it, which stays
+    with open(partial + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        # Downloaded by someone else in the meantime?
+        if os.path.isfile(target):
+            return target
+
+        path = download_partial(url, sha256, partial, target, progress, limiter, resume)
+
+        # Everyone waiting finds the file in the store now
+        os.remove(partial + ".lock")
+
+        return path
+
+# Downloads a file into the partial file and moves it to target (see download_file, which holds the lock of the partial
+# file); returns target
+def download_partial(url, sha256, partial, target, progress, limiter, resume):
+    # Continue the checksum with the bytes downloaded before
+    checksum = hashlib.sha256()
+    offset = 0
+
+    if os.path.isfile(partial) and not resume:
+        os.remove(partial)
+
+    if os.path.isfile(partial):
+        with open(partial, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                checksum.update(chunk)
+                offset += len(chunk)
+
+    request = urllib.request.Request(url, headers={'User-Agent': 'kittykernel'})
+
+    if offset > 0:
+        request.add_header('Range', 'bytes=%d-' % offset)
+
+    try:
+        response = urllib.request.urlopen(request, timeout=30)
+
+    except urllib.error.HTTPError as e:
+        # Range not satisfiable? The partial file is probably complete or broken; start again
+        if e.code == 416:
+            return download_partial(url, sha256, partial, target, progress, limiter, False)
+        raise
+
+    with response:
+        # Server ignored the range (200)? Then, the whole file comes and the partial file is overwritten
+        if offset > 0 and response.status != 206:
+            checksum = hashlib.sha256()
+            offset = 0
+
+        # Server sent another range than asked for (e.g. "bytes 0-999/1000" instead of "bytes 500-999/1000")? Then, the
+        # data cannot be appended; start again without resuming
+        elif offset > 0 and get_range_start(response.headers.get('Content-Range')) != offset:
+            response.close()
+            return download_partial(url, sha256, partial, target, progress, limiter, False)
+
+        with open(partial, "ab" if offset > 0 else "wb") as f:
+            for chunk in iter(lambda: response.read(chunk_size), b""):
+                checksum.update(chunk)
+                f.write(chunk)
+
+                if progress is not None:
+                    progress(len(chunk))
+
+                if limiter is not None:
+                    limiter.consume(len(chunk))
+
+    # Wrong checksum? Then, remove the file; it cannot be resumed
+    if checksum.hexdigest() != sha256.lower():
+        os.remove(partial)
+        raise ValueError("Checksum mismatch for %s" % url)
+
+    os.replace(partial, target)
+
+    return target
+
+# Downloads several files at once with at most max_connections connections; files is a list of tuples (url, sha256).
+# progress is called with the total number of bytes downloaded so far (from the download threads!); rate limits the
+# bandwidth of all downloads together (bytes per second, 0 for no limit). Returns the list of paths in the store (same
+# order as files); raises the first exception of any download.
+def download_files(files, max_connections = 4, store = None, progress = None, rate = 0):
+    lock = threading.Lock()
+    limiter = RateLimiter(rate)
+    downloaded = [0]
+
+    # Sum up the progress of all downloads
+    def chunk_progress(size):
+        with lock:
+            downloaded[0] += size
+            total = downloaded[0]
+
+        if progress is not None:
+            progress(total)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_connections) as executor:
+        futures = [executor.submit(download_file, url, sha256, store, chunk_progress, limiter) for url, sha256 in files]
+
+        return [future.result() for future in futures]
+
+# Downloads all packages of a mainline kernel (see kittykemainline.get_index_kernels) and returns their paths in the
+# store; the checksums are taken from the CHECKSUMS file of the kernel. Returns an empty list if something went wrong.
+def download_kernel(kernel, max_connections = 4, store = None, progress = None):
+    try:
+        checksums = fetch_checksums(kernel['checksums'])
+
+        # Every package needs a checksum
+        files = [(url, checksums[os.path.basename(url)]) for url in kernel['debs']]
+
+        return download_files(files, max_connections, store, progress)
+
+    except Exception as e:
+        if kittykecore.debugmode:
+            print (e)
+            print(sys.exc_info())
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            print(exc_type, fname, exc_tb.tb_lineno)
+        return []
@@ -30,7 +30,12 @@ import os
 import sys
 import gi
 import re
+import time
 import subprocess
+import shlex
+import shutil
+import tempfile
+import threading
 from enum import Enum;
 
 gi.require_version('Gtk', '3.0')
@@ -39,6 +44,19 @@ gi.require_version('GdkX11', '3.0')
 from gi.repository import Gtk, Gdk, GdkPixbuf, GdkX11, Gio, Pango, GLib
 
 import kittykecore
+import kittykemainline
+import kittykedownload
+import kittykewatch
+import kittykechangelog
+import kittykeoval
+
+
+# The glade file with the main window and the dialogs
+ui_file = "/usr/lib/kittykernel/kittykernel.ui"
+
+# Objects needed for showing the main window (the window itself and the images used by its buttons); everything else
+# (the dialogs) is loaded when it is used for the first time
+ui_main_objects = ["kittykewindow", "image1", "image2", "image6"]
 
 
 # Identifiers for columns of the kernel group list
@@ -66,20 +84,53 @@ class KittykeMainWindow():
     # Setup the UI and some parameters
     def __init__(self):
         try:
+            # Start time; used for measuring how long the window needs to show up and to show the kernels
+            self.start_time = time.monotonic()
+
             # Read config from file
             self.config = kittykecore.load_config()    
 
             # Read blacklist
             self.blacklist = kittykecore.load_blacklist()
+            self.blacklist_mtime = kittykecore.get_blacklist_mtime()
+
+            # List of all kernels (without blacklist applied); kept for applying a changed blacklist
+            self.kernels_all = []
+
+            # Number of CVEs not fixed per kernel (see kittykeoval.count_unfixed_kernels)
+            self.unfixed = {}
+
+            # Search index of the shown kernels (see kittykecore.build_search_index)
+            self.search_index = kittykecore.build_search_index([])
 
-            # Create the GtkBuilder with the respective glade file of our main window
+            # Index of the changelogs read so far; CVE IDs and bugs are looked up there. It is loaded by a background thread
+            # after the first refresh (see index_changelogs), so that it does not slow down the start.
+            self.changelog_index = None
+
+            # Sizes of the kernel files in /boot; filled by a background thread after each refresh
+            self.boot_usage = {}
+
+            # Running update of the package lists (see start_update)
+            self.update_process = None
+            self.update_cancelled = False
+
+            # Changes reported by the watcher are ignored while our own transaction runs and until the watcher reported
+            # the changes of it (see perform_transaction)
+            self.transaction_running = False
+            self.ignore_changes_until = 0.0
+
+            # Create the GtkBuilder with the respective glade file of our main window; only the main window is built now
             self.builder = Gtk.Builder()
-            self.builder.add_from_file("/usr/lib/kittykernel/kittykernel.ui")
+            self.builder.add_objects_from_file(ui_file, ui_main_objects)
             self.builder.connect_signals(self)
 
             # Save the current theme
             self.theme = Gtk.IconTheme.get_default()                            
 
+            # Icons loaded so far (see get_icon); cleared when the theme changes
+            self.icon_cache = {}
+            self.theme.connect("changed", self.on_theme_changed)
+
             # Setup the treeview
             self.setup_treeview()
 
@@ -93,10 +144,23 @@ class KittykeMainWindow():
             # Main window handle
             self.window = self.builder.get_object("kittykewindow")
             self.window.set_icon_from_file("/usr/lib/kittykernel/kittykernel.svg")
+
+            # Start the first update as soon as the window is shown; the update runs when idle, i.e. after the window was drawn
+            self.map_handler = self.window.connect("map-event", self.on_window_mapped)
+            self.draw_handler = self.window.connect("draw", self.on_window_drawn)
+
             self.window.show_all()                  
 
-            # Hesitate a little bit with updating, so that the user sees the window before the actual first update happens
-            GLib.timeout_add(1000, self.init_refresh)            
+            # Check regularly whether the blacklist was changed
+            GLib.timeout_add_seconds(2, self.check_blacklist)
+
+            # Watch for changes by other programs (e.g. unattended-upgrades); not available everywhere
+            self.watcher = None
+            try:
+                self.watcher = kittykewatch.KittykeWatcher(self.on_system_changed)
+                self.watcher.start()
+            except Exception as e:
+                print (e)
 
             # Start main loop
             Gtk.main()
@@ -106,17 +170,74 @@ class KittykeMainWindow():
             print(sys.exc_info()[0])
             sys.exit(-1)
 
+    # Returns an object of the glade file; dialogs are loaded (and their signals connected) when they are used first
+    def get_ui_object(self, name):
+        if self.builder.get_object(name) is None:
+            self.builder.add_objects_from_file(ui_file, [name])
+
+            # Only connects the signals of the new objects; the others were connected already
+            self.builder.connect_signals(self)
+
+        return self.builder.get_object(name)
+
+    # Returns the icon with the given name from the theme (or from the file, if name is a path) in the given size; each
+    # icon is only loaded (or rendered) once per size and scale of the window
+    def get_icon(self, name, size):
+        key = (name, size, self.window.get_scale_factor())
+
+        if key not in self.icon_cache:
+            if name.startswith("/"):
+                self.icon_cache[key] = GdkPixbuf.Pixbuf.new_from_file_at_scale(name, size, size, True)
+            else:
+                self.icon_cache[key] = self.theme.load_icon(name, size, 0)
+
+        return self.icon_cache[key]
+
+    # Icon theme changed; forget the icons loaded before and show the new ones
+    def on_theme_changed(self, theme):
+        self.icon_cache = {}
+
+        if len(self.kernels_all) > 0:
+            self.fill_group_list(self.kernels_all, [kernel for kernel in self.kernels if not kernel.get('mainline')])
+
+    # Releases the APT cache, if the user wants to save memory; only the list of kernels is needed until the cache is
+    # used again (e.g. for a transaction), which opens it again
+    def release_cache(self):
+        if self.config['Checks']['releasecache'] == 'ok':
+            kittykecore.release_cache()
+
+            if kittykecore.debugmode:
+                print("Resident memory after releasing the cache: %s" % kittykecore.sizeof_fmt(kittykecore.get_rss()))
+
+    # Window is shown for the first time; do the first update when idle
+    def on_window_mapped(self, window, event):
+        window.disconnect(self.map_handler)
+        GLib.idle_add(self.init_refresh)
+        return False
+
+    # Window was drawn for the first time; measure the time needed
+    def on_window_drawn(self, window, context):
+        window.disconnect(self.draw_handler)
+
+        if kittykecore.debugmode:
+            print("Time to first paint: %.3f s" % (time.monotonic() - self.start_time))
+
+        return False
+
     # Initial refresh after startup
     def init_refresh(self):
         # Do the actual refresh
-        self.do_refresh(False)
+        self.do_refresh()
+
+        if kittykecore.debugmode:
+            print("Time to populated list: %.3f s" % (time.monotonic() - self.start_time))
 
         # Only show warning until user read actually the warning text
         if self.config['Checks']['kittywarning'] == 'nokitty':
             return False
 
         # Show fancy messagebox with warning and explaination to the user
-        warningbox = self.builder.get_object("dialog_kittywarning")
+        warningbox = self.get_ui_object("dialog_kittywarning")
         warningbox.set_transient_for(self.window)
         warningbox.run()
 
@@ -172,9 +293,17 @@ class KittykeMainWindow():
     def group_separator_func(self, model, iter, data):
         return model[iter][2] == "separator"
 
-    # Fill treeview (for example after a refresh)   
-    def fill_group_list(self):
+    # Fill treeview (for example after a refresh); kernels is the list of kernels, if it was already loaded (e.g. by the watcher),
+    # and filtered the same list with the blacklist already applied
+    def fill_group_list(self, kernels = None, filtered = None):
         try:
+            # Remember the selected group to select it again afterwards
+            selected_major = None
+            if self.kernelgroup.get_model() is not None:
+                model, treeiter = self.kernelgroup.get_selection().get_selected()
+                if treeiter is not None:
+                    selected_major = model[treeiter][Group_columns.KITTYKE_GROUP_VERSION.value]
+
             # Unset current model, if set; this will empty the list
             self.kernelgroup.set_model(None)  
             self.kernelgroup.set_row_separator_func(self.group_separator_func, None)          
@@ -183,18 +312,32 @@ class KittykeMainWindow():
             model_groups = Gtk.ListStore(GdkPixbuf.Pixbuf, str, str)
 
             # Get kernels
-            self.kernels = kittykecore.get_kernels()
+            if kernels is None:
+                kernels = kittykecore.load_kernels()
+
+                # Download kernel of highest version
+                if len(kernels) > 0:
+                    self.changelog = kittykecore.load_kernel_changelog(kernels[-1]['fullname'])    
 
-            # Download kernel of highest version
-            if len(self.kernels) > 0:
-                self.changelog = kittykecore.get_kernel_changelog(self.kernels[-1]['fullname'])    
+                    # Add the new entries of the changelogs to the index
+                    threading.Thread(target=self.index_changelogs, args=(kernels, {kernels[-1]['fullname']: self.changelog}), daemon=True).start()
 
             # Apply blacklist to the kernel list
-            self.kernels = kittykecore.apply_blacklist(self.kernels, self.blacklist)
+            self.kernels_all = kernels
+            self.kernels = filtered if filtered is not None else kittykecore.apply_blacklist(kernels, self.blacklist)
 
             # Get support times
             self.support_times = kittykecore.get_kernel_support_times()
 
+            # Count the CVEs not fixed in each kernel (if OVAL data was imported)
+            self.unfixed = kittykeoval.count_unfixed_kernels(kittykeoval.load_index(), self.kernels)
+
+            # Mainline kernels have to be loaded again when selected
+            self.mainline_loaded = False
+
+            # Index for the search entry
+            self.search_index = kittykecore.build_search_index(self.kernels)
+
             # Add kernel groups
             for kernel in self.kernels:
                 # Check if there is already a group with the same name and continue if so
@@ -209,32 +352,7 @@ class KittykeMainWindow():
                     continue
 
                 # No parent, then add a new one with this major version and a cog symbol
-                num_available = [1 if x['version_major'] == kernel['version_major'] else 0 for x in self.kernels].count(1)
-                num_downloaded = [1 if x['downloaded'] and x['version_major'] == kernel['version_major'] else 0 for x in self.kernels].count(1)
-                num_installed = [1 if x['installed'] and x['version_major'] == kernel['version_major'] else 0 for x in self.kernels].count(1)                    
-
-                # Second, is the active kernel in the current list?
-                has_active_kernel = ([1 if x['active'] and x['version_major'] == kernel['version_major'] else 0 for x in self.kernels].count(1) > 0)                    
-
-                # Third, create the string for this top-level node
-                node_markup = ["<span foreground='%s'>%s</span>" % (self.config['Colors']['active'], "<b>"+kernel['version_major']+"</b>") if has_active_kernel else kernel['version_major']][0]
-                node_markup += " (<span foreground='%s'>%d</span>" % (self.config['Colors']['downloaded'], num_downloaded)
-                node_markup += ", <span foreground='%s'>%d</span>" % (self.config['Colors']['installed'], num_installed)
-                node_markup += ", %d)" % (num_available)
-
-                # Fourth, create a string for the 'info'-column for the number of supported month
-                supporttext = '---'
-                for entry in self.support_times:
-                    if (kernel['origins'].find(entry['origin']+' ') != -1) and (kernel['version_major'] == entry['version']):
-                        if entry['month'] > 0:
-                            supporttext = "<span foreground='%s'>supported for another %.0d month(s)</span>" % (self.config['Colors']['supported'], entry['month'])
-                        elif entry['month'] < 0:
-                            supporttext = "<span foreground='%s'>support expired %.0d month(s) ago</span>" % (self.config['Colors']['expired'], entry['month']*-1)
-                        else:
-                            supporttext = "<span foreground='%s'>support will expire this month</span>" % (self.config['Colors']['toexpire'])  
-
-                #if len(supporttext) > 0:
-                node_markup += "\n" + supporttext
+                node_markup = self.get_group_markup(kernel['version_major'])
 
                 # We want to sort the listbox by descending version numbers, so find the first iter, which is smaller than the current version
                 iternextrow = None
@@ -244,18 +362,25 @@ class KittykeMainWindow():
                         break
 
                 # Add to model
-                model_groups.insert_before(iternextrow, [self.theme.load_icon("gtk-execute", 22, 0), node_markup, kernel['version_major']])
+                model_groups.insert_before(iternextrow, [self.get_icon("gtk-execute", 22), node_markup, kernel['version_major']])
 
             # Add empty line and Ubuntu main line kernels
             model_groups.append([None, "", "separator"])
-            model_groups.append([GdkPixbuf.Pixbuf.new_from_file_at_scale("/usr/lib/kittykernel/ubuntu.svg", 22, 22, True), "Ubuntu mainline kernels archive\nhttp://kernel.ubuntu.com", "ubuntu mainline"])
+            model_groups.append([self.get_icon("/usr/lib/kittykernel/ubuntu.svg", 22), "Ubuntu mainline kernels archive\nhttp://kernel.ubuntu.com", "ubuntu mainline"])
 
             # Set model to show
             self.kernelgroup.set_model(model_groups)   
 
-            # Fill kernel list with first item in listbox
+            # Fill kernel list with the previously selected group or the first item in listbox
             if len(model_groups) > 0:
-                self.kernelgroup.get_selection().select_iter(model_groups.get_iter_first())       
+                selected_iter = model_groups.get_iter_first()
+
+                for row in model_groups:
+                    if row[Group_columns.KITTYKE_GROUP_VERSION.value] == selected_major:
+                        selected_iter = row.iter
+                        break
+
+                self.kernelgroup.get_selection().select_iter(selected_iter)       
 
             # Delete model
             del model_groups            
@@ -267,8 +392,53 @@ class KittykeMainWindow():
             fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
             print(exc_type, fname, exc_tb.tb_lineno)
 
-    # Fill in the list of kernels based on the major version selected
-    def fill_kernel_list(self, selected_major):
+    # Returns the markup of a group: the major version, the number of downloaded, installed, and available kernels, and the
+    # support info
+    def get_group_markup(self, version_major):
+        # First, count the kernels of this group
+        num_available = [1 if x['version_major'] == version_major else 0 for x in self.kernels].count(1)
+        num_downloaded = [1 if x['downloaded'] and x['version_major'] == version_major else 0 for x in self.kernels].count(1)
+        num_installed = [1 if x['installed'] and x['version_major'] == version_major else 0 for x in self.kernels].count(1)                    
+
+        # Second, is the active kernel in the current list?
+        has_active_kernel = ([1 if x['active'] and x['version_major'] == version_major else 0 for x in self.kernels].count(1) > 0)                    
+
+        # Third, create the string for this top-level node
+        node_markup = ["<span foreground='%s'>%s</span>" % (self.config['Colors']['active'], "<b>"+version_major+"</b>") if has_active_kernel else version_major][0]
+        node_markup += " (<span foreground='%s'>%d</span>" % (self.config['Colors']['downloaded'], num_downloaded)
+        node_markup += ", <span foreground='%s'>%d</span>" % (self.config['Colors']['installed'], num_installed)
+        node_markup += ", %d)" % (num_available)
+
+        # Fourth, create a string for the 'info'-column for the number of supported month
+        supporttext = '---'
+        supportmonth = kittykecore.get_kernel_support_month(self.support_times, [x for x in self.kernels if x['version_major'] == version_major][0])
+        if supportmonth is not None:
+            if supportmonth > 0:
+                supporttext = "<span foreground='%s'>supported for another %.0d month(s)</span>" % (self.config['Colors']['supported'], supportmonth)
+            elif supportmonth < 0:
+                supporttext = "<span foreground='%s'>support expired %.0d month(s) ago</span>" % (self.config['Colors']['expired'], supportmonth*-1)
+            else:
+                supporttext = "<span foreground='%s'>support will expire this month</span>" % (self.config['Colors']['toexpire'])  
+
+        # Fifth, the CVEs not fixed even in the best kernel of this group
+        unfixed = [self.unfixed[x['fullname']] for x in self.kernels if x['version_major'] == version_major and self.unfixed.get(x['fullname']) is not None]
+        if len(unfixed) > 0 and min(unfixed) > 0:
+            supporttext += ", <span foreground='%s'>%d unfixed CVE(s)</span>" % (self.config['Colors']['expired'], min(unfixed))
+
+        #if len(supporttext) > 0:
+        node_markup += "\n" + supporttext
+
+        return node_markup
+
+    # Fill in the list of kernels based on the major version selected; if indices (of self.kernels) are given, these
+    # kernels are shown instead (e.g. the results of a search)
+    def fill_kernel_list(self, selected_major, indices = None):
+        # Remember the selected kernel (the first line of the title is the package) to select it again afterwards
+        selected_package = None
+        model, treeiter = self.kerneltree.get_selection().get_selected()
+        if treeiter is not None:
+            selected_package = model[treeiter][Columns.KITTYKE_PACKAGE.value].split("\n")[0]
+
         # Unset current model, if set; this will empty the list
         self.kerneltree.set_model(None)
 
@@ -277,38 +447,68 @@ class KittykeMainWindow():
 
         # Add kernels to model
         for index, kernel in enumerate(self.kernels):
-            # Should be the major version given
-            if not kernel['version_major'] == selected_major:
+            # Should be the major version given; mainline kernels are only shown in their own group
+            if indices is not None:
+                if index not in indices:
+                    continue
+            elif kernel.get('mainline'):
+                if selected_major != "ubuntu mainline":
+                    continue
+            elif not kernel['version_major'] == selected_major:
                 continue
 
             # Show a symbol if the kernel is installed (checkmark)
-            pixbufinstalled = [self.theme.load_icon("gtk-yes", 22, 0) if kernel["installed"] else None][0]
-
-            # Prepare extra info for title
-            titleadds = []
-
-            if kernel['active']:
-                titleadds.append("<i><small><span foreground='%s'>%s</span></small></i>" % (self.config['Colors']['active'], "active"))
-
-            if kernel['installed']:
-                titleadds.append("<i><small><span foreground='%s'>%s</span></small></i>" % (self.config['Colors']['installed'], "installed"))
-
-            if kernel['downloaded']:
-                titleadds.append("<i><small><span foreground='%s'>%s</span></small></i>" % (self.config['Colors']['downloaded'], "downloaded"))
+            pixbufinstalled = [self.get_icon("gtk-yes", 22) if kernel["installed"] else None][0]
 
             # Prepare title (package + extra info)
-            title = kernel['package'] + "\n" + ", ".join(titleadds)
+            title = self.get_kernel_title(kernel)
 
             # Add row to model
             iterindex = model_kernels.append([None, "", pixbufinstalled, kernel['version'], title, 
-                                     kittykecore.sizeof_fmt(kernel['size']), kittykecore.sizeof_fmt(kernel['installed_size']), kernel['origins'], int(index)])        
+                                     kittykecore.sizeof_fmt(kernel['size']), kittykecore.sizeof_fmt(kernel['installed_size']), kittykecore.format_origins(kernel['origins']), int(index)])        
 
         # Set the treeview model to show the new list
         self.kerneltree.set_model(model_kernels)
 
+        for row in model_kernels:
+            if self.kernels[row[Columns.KITTYKE_DATA_INDEX.value]]['package'] == selected_package:
+                self.kerneltree.get_selection().select_iter(row.iter)
+                break
+
         # Delete model
         del model_kernels
 
+    # Returns the title of a kernel in the list: the package and the extra info (active, installed, etc)
+    def get_kernel_title(self, kernel):
+        # Prepare extra info for title
+        titleadds = []
+
+        if kernel['active']:
+            titleadds.append("<i><small><span foreground='%s'>%s</span></small></i>" % (self.config['Colors']['active'], "active"))
+
+        if kernel['installed']:
+            titleadds.append("<i><small><span foreground='%s'>%s</span></small></i>" % (self.config['Colors']['installed'], "installed"))
+
+        if kernel['downloaded']:
+            titleadds.append("<i><small><span foreground='%s'>%s</span></small></i>" % (self.config['Colors']['downloaded'], "downloaded"))
+
+        if kernel['installed'] and kernel.get('protected_by'):
+            titleadds.append("<i><small>%s</small></i>" % (_("needed by %s") % ", ".join(kernel['protected_by'])))
+
+        if kernel['installed'] and kernel.get('dkms_modules'):
+            titleadds.append("<i><small>%s</small></i>" % (_("DKMS modules %s") % ", ".join(kernel['dkms_modules'])))
+
+        if self.unfixed.get(kernel['fullname']):
+            titleadds.append("<i><small><span foreground='%s'>%s</span></small></i>" % (self.config['Colors']['expired'], _("%d unfixed CVE(s)") % self.unfixed[kernel['fullname']]))
+
+        if kittykecore.get_kernel_boot_size(self.boot_usage, kernel) > 0:
+            titleadds.append("<i><small>%s</small></i>" % (_("%s in /boot") % kittykecore.sizeof_fmt(kittykecore.get_kernel_boot_size(self.boot_usage, kernel))))
+
+        # Prepare title (package + extra info)
+        title = kernel['package'] + "\n" + ", ".join(titleadds)
+
+        return title
+
     # Called each time a user selects an entry in the major version list
     def on_kernel_major_changed(self, selection):
         # Get selection
@@ -316,9 +516,91 @@ class KittykeMainWindow():
 
         # If there is an item behind this selection (no de-selection)
         if treeiter is not None:
+            # Search results are shown as long as there is a search
+            if self.builder.get_object("searchentry").get_text().strip() != "":
+                self.show_search_results()
+                return
+
+            # Mainline kernels are loaded from the archive first
+            if model[treeiter][Group_columns.KITTYKE_GROUP_VERSION.value] == "ubuntu mainline" and not self.mainline_loaded:
+                self.kerneltree.set_model(None)
+                self.builder.get_object("statustext").set_label(_("Loading mainline kernels..."))
+                threading.Thread(target=self.load_mainline_kernels, daemon=True).start()
+                return
+
             # Refill list of kernels
             self.fill_kernel_list(model[treeiter][Group_columns.KITTYKE_GROUP_VERSION.value])  
 
+    # Reads the kernels of the mainline archive (runs in background thread)
+    def load_mainline_kernels(self):
+        kernels = kittykemainline.get_mainline_kernels(self.config['Mainline']['url'], int(self.config['Mainline']['versions']))
+
+        # Gtk is not thread-safe, so let the main loop do the update
+        GLib.idle_add(self.show_mainline_kernels, kernels)
+
+    # Adds the mainline kernels to the kernel list and shows them, if the mainline group is still selected
+    def show_mainline_kernels(self, kernels):
+        # Previously loaded mainline kernels are replaced
+        self.kernels = [kernel for kernel in self.kernels if not kernel.get('mainline')] + kernels
+        self.mainline_loaded = True
+        self.search_index = kittykecore.build_search_index(self.kernels)
+        self.release_cache()
+
+        self.builder.get_object("statustext").set_label(_("Ready."))
+
+        model, treeiter = self.kernelgroup.get_selection().get_selected()
+        if treeiter is not None and model[treeiter][Group_columns.KITTYKE_GROUP_VERSION.value] == "ubuntu mainline":
+            self.fill_kernel_list("ubuntu mainline")
+
+        return False
+
+    # Adds the changelogs of the kernels to the changelog index (runs in background thread)
+    def index_changelogs(self, kernels, changelogs):
+        # The index is loaded from disk (where each update is saved) and only handed to the main loop when it is complete;
+        # the index used by the search is never changed
+        index = kittykechangelog.load_index()
+
+        # The changelog of the newest kernel of each source package contains those of all older ones; changelogs already
+        # loaded (e.g. the one shown) are not loaded again
+        for kernel in kittykechangelog.get_newest_kernels(kernels):
+            changelog = changelogs.get(kernel['fullname']) or kittykecore.load_kernel_changelog(kernel['fullname'])
+            kittykechangelog.update_index(kernel, changelog, index)
+
+        # Gtk is not thread-safe, so let the main loop take over the index
+        GLib.idle_add(self.set_changelog_index, index)
+
+    # Replaces the changelog index used by the search; shows the results again if a CVE or bug is searched
+    def set_changelog_index(self, index):
+        self.changelog_index = index
+
+        if kittykechangelog.is_bug_query(self.builder.get_object("searchentry").get_text()):
+            self.show_search_results()
+
+        return False
+
+    # Called (with a short delay) each time the text of the search entry changes
+    def on_search_changed(self, entry):
+        self.show_search_results()
+
+    # Shows the kernels (of all groups) matching the text of the search entry (or fixing the CVE/bug given there); shows
+    # the selected group again if the search entry is empty
+    def show_search_results(self):
+        query = self.builder.get_object("searchentry").get_text()
+
+        if query.strip() == "":
+            model, treeiter = self.kernelgroup.get_selection().get_selected()
+            if treeiter is not None:
+                self.fill_kernel_list(model[treeiter][Group_columns.KITTYKE_GROUP_VERSION.value])
+            return
+
+        # CVE IDs and bugs: show the kernels whose changelog says they are fixed
+        if kittykechangelog.is_bug_query(query):
+            fixed = [id(kernel) for kernel in kittykechangelog.find_kernels(self.changelog_index or {'terms': {}}, self.kernels, kittykechangelog.normalize_term(query))]
+            self.fill_kernel_list(None, set([index for index, kernel in enumerate(self.kernels) if id(kernel) in fixed]))
+            return
+
+        self.fill_kernel_list(None, set(kittykecore.search_kernels(self.search_index, query)))
+
     # Get iter of specific major version: return None if not found
     def get_iter_of_kernel_major(self, version):
         # Get model
@@ -338,11 +620,22 @@ class KittykeMainWindow():
         # Not found?
         return None
 
-    # Update the info bar with current kernel and size of /boot
+    # Update the info bar with current kernel and size of /boot; the kernel files in /boot are analysed by a
+    # background thread, which completes the info bar when it is done
     def update_infobar(self):
-        # Size of /boot
+        threading.Thread(target=self.analyse_boot, daemon=True).start()
+        return False
+
+    # Gets the size of /boot and its kernel files (runs in background thread)
+    def analyse_boot(self):
         sizeofboot = kittykecore.sizeof_boot()
+        usage = kittykecore.get_boot_usage()
+
+        # Gtk is not thread-safe, so let the main loop do the update
+        GLib.idle_add(self.show_infobar, sizeofboot, usage)
 
+    # Shows the current kernel and the results of the /boot analysis in the info bar
+    def show_infobar(self, sizeofboot, usage):
         # Size of all kernels, downloaded and installed
         sizeofkernels = 0
 
@@ -355,7 +648,87 @@ class KittykeMainWindow():
         # Construct the text
         self.builder.get_object("current_kernel").set_label( _("Current kernel version: <b>%s</b>. ") % (kittykecore.get_current_kernel()) \
                                                            + _("/boot: <b>%s</b> of %s free. ") % (kittykecore.sizeof_fmt(sizeofboot[0]), kittykecore.sizeof_fmt(sizeofboot[1])) \
-                                                           + _("Kernels occupy <b>%s</b> of space.") % (kittykecore.sizeof_fmt(sizeofkernels)) )
+                                                           + _("Kernels occupy <b>%s</b> of space (%s in /boot).") % (kittykecore.sizeof_fmt(sizeofkernels), kittykecore.sizeof_fmt(sum(usage.values()))) )
+
+        # Show the new /boot sizes in the kernel list, if they changed; only the titles change, so the rows (and the
+        # selection) are kept
+        if usage != self.boot_usage:
+            self.boot_usage = usage
+
+            for row in self.kerneltree.get_model() or []:
+                row[Columns.KITTYKE_PACKAGE.value] = self.get_kernel_title(self.kernels[row[Columns.KITTYKE_DATA_INDEX.value]])
+
+        return False
+
+    # Called by the watcher (in its thread) after packages or /boot were changed by other programs; Gtk and the lists of
+    # kernels belong to the main loop, so the change is handled there
+    def on_system_changed(self, kinds):
+        GLib.idle_add(self.handle_system_change, kinds)
+
+    # Handles a change reported by the watcher; only does the necessary updates: the kernels are only read again (in a
+    # background thread) if dpkg or APT changed something. Changes caused by our own transactions are ignored, since
+    # the lists are refreshed after each transaction anyway.
+    def handle_system_change(self, kinds):
+        if self.transaction_running or time.monotonic() < self.ignore_changes_until:
+            return False
+
+        if 'dpkg' in kinds or 'lists' in kinds:
+            threading.Thread(target=self.reload_kernels, daemon=True).start()
+        else:
+            self.update_infobar()
+
+        return False
+
+    # Reads the kernels again after a change (runs in background thread)
+    def reload_kernels(self):
+        kittykecore.reopen_cache()
+        kernels = kittykecore.load_kernels()
+
+        # Gtk is not thread-safe, so let the main loop do the update
+        GLib.idle_add(self.update_kernels, kernels)
+
+    # Updates the lists with the kernels read after a change; only the rows of changed kernels are updated and the lists
+    # are only refilled if kernels were added or removed
+    def update_kernels(self, kernels):
+        # Compare with the kernels shown (the mainline kernels are not part of the APT cache)
+        shown = [kernel for kernel in self.kernels if not kernel.get('mainline')]
+        diff = kittykecore.diff_kernels(shown, kittykecore.apply_blacklist(kernels, self.blacklist))
+
+        if diff and (len(diff['added']) > 0 or len(diff['removed']) > 0):
+            self.fill_group_list(kernels)
+        elif diff:
+            self.update_kernel_rows(kernels, diff['changed'])
+
+        # The cache was opened again for reading the kernels, even if nothing changed
+        self.release_cache()
+        self.update_infobar()
+        return False
+
+    # Replaces changed kernels (same packages, e.g. installed or upgraded) in the lists of kernels and updates their rows
+    # and the rows of their groups
+    def update_kernel_rows(self, kernels, changed):
+        changed = {kernel['package']: kernel for kernel in changed}
+
+        self.kernels_all = kernels
+        self.kernels = [changed.get(kernel['package'], kernel) for kernel in self.kernels]
+        self.search_index = kittykecore.build_search_index(self.kernels)
+
+        majors = set([kernel['version_major'] for kernel in changed.values()])
+
+        for row in self.kernelgroup.get_model() or []:
+            if row[Group_columns.KITTYKE_GROUP_VERSION.value] in majors:
+                row[Group_columns.KITTYKE_GROUP_NAME.value] = self.get_group_markup(row[Group_columns.KITTYKE_GROUP_VERSION.value])
+
+        for row in self.kerneltree.get_model() or []:
+            kernel = self.kernels[row[Columns.KITTYKE_DATA_INDEX.value]]
+
+            if kernel['package'] in changed:
+                row[Columns.KITTYKE_INSTALLED.value] = [self.get_icon("gtk-yes", 22) if kernel["installed"] else None][0]
+                row[Columns.KITTYKE_VERSION.value] = kernel['version']
+                row[Columns.KITTYKE_PACKAGE.value] = self.get_kernel_title(kernel)
+                row[Columns.KITTYKE_SIZE_DOWNLOAD.value] = kittykecore.sizeof_fmt(kernel['size'])
+                row[Columns.KITTYKE_SIZE_INSTALLED.value] = kittykecore.sizeof_fmt(kernel['installed_size'])
+                row[Columns.KITTYKE_ORIGIN.value] = kittykecore.format_origins(kernel['origins'])
 
     # Updates the changelog (mainly the colors)
     def update_changelog(self):
@@ -376,6 +749,9 @@ class KittykeMainWindow():
 
     # Will show the preferences
     def on_preferences(self, widget):
+        # Load dialog (first time only)
+        prefdialog = self.get_ui_object("dialog_kittypreferences")
+
         # Set the options depending on config
         # colors
         for key in self.config['Colors']:
@@ -391,7 +767,6 @@ class KittykeMainWindow():
                     self.builder.get_object(check_option).set_active(True)
 
         # Show fancy options dialog
-        prefdialog = self.builder.get_object("dialog_kittypreferences")
         prefdialog.set_transient_for(self.window)
         
         # Saves the options if the users presses ok
@@ -427,20 +802,16 @@ class KittykeMainWindow():
         self.builder.get_object("statustext").set_label(text)
         while Gtk.events_pending(): Gtk.main_iteration_do(False)
 
-    # Do a refresh, with or without cache-update
-    def do_refresh(self, update = False):      
+    # Do a refresh; the package lists are updated by start_update
+    def do_refresh(self):      
         # Remove all items from the Treeview
         self.kerneltree.set_model(None)      
 
-        # Refresh cache by the method provided by the core functions
-        if update:
-            self.set_progress( _("Updating cache..."), 0.20)    
-            kittykecore.refresh_cache(self.window.get_window().get_xid())        
-
         # Fill the kernel list
         self.set_progress( _("Filling kernel list..."), 0.40)   
         kittykecore.reopen_cache() 
         self.fill_group_list()
+        self.release_cache()
 
         # Update the info bar with current kernel and size of /boot
         self.set_progress( _("Updating current kernel and /boot..."), 0.60)    
@@ -455,11 +826,81 @@ class KittykeMainWindow():
 
     # Refreshes the cache
     def on_refresh(self, widget):    
-        self.do_refresh(False)
+        self.do_refresh()
 
     # Refreshes and updates the cache
     def on_refresh_apt(self, widget):
-        self.do_refresh(True)
+        self.start_update(False)
+
+    # Updates only the sources providing kernel packages (faster with many other sources)
+    def on_refresh_apt_kernels(self, widget):
+        self.start_update(True)
+
+    # Updates the package lists in the background; this runs kittykernel-cli as root, which reports the progress
+    def start_update(self, kernel_sources):
+        # Only one update at a time
+        if self.update_process is not None:
+            return
+
+        # The update runs as root, so it cannot be signalled; it is cancelled by creating the cancel file (see on_update_cancel)
+        self.update_directory = tempfile.mkdtemp(prefix="kittykernel-")
+        self.update_cancel_file = os.path.join(self.update_directory, "cancel")
+
+        cmd = ["gksudo", "--", "/usr/lib/kittykernel/kittykecli.py", "update", "--progress", "--cancel-file", shlex.quote(self.update_cancel_file)]
+        if kernel_sources:
+            cmd.append("--kernel-sources")
+
+        self.update_cancelled = False
+        self.update_process = subprocess.Popen(' '.join(cmd), shell=True, stdout=subprocess.PIPE, universal_newlines=True)
+
+        self.builder.get_object("statuscancel").show()
+        self.set_update_progress(0.0, _("Updating cache..."))
+
+        threading.Thread(target=self.read_update_progress, daemon=True).start()
+
+    # Reads the progress of the update (runs in background thread) until the update finished
+    def read_update_progress(self):
+        for line in self.update_process.stdout:
+            fraction, separator, text = line.rstrip("\n").partition("\t")
+
+            try:
+                GLib.idle_add(self.set_update_progress, float(fraction), text)
+            except ValueError:
+                continue
+
+        self.update_process.stdout.close()
+        result = self.update_process.wait()
+
+        GLib.idle_add(self.finish_update, result)
+
+    # Shows the progress of the update
+    def set_update_progress(self, fraction, text):
+        self.builder.get_object("statusprogress").set_fraction(fraction)
+        self.builder.get_object("statustext").set_label(text)
+        return False
+
+    # Cancels the update; the update checks for the cancel file while downloading
+    def on_update_cancel(self, widget):
+        self.update_cancelled = True
+        self.builder.get_object("statustext").set_label(_("Cancelling update..."))
+
+        try:
+            open(self.update_cancel_file, "w").close()
+        except Exception as e:
+            print (e)
+
+    # Update finished (or cancelled); show the new kernels
+    def finish_update(self, result):
+        self.update_process = None
+        self.builder.get_object("statuscancel").hide()
+        shutil.rmtree(self.update_directory, ignore_errors=True)
+
+        if result != 0:
+            self.set_update_progress(1.0, [_("Update cancelled.") if self.update_cancelled else _("Update failed (error code %d).") % result][0])
+            return False
+
+        self.do_refresh()
+        return False
 
     # Shows the about dialog
     def on_about(self, widget):
@@ -495,9 +936,29 @@ class KittykeMainWindow():
     def on_goto_kernelorg(self, widget):
         Gtk.show_uri(None, "https://www.kernel.org/", Gtk.get_current_event_time())
 
-    # Opens default editor for editing the blacklist
+    # Opens default editor for editing the blacklist; the changes are applied by check_blacklist as soon as they are saved
     def on_blacklistedit(self, widget):
-        subprocess.call(["xdg-open", os.path.expanduser("~/.config/kittykernel/blacklist")])
+        subprocess.call(["xdg-open", kittykecore.blacklist_file])
+
+    # Reloads the blacklist if it was changed and applies it to the kernels in memory (without reading the APT cache again)
+    def check_blacklist(self):
+        mtime = kittykecore.get_blacklist_mtime()
+
+        if mtime != self.blacklist_mtime:
+            self.blacklist_mtime = mtime
+            blacklist = kittykecore.load_blacklist()
+
+            if blacklist != self.blacklist:
+                # Mainline kernels are not filtered and not kept; they are loaded again when their group is selected
+                shown = [kernel for kernel in self.kernels if not kernel.get('mainline')]
+                filtered = kittykecore.reapply_blacklist(self.kernels_all, shown, self.blacklist, blacklist)
+
+                self.blacklist = blacklist
+                self.fill_group_list(self.kernels_all, filtered)
+                self.update_infobar()
+
+        # Keep checking
+        return True
 
     # Get iter of active kernel in the current list; returns None if not in current list/not found
     def get_iter_of_current_kernel(self):
@@ -621,6 +1082,8 @@ class KittykeMainWindow():
 
         # Right mouse button
         if event.button == 3:     
+            # A transaction may follow; open the cache in the meantime (if it was released)
+            kittykecore.preload_cache()
 
             # Kernel menu   
             menu = self.builder.get_object("menu_kernel")
@@ -645,6 +1108,8 @@ class KittykeMainWindow():
 
         # Right mouse button
         if event.button == 3:     
+            # A transaction may follow; open the cache in the meantime (if it was released)
+            kittykecore.preload_cache()
 
             # Show kernel group menu   
             menu = self.builder.get_object("menu_kernel_group")
@@ -665,26 +1130,100 @@ class KittykeMainWindow():
         if treeiter != None:
             index = model[treeiter][Columns.KITTYKE_DATA_INDEX.value]
 
-            # Is this kernel _not_ installed?
-            if not self.kernels[index]['installed']:
-                # Check free space on /boot
-                freeonboot = kittykecore.sizeof_boot()[0]
+            # Mainline kernels are not in the repos; they are downloaded first and then installed with dpkg
+            if self.kernels[index].get('mainline'):
+                if not self.kernels[index]['installed']:
+                    self.set_progress(_("Downloading kernel packages..."), 0.0)
+                    threading.Thread(target=self.download_mainline_kernel, args=(self.kernels[index],), daemon=True).start()
+                return
+
+            # Is this kernel _not_ installed? Then, plan the installation in a background thread (the cache may have to be
+            # opened again) and ask in confirm_kernel_install
+            if not self.kernels[index]['installed'] and self.begin_transaction(_("Preparing installation...")):
+                threading.Thread(target=self.prepare_kernel_install, args=(self.kernels[index],), daemon=True).start()
+
+    # Gets the operations for installing a kernel and, if /boot is running out of free space, the kernels which would have
+    # to go (runs in background thread; see on_kernel_install)
+    def prepare_kernel_install(self, kernel):
+        try:
+            # Check free space on /boot
+            freeonboot = kittykecore.sizeof_boot()[0]
+            bootfree = int(self.config['Cleanup']['bootfree'])
+
+            # Operations for installing the kernel
+            operations = kittykecore.load_kernel_operations([kernel['package']], 'install')
+
+            # Which kernels would have to go to free enough space?
+            plan = None
+            if freeonboot < bootfree:
+                plan = kittykecore.plan_boot_cleanup(self.kernels, bootfree, int(self.config['Cleanup']['keeppergroup']), 'purge',
+                                                     kittykecore.get_boot_usage(), freeonboot)
+        except Exception as e:
+            print (e)
+            GLib.idle_add(self.finish_transaction, -3)
+            return
+
+        # Gtk is not thread-safe, so let the main loop ask
+        GLib.idle_add(self.confirm_kernel_install, operations, freeonboot, plan)
+
+    # Installs a kernel with the operations of prepare_kernel_install; warns first, when /boot has less than 80 MiB (default)
+    # free, i.e. when there is a plan for cleaning up /boot
+    def confirm_kernel_install(self, operations, freeonboot, plan):
+        if plan is not None:
+            dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.WARNING, Gtk.ButtonsType.NONE, "Low disk space on /boot")
+            dialog.format_secondary_text(_("/boot is running out of free disk space (%s free). A kernel approximately requires 60-70 MiB. "
+                                           "Please remove kernels you don't need anymore. It is suggested to keep the last working kernel. "
+                                           "\n\nDo you want to continue installing the new kernel?") % (kittykecore.sizeof_fmt(freeonboot)))
+
+            # Offer to purge the planned kernels in the same transaction
+            if len(plan['kernels']) > 0:
+                dialog.format_secondary_text(_("/boot is running out of free disk space (%s free). A kernel approximately requires 60-70 MiB. "
+                                               "Purging the following kernels would free %s on /boot:\n\n%s"
+                                               "\n\nDo you want to purge these kernels while installing the new kernel?") % (kittykecore.sizeof_fmt(freeonboot), 
+                                               kittykecore.sizeof_fmt(plan['freed']), "\n".join([kernel['package'] for kernel in plan['kernels']])))
+                dialog.add_button(_("Purge and install"), Gtk.ResponseType.APPLY)
+
+            dialog.add_buttons(_("Install only"), Gtk.ResponseType.YES, _("Cancel"), Gtk.ResponseType.NO)
+
+            response = dialog.run()
+            dialog.destroy()
+
+            if response not in [Gtk.ResponseType.YES, Gtk.ResponseType.APPLY]:
+                self.cancel_transaction()
+                return False
+
+            if response == Gtk.ResponseType.APPLY:
+                operations = plan['operations'] + operations
+
+        self.start_transaction(kittykecore.perform_operations, operations)
+
+        return False
+
+    # Downloads the packages of a mainline kernel (runs in background thread)
+    def download_mainline_kernel(self, kernel):
+        # Show progress in the status bar
+        def progress(downloaded):
+            GLib.idle_add(self.builder.get_object("statusprogress").set_fraction, min(downloaded / max(kernel['size'], 1), 1.0))
 
-                # Warning, when /boot has less than 80 MiB free.
-                if freeonboot < 80000000:
-                    dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.WARNING, Gtk.ButtonsType.YES_NO, "Low disk space on /boot")
-                    dialog.format_secondary_text(_("/boot is running out of free disk space (%s free). A kernel approximately requires 60-70 MiB. "
-                                                   "Please remove kernels you don't need anymore. It is suggested to keep the last working kernel. "
-                                                   "\n\nDo you want to continue installing the new kernel?") % (kittykecore.sizeof_fmt(freeonboot)))
-                    
-                    if dialog.run() == Gtk.ResponseType.NO:
-                        dialog.destroy()
-                        return
+        paths = kittykedownload.download_kernel(kernel, int(self.config['Mainline']['connections']), self.config['Mainline']['store'] or None, progress)
 
-                    dialog.destroy()
+        # Gtk is not thread-safe, so let the main loop do the installation
+        GLib.idle_add(self.install_mainline_kernel, kernel, paths)
 
-                kittykecore.perform_kernels( [self.kernels[index]['package']], 'install', self.window.get_window().get_xid())
-                self.do_refresh(False)
+    # Installs the downloaded packages of a mainline kernel
+    def install_mainline_kernel(self, kernel, paths):
+        if len(paths) == 0:
+            self.set_progress(_("Download failed."), 0.0)
+            dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.ERROR, Gtk.ButtonsType.CLOSE, _("Download failed"))
+            dialog.format_secondary_text(_("The packages of kernel %s could not be downloaded or their checksums did not match.") % kernel['package'])
+            dialog.run()
+            dialog.destroy()
+            return False
+
+        self.set_progress(_("Installing kernel packages..."), 1.0)
+        self.perform_transaction(kittykecore.install_deb_files, paths)
+
+        return False
 
     # Removes a kernel
     def on_kernel_remove(self, widget):
@@ -705,8 +1244,121 @@ class KittykeMainWindow():
 
             # Is this kernel installed?
             if self.kernels[index]['installed']:
-                kittykecore.perform_kernels( [self.kernels[index]['package']], 'remove', self.window.get_window().get_xid())
-                self.do_refresh(False)
+                if not self.confirm_protected([self.kernels[index]]):
+                    return
+
+                self.perform_transaction(kittykecore.perform_kernels, [self.kernels[index]['package']], 'remove')
+
+    # Performs a transaction with function (kittykecore.perform_kernels, etc), which gets the arguments, the window, and
+    # the progress callback for the dpkg lock. Waiting for the lock and the transaction itself run in a background thread,
+    # so the window stays responsive; the kernel actions are disabled until the transaction finished (see finish_transaction).
+    def perform_transaction(self, function, *arguments):
+        if self.begin_transaction(_("Installing or removing packages...")):
+            self.start_transaction(function, *arguments)
+
+    # Marks a transaction as running and disables the kernel actions, also while it is prepared (see on_kernel_install);
+    # returns False if another transaction runs already (only one transaction at a time)
+    def begin_transaction(self, text):
+        if self.transaction_running:
+            return False
+
+        self.transaction_running = True
+        self.set_actions_sensitive(False)
+        self.set_update_progress(0.0, text)
+
+        return True
+
+    # Starts a transaction begun with begin_transaction in a background thread
+    def start_transaction(self, function, *arguments):
+        self.set_update_progress(0.0, _("Installing or removing packages..."))
+
+        threading.Thread(target=self.run_transaction, args=(function, arguments, self.window.get_window().get_xid()), daemon=True).start()
+
+    # A transaction begun with begin_transaction was cancelled before it started
+    def cancel_transaction(self):
+        self.transaction_running = False
+        self.set_actions_sensitive(True)
+        self.set_update_progress(0.0, "")
+
+    # Runs a transaction (runs in background thread; see perform_transaction)
+    def run_transaction(self, function, arguments, xwindow_id):
+        try:
+            result = function(*arguments, xwindow_id, progress = self.on_dpkg_locked)
+        except Exception as e:
+            print (e)
+            result = -3
+
+        # Gtk is not thread-safe, so let the main loop show the result
+        GLib.idle_add(self.finish_transaction, result)
+
+    # Transaction finished; shows an error if it failed and refreshes the lists
+    def finish_transaction(self, result):
+        self.transaction_running = False
+
+        # The watcher reports the changes of the transaction only after they settled
+        self.ignore_changes_until = time.monotonic() + (self.watcher.delay + 1.0 if self.watcher is not None else 0.0)
+
+        self.set_actions_sensitive(True)
+        self.check_transaction(result)
+        self.do_refresh()
+
+        return False
+
+    # Enables or disables the actions changing kernels (menus of the kernels and groups, also used as context menus)
+    def set_actions_sensitive(self, sensitive):
+        for name in ["menu_kernel", "menu_kernel_group"]:
+            self.builder.get_object(name).set_sensitive(sensitive)
+
+    # Shows that a transaction waits for another program (e.g. unattended-upgrades) to release the dpkg lock (runs in the
+    # background thread of the transaction)
+    def on_dpkg_locked(self, waited, timeout, holder):
+        GLib.idle_add(self.set_update_progress, min(waited / timeout, 1.0), _("Waiting for %s to finish...") % holder)
+        return True
+
+    # Shows an error if a transaction failed; result is the return code of kittykecore.perform_operations
+    def check_transaction(self, result):
+        if result == 0:
+            return
+
+        dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.ERROR, Gtk.ButtonsType.CLOSE, _("Transaction failed"))
+
+        if result == kittykecore.transaction_locked:
+            dialog.format_secondary_text(_("Another program is installing or removing packages and did not finish in time. Please try again later."))
+        else:
+            dialog.format_secondary_text(_("The packages could not be installed or removed (error code %d).") % result)
+
+        dialog.run()
+        dialog.destroy()
+
+    # Asks whether kernels, which installed meta-packages depend on (APT would remove these packages as well) or which have
+    # DKMS modules built (these are removed with the kernel), should be removed anyway. Returns True if there are no such
+    # kernels or the user wants to continue.
+    def confirm_protected(self, kernels):
+        protected = [kernel for kernel in kernels if kernel['installed'] and kernel.get('protected_by')]
+        dkms = [kernel for kernel in kernels if kernel['installed'] and kernel.get('dkms_modules')]
+
+        if len(protected) == 0 and len(dkms) == 0:
+            return True
+
+        text = []
+
+        if len(protected) > 0:
+            text.append(_("The following packages depend on the kernel and would be removed as well:\n\n%s")
+                        % "\n".join(["%s: %s" % (kernel['package'], ", ".join(kernel['protected_by'])) for kernel in protected]))
+
+        if len(dkms) > 0:
+            text.append(_("The following DKMS modules were built for the kernel and would be removed with it:\n\n%s")
+                        % "\n".join(["%s: %s" % (kernel['package'], ", ".join(kernel['dkms_modules'])) for kernel in dkms]))
+
+        dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.WARNING, Gtk.ButtonsType.NONE,
+                                   _("Kernel needed by other packages") if len(protected) > 0 else _("Kernel with DKMS modules"))
+        dialog.format_secondary_text("\n\n".join(text) + "\n\n" + _("Do you want to continue?"))
+        dialog.add_buttons(_("Remove anyway"), Gtk.ResponseType.YES, _("Cancel"), Gtk.ResponseType.NO)
+
+        response = dialog.run()
+        dialog.destroy()
+
+        return response == Gtk.ResponseType.YES
 
     # Purges a kernel
     def on_kernel_purge(self, widget):
@@ -727,8 +1379,10 @@ class KittykeMainWindow():
 
             # Is this kernel installed?
             if self.kernels[index]['installed'] or self.kernels[index]['downloaded']:
-                kittykecore.perform_kernels( [self.kernels[index]['package']], 'purge', self.window.get_window().get_xid())
-                self.do_refresh(False)
+                if not self.confirm_protected([self.kernels[index]]):
+                    return
+
+                self.perform_transaction(kittykecore.perform_kernels, [self.kernels[index]['package']], 'purge')
 
     # Purges all kernels except the active one
     def on_kernel_purge_all(self, widget):
@@ -736,29 +1390,44 @@ class KittykeMainWindow():
         if len(self.kernels) == 0:
             return
 
-        kernels_to_purge = []
+        # Purge every installed or downloaded kernel except the active one
+        decision = kittykecore.evaluate_retention_policy(self.kernels, {'keep_newest': 0, 'keep_supported': False, 'purge_leftovers': True, 'verb': 'purge'}, 
+                                                         self.support_times)
 
-        # Check each kernel
-        for kernel in self.kernels:
-            # Is active one? Ignore
-            if kernel['active']:
-                continue
+        kernels_to_purge = [kernel['package'] for kernel, reason in decision['purge']]
 
-            # Is installed? Then purge!
-            if kernel['installed'] or kernel['downloaded']:
-                kernels_to_purge.append(kernel['package'])
+        # Kernels kept besides the active one (e.g. needed by meta-packages) with the reason
+        kept = ["%s (%s)" % (kernel['package'], _("needed by %s") % ", ".join(kernel['protected_by']) if reason == 'protected' else reason)
+                for kernel, reason in decision['keep'] if reason != 'active']
 
         # No kernels selected? Display a messagebox
         if len(kernels_to_purge) == 0:
             dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.INFO, Gtk.ButtonsType.CLOSE, _("Nothing to purge"))
-            dialog.format_secondary_text( _("No kernels were purged since only the active one is currently installed on the system."))
+
+            if len(kept) > 0:
+                dialog.format_secondary_text( _("No kernels were purged. Besides the active one, these kernels are kept:\n\n%s") % "\n".join(kept))
+            else:
+                dialog.format_secondary_text( _("No kernels were purged since only the active one is currently installed on the system."))
+
             dialog.run()
             dialog.destroy()
+            return
 
-        # Send to purge function and refresh list afterwards
+        # Ask first; the kernels kept are listed as well
+        dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.QUESTION, Gtk.ButtonsType.YES_NO, _("Purge all kernels"))
+
+        if len(kept) > 0:
+            dialog.format_secondary_text( _("The following kernels will be purged:\n\n%s\n\nThese kernels are kept besides the active one:\n\n%s"
+                                            "\n\nDo you want to continue?") % ("\n".join(kernels_to_purge), "\n".join(kept)))
         else:
-            kittykecore.perform_kernels( kernels_to_purge, 'purge', self.window.get_window().get_xid())
-            self.do_refresh(False)
+            dialog.format_secondary_text( _("The following kernels will be purged:\n\n%s\n\nDo you want to continue?") % "\n".join(kernels_to_purge))
+
+        response = dialog.run()
+        dialog.destroy()
+
+        # Send to purge function and refresh list afterwards
+        if response == Gtk.ResponseType.YES:
+            self.perform_transaction(kittykecore.perform_kernels, kernels_to_purge, 'purge')
 
     # Removes all kernels from the currently selected group
     def on_remove_group(self, widget):
@@ -794,9 +1463,8 @@ class KittykeMainWindow():
             dialog.destroy()
 
         # Send to purge function and refresh list afterwards
-        else:
-            kittykecore.perform_kernels( kernels_to_remove, 'remove', self.window.get_window().get_xid())
-            self.do_refresh(False)
+        elif self.confirm_protected([kernel for kernel in self.kernels if kernel['package'] in kernels_to_remove]):
+            self.perform_transaction(kittykecore.perform_kernels, kernels_to_remove, 'remove')
 
 
     # Purges all kernels from the currently selected group
@@ -833,9 +1501,8 @@ class KittykeMainWindow():
             dialog.destroy()
 
         # Send to purge function and refresh list afterwards
-        else:
-            kittykecore.perform_kernels( kernels_to_purge, 'purge', self.window.get_window().get_xid())
-            self.do_refresh(False)
+        elif self.confirm_protected([kernel for kernel in self.kernels if kernel['package'] in kernels_to_purge]):
+            self.perform_transaction(kittykecore.perform_kernels, kernels_to_purge, 'purge')
 
 
 
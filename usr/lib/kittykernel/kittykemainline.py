@@ -0,0 +1,330 @@
+#!/usr/bin/python3
+
+#  kittykernel
+#
+#  Copyright (C) 2017 by Sven Kochmann, available at Github:
+#  <https://www.github.com/Schallaven/kittykernel/>
+#
+#  This program is free software;  you can redistribute it and/or modify
+#  it under the terms of the  GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  This program is  distributed in the hope that it  will be useful, but
+#  WITHOUT  ANY   WARRANTY;  without   even  the  implied   warranty  of
+#  MERCHANTABILITY  or FITNESS FOR  A PARTICULAR  PURPOSE.  See  the GNU
+#  General Public License for more details.
+#
+#  You should  have received  a copy of  the GNU General  Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#  Routines for the Ubuntu mainline kernel archive, e.g. reading the list
+#  of mainline kernels from kernel.ubuntu.com
+#
+#
+#  Warning: Don't read this  source file if  you are annoyed by too many
+#           comments. Read source code  of other FOSS projects  instead.
+#
+
+import os
+import sys
+import re
+import json
+import codecs
+import urllib.request
+import urllib.error
+import urllib.parse
+import html.parser
+import concurrent.futures
+import apt_pkg
+
+import kittykecore
+
+
+# Path of the local index cache
+index_file = os.path.expanduser("~/.cache/kittykernel/mainline.json")
+
+# Number of bytes read from the network at once; the listings are parsed while they come in
+chunk_size = 16384
+
+# Dates and sizes as shown in the directory listings (Apache and nginx style)
+listing_date = re.compile(r"(\d{4}-\d{2}-\d{2} \d{2}:\d{2}|\d{2}-\w{3}-\d{4} \d{2}:\d{2})")
+listing_size = re.compile(r"^(\d+(?:\.\d+)?)([KMG]?)$")
+
+# Version directories of the archive, e.g. "v4.15/", "v6.5.3/", "v6.6-rc1/"
+version_directory = re.compile(r"^v(\d+)\.(\d+)(?:\.(\d+))?(-rc\d+)?/$")
+
+# Debian package file names: <name>_<version>_<architecture>.deb
+deb_file = re.compile(r"^([^_/]+)_([^_/]+)_([^_/]+)\.deb$")
+
+
+# Parser for directory listings; it can be fed with parts of the page as they come in. Each link is saved
+# together with the date and size shown next to it as dictionary in entries.
+class ListingParser(html.parser.HTMLParser):
+
+    def __init__(self):
+        html.parser.HTMLParser.__init__(self)
+        self.entries = []
+        self.text = None
+
+    # Each link starts a new entry
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            self.finish_entry()
+
+            href = dict(attrs).get('href', '')
+
+            # Ignore sorting links, parent directory, and absolute links
+            if href and not href.startswith(('?', '/', '#')) and '://' not in href and href != '../':
+                self.entries.append({'name': urllib.parse.unquote(href), 'date': '', 'size': 0})
+                self.text = ""
+
+    # Collect the text after a link (date, size)
+    def handle_data(self, data):
+        if self.text is not None:
+            self.text += data
+
+    # End of row; the text after the link is complete
+    def handle_endtag(self, tag):
+        if tag in ['tr', 'pre']:
+            self.finish_entry()
+
+    # Take date and size from the text collected after the last link
+    def finish_entry(self):
+        if self.text is None or len(self.entries) == 0:
+            self.text = None
+            return
+
+        # The first part of the text is the link text itself, so only look behind it
+        date = listing_date.search(self.text)
+
+        if date:
+            self.entries[-1]['date'] = date.group(1)
+
+            for token in self.text[date.end():].split():
+                size = listing_size.match(token)
+                if size:
+                    self.entries[-1]['size'] = int(float(size.group(1)) * {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3}[size.group(2)])
+                    break
+
+        self.text = None
+
+    # Finish last entry
+    def close(self):
+        html.parser.HTMLParser.close(self)
+        self.finish_entry()
+
+
+# Fetches a directory listing and parses it while it is streamed in. cached is the dictionary saved for this
+# url before (or None); its ETag and Last-Modified values are used to ask the server, if something changed.
+# Returns a dictionary with 'etag', 'modified', and 'entries', which is the cached one if nothing changed.
+def fetch_listing(url, cached = None):
+    request = urllib.request.Request(url, headers={'User-Agent': 'kittykernel'})
+
+    if cached is not None:
+        if cached.get('etag'):
+            request.add_header('If-None-Match', cached['etag'])
+        if cached.get('modified'):
+            request.add_header('If-Modified-Since', cached['modified'])
+
+    try:
+        response = urllib.request.urlopen(request, timeout=30)
+
+    except urllib.error.HTTPError as e:
+        # Not modified? Then, the cached listing is still valid
+        if e.code == 304 and cached is not None:
+            return cached
+        raise
+
+    with response:
+        parser = ListingParser()
+        decoder = codecs.getincrementaldecoder(response.headers.get_content_charset() or "utf-8")(errors="replace")
+
+        # Parse the page while it comes in
+        while True:
+            chunk = response.read(chunk_size)
+            if not chunk:
+                break
+            parser.feed(decoder.decode(chunk))
+
+        parser.feed(decoder.decode(b"", final=True))
+        parser.close()
+
+        return {'etag': response.headers.get('ETag', ''), 'modified': response.headers.get('Last-Modified', ''), 'entries': parser.entries}
+
+
+# Loads the local index cache; returns an empty index if there is none (or it is from a different archive)
+def load_index(url):
+    try:
+        with open(index_file, "r") as f:
+            index = json.load(f)
+
+        if index.get('url') == url:
+            return index
+
+    except Exception as e:
+        if kittykecore.debugmode:
+            print (e)
+
+    return {'url': url, 'listing': None, 'versions': {}}
+
+# Saves the local index cache
+def save_index(index):
+    os.makedirs(os.path.dirname(index_file), exist_ok=True)
+
+    # Write to temporary file first, so that an interrupted write does not destroy the cache
+    with open(index_file + ".tmp", "w") as f:
+        json.dump(index, f)
+
+    os.replace(index_file + ".tmp", index_file)
+
+
+# Sort key for version directories, e.g. "v6.5-rc1/" < "v6.5/" < "v6.5.3/"
+def version_directory_key(name):
+    match = version_directory.match(name)
+    return (int(match.group(1)), int(match.group(2)), match.group(4) is None, int(match.group(3) or 0), match.group(4) or "")
+
+# Fetches the files of a version directory; newer versions keep their packages in a subdirectory per architecture,
+# which is fetched as well. Returns the new cache entry for this directory.
+def fetch_version(url, name, date, cached, architecture):
+    listing = fetch_listing(url + name, cached)
+
+    entry = {'etag': listing['etag'], 'modified': listing['modified'], 'entries': listing['entries'], 'date': date, 'files': []}
+
+    # Packages directly in the directory (older versions)
+    entry['files'] = [[name + file['name'], file['size']] for file in listing['entries'] if deb_file.match(file['name'])]
+
+    # Packages in the architecture directory
+    if (architecture + "/") in [file['name'] for file in listing['entries']]:
+        archlisting = fetch_listing(url + name + architecture + "/", cached.get('arch') if cached else None)
+        entry['arch'] = archlisting
+        entry['files'] += [[name + architecture + "/" + file['name'], file['size']] for file in archlisting['entries'] if deb_file.match(file['name'])]
+
+    # CHECKSUMS file is next to the packages
+    for path, size in entry['files']:
+        entry['checksums'] = url + os.path.dirname(path) + "/CHECKSUMS"
+        break
+
+    return entry
+
+# Updates the local index of the mainline archive at url: the main listing is revalidated and only version directories
+# which are new or whose date in the main listing changed are fetched again (up to the newest maxversions ones).
+# Returns the index.
+def update_index(url, maxversions = 50, architecture = None):
+    if architecture is None:
+        architecture = apt_pkg.config.find("APT::Architecture")
+
+    index = load_index(url)
+
+    # Revalidate main listing
+    index['listing'] = fetch_listing(url, index['listing'])
+
+    # Newest version directories
+    versions = [entry for entry in index['listing']['entries'] if version_directory.match(entry['name'])]
+    versions = sorted(versions, key=lambda entry: version_directory_key(entry['name']), reverse=True)[:maxversions]
+
+    # Directories to fetch
+    outdated = [entry for entry in versions if entry['name'] not in index['versions'] or index['versions'][entry['name']]['date'] != entry['date'] or not entry['date']]
+
+    # Fetch them a few at once
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        futures = {executor.submit(fetch_version, url, entry['name'], entry['date'], index['versions'].get(entry['name']), architecture): entry['name'] for entry in outdated}
+
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                index['versions'][futures[future]] = future.result()
+            except Exception as e:
+                if kittykecore.debugmode:
+                    print(futures[future], e)
+
+    # Forget directories, which are not among the newest anymore
+    index['versions'] = {name: entry for name, entry in index['versions'].items() if name in [version['name'] for version in versions]}
+
+    save_index(index)
+
+    return index
+
+
+# Turns the index into kernel dictionaries as returned by kittykecore.get_kernels; each kernel image of the
+# architecture gives one kernel. The extra keys 'mainline' (True), 'debs' (urls of the packages needed for
+# installing), and 'checksums' (url of the CHECKSUMS file) are added.
+@kittykecore.with_cache_lock
+def get_index_kernels(index, architecture = None):
+    if architecture is None:
+        architecture = apt_pkg.config.find("APT::Architecture")
+
+    current_version = kittykecore.get_current_kernel()
+    site = urllib.parse.urlparse(index['url']).hostname or ""
+
+    # The installed kernels are looked up in the APT cache; the lock keeps it from being released in the meantime
+    cache = kittykecore.get_cache()
+
+    kernel_list = []
+
+    for name, entry in index['versions'].items():
+        # Split file names in package name, version, and architecture
+        packages = []
+        for path, size in entry['files']:
+            match = deb_file.match(os.path.basename(path))
+            if match and match.group(3) in [architecture, "all"]:
+                packages.append( (match.group(1), match.group(2), match.group(3), index['url'] + path, size) )
+
+        for package, pkg_version, arch, url, size in packages:
+            # Kernel images only
+            if not package.startswith("linux-image-") or package.startswith("linux-image-extra-"):
+                continue
+
+            abi = re.sub(r"^linux-image-(unsigned-)?", "", package)
+
+            # Modules and headers of the same kernel; the architecture-independent headers have no flavour
+            flavourless = abi.rsplit('-', 1)[0]
+            companions = [entry for entry in packages if entry[0] in ["linux-modules-" + abi, "linux-headers-" + abi, "linux-headers-" + flavourless]]
+
+            kernel = { 'version_major': '', 'version': kittykecore.strip_kernel_version(abi), 'package': package, 'abi': abi, 'pkg_version': pkg_version, 'source': '',
+                       'size': size + sum([companion[4] for companion in companions]), 'installed_size': 0,
+                       'origins': (kittykecore.intern_origin("Ubuntu mainline", name.rstrip('/'), site, False),), 'fullname': package,
+                       'active': abi == current_version, 'installed': False, 'downloaded': False,
+                       'mainline': True, 'debs': [url] + [companion[3] for companion in companions], 'checksums': entry.get('checksums', '') }
+
+            if len(kernel['version'].split('.')) < 2:
+                continue
+
+            kernel['version_major'] = kernel['version'].split('.')[0] + "." + kernel['version'].split('.')[1]
+
+            # Already on the system?
+            if package in cache:
+                kernel['installed'] = cache[package].is_installed
+                kernel['downloaded'] = cache[package].has_config_files
+
+            kernel_list.append(kernel)
+
+    # Sort list by version and return it
+    return sorted(kernel_list, key=kittykecore.kernel_version_key, reverse=True)
+
+# Updates the index and returns the list of mainline kernels; returns an empty list if something went wrong
+def get_mainline_kernels(url, maxversions = 50):
+    try:
+        return get_index_kernels(update_index(url, maxversions))
+
+    except Exception as e:
+        if kittykecore.debugmode:
+            print (e)
+            print(sys.exc_info())
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            print(exc_type, fname, exc_tb.tb_lineno)
+        return []
+
+
+# Script file is run directly... then let's have some test outputs here; an url (e.g. of a local copy of the
+# archive served with "python3 -m http.server") can be given as argument
+if __name__ == '__main__':
+    print("Script was called directly. Testing...")
+
+    kittykecore.debugmode = True
+
+    url = sys.argv[1] if len(sys.argv) > 1 else kittykecore.config_default['Mainline']['url']
+
+    for kernel in get_mainline_kernels(url, 5):
+        print(kernel['package'], kernel['pkg_version'], kittykecore.sizeof_fmt(kernel['size']), kernel['debs'])
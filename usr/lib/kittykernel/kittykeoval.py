@@ -0,0 +1,272 @@
+#!/usr/bin/python3
+
+#  kittykernel
+#
+#  Copyright (C) 2017 by Sven Kochmann, available at Github:
+#  <https://www.github.com/Schallaven/kittykernel/>
+#
+#  This program is free software;  you can redistribute it and/or modify
+#  it under the terms of the  GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  This program is  distributed in the hope that it  will be useful, but
+#  WITHOUT  ANY   WARRANTY;  without   even  the  implied   warranty  of
+#  MERCHANTABILITY  or FITNESS FOR  A PARTICULAR  PURPOSE.  See  the GNU
+#  General Public License for more details.
+#
+#  You should  have received  a copy of  the GNU General  Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#  Imports the Ubuntu CVE OVAL data (e.g. com.ubuntu.bionic.cve.oval.xml
+#  from https://security-metadata.canonical.com/oval/) and counts the CVEs
+#  which are not fixed in each kernel
+#
+#
+#  Warning: Don't read this  source file if  you are annoyed by too many
+#           comments. Read source code  of other FOSS projects  instead.
+#
+
+import os
+import sys
+import re
+import bz2
+import json
+import bisect
+import functools
+import xml.etree.ElementTree
+import apt_pkg
+
+import kittykecore
+
+
+# Path of the imported data
+index_file = os.path.expanduser("~/.cache/kittykernel/oval.json")
+
+# Index loaded before (see load_index); only loaded again if the file changed
+index_cache = {'mtime': None, 'index': None}
+
+# CVE IDs in titles and references
+cve_id = re.compile(r"CVE-\d{4}-\d{4,}")
+
+# Elements of the containers (definitions, tests, objects, states), which are cleared after each of their children
+containers = ['definitions', 'tests', 'objects', 'states', 'variables']
+
+# Number of objects the last parse_oval skipped, since their package names could not be resolved (e.g. names given by
+# variables other than constant variables); their CVEs are missing in the result
+skipped_objects = 0
+
+
+# Returns the name of an element without namespace, e.g. "definition" for "{http://oval.mitre.org/...}definition"
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+# Reads an OVAL file (plain or compressed with bzip2) element by element; every element is thrown away after it was read,
+# so even large files need little memory. Only the source packages starting with prefix (the kernels) are kept. Returns
+# a dictionary, which maps each source package to a dictionary {CVE ID: version fixing it (None if not fixed yet)}.
+# Package names may be given directly or by a constant variable (var_ref), which may list several packages.
+def parse_oval(path, prefix = "linux"):
+    global skipped_objects
+
+    # Definition: list of (CVE IDs, test ids); tests: id -> (object id, state id); objects: id -> packages; states: id -> version;
+    # object_variables: object id -> variable id; variables: id -> values (constant variables only)
+    definitions = []
+    tests = {}
+    objects = {}
+    states = {}
+    object_variables = {}
+    variables = {}
+
+    container = None
+
+    with (bz2.open(path, "rb") if path.endswith(".bz2") else open(path, "rb")) as f:
+        for event, element in xml.etree.ElementTree.iterparse(f, events=('start', 'end')):
+            name = local_name(element.tag)
+
+            if event == 'start':
+                if name in containers:
+                    container = element
+                continue
+
+            if name == 'definition':
+                cves = set()
+                for child in element.iter():
+                    childname = local_name(child.tag)
+                    if childname == 'title' and child.text:
+                        cves |= set(cve_id.findall(child.text))
+                    elif childname == 'reference' and child.get('source') == 'CVE':
+                        cves.add(child.get('ref_id'))
+                    elif childname == 'cve' and child.text:
+                        cves |= set(cve_id.findall(child.text))
+
+                refs = tuple([child.get('test_ref') for child in element.iter() if local_name(child.tag) == 'criterion'])
+
+                if cves and refs:
+                    definitions.append((tuple(sorted(cves)), refs))
+
+            elif name.endswith('_test') and element.get('id'):
+                object_ref = None
+                state_ref = None
+                for child in element:
+                    if local_name(child.tag) == 'object':
+                        object_ref = child.get('object_ref')
+                    elif local_name(child.tag) == 'state':
+                        state_ref = child.get('state_ref')
+
+                tests[element.get('id')] = (object_ref, state_ref)
+
+            elif name.endswith('_object') and element.get('id'):
+                for child in element:
+                    if local_name(child.tag) == 'name' and child.get('var_ref'):
+                        object_variables[element.get('id')] = child.get('var_ref')
+                    elif local_name(child.tag) == 'name' and child.text and child.text.startswith(prefix):
+                        objects[element.get('id')] = [child.text]
+
+            elif name == 'constant_variable' and element.get('id'):
+                variables[element.get('id')] = [child.text for child in element if local_name(child.tag) == 'value' and child.text]
+
+            elif name.endswith('_state') and element.get('id'):
+                for child in element:
+                    if local_name(child.tag) == 'evr' and child.get('operation') == 'less than' and child.text:
+                        # Remove epoch "0:"
+                        states[element.get('id')] = re.sub(r"^0:", "", child.text)
+
+            else:
+                continue
+
+            # Throw away what was read
+            element.clear()
+            if container is not None:
+                container.clear()
+
+    # Resolve the names given by variables; the variables come after the objects in the file
+    skipped_objects = 0
+
+    for object_id, variable in object_variables.items():
+        if variable not in variables:
+            skipped_objects += 1
+            continue
+
+        packages = [value for value in variables[variable] if value.startswith(prefix)]
+        if len(packages) > 0:
+            objects[object_id] = packages
+
+    if skipped_objects > 0 and kittykecore.debugmode:
+        print("parse_oval: skipped %d objects with unresolved names" % skipped_objects)
+
+    # Join definitions, tests, objects, and states
+    fixes = {}
+
+    for cves, refs in definitions:
+        for ref in refs:
+            object_ref, state_ref = tests.get(ref, (None, None))
+
+            if object_ref not in objects:
+                continue
+
+            # A test without state checks only whether the package is installed, i.e. there is no fix yet
+            fixed = states.get(state_ref) if state_ref is not None else None
+
+            if state_ref is not None and fixed is None:
+                continue
+
+            for package in objects[object_ref]:
+                for cve in cves:
+                    known = fixes.setdefault(package, {})
+
+                    # If the data lists a CVE twice, the later fix counts
+                    if cve not in known or (fixed is not None and (known[cve] is None or apt_pkg.version_compare(fixed, known[cve]) > 0)):
+                        known[cve] = fixed
+
+    return fixes
+
+# Imports an OVAL file, i.e. saves its kernel data for load_index; returns the number of source packages and CVEs
+def import_oval(path):
+    fixes = parse_oval(path)
+
+    os.makedirs(os.path.dirname(index_file), exist_ok=True)
+
+    # Write to temporary file first, so that an interrupted write does not destroy the data imported before
+    with open(index_file + ".tmp", "w") as f:
+        json.dump({'file': os.path.abspath(path), 'fixes': fixes}, f, separators=(',', ':'))
+
+    os.replace(index_file + ".tmp", index_file)
+
+    return len(fixes), sum([len(cves) for cves in fixes.values()])
+
+
+# Loads the imported data and prepares it for counting: for each package, the CVEs without fix and the sorted list of
+# versions fixing the others (with the CVEs they fix). The file is only read again if it changed. Returns an empty index
+# if nothing was imported.
+def load_index():
+    try:
+        mtime = os.stat(index_file).st_mtime
+    except OSError:
+        return {}
+
+    if index_cache['mtime'] == mtime:
+        return index_cache['index']
+
+    try:
+        with open(index_file, "r") as f:
+            fixes = json.load(f)['fixes']
+    except Exception as e:
+        if kittykecore.debugmode:
+            print (e)
+        return {}
+
+    index = {}
+    version_key = functools.cmp_to_key(apt_pkg.version_compare)
+
+    for package, cves in fixes.items():
+        fixed = sorted([(version, cve) for cve, version in cves.items() if version is not None], key=lambda item: version_key(item[0]))
+        index[package] = {'unfixed': [cve for cve, version in cves.items() if version is None], 'cves': [cve for version, cve in fixed],
+                          'keys': [version_key(version) for version, cve in fixed]}
+
+    index_cache['mtime'] = mtime
+    index_cache['index'] = index
+
+    return index
+
+# Returns the package names a kernel's CVEs may be listed under: OVAL files name either the source package (e.g. linux)
+# or the binary packages (e.g. linux-image-6.8.0-31-generic, given by a constant variable)
+def get_oval_names(kernel):
+    names = [kernel.get('source'), kernel['package'].split(":")[0]]
+
+    if kernel.get('abi'):
+        names.extend(kittykecore.get_kernel_companions(kernel['abi']))
+
+    return names
+
+# Returns the number of CVEs not fixed in a kernel (None if there is no data for it); the versions fixing CVEs are sorted,
+# so this is a binary search per package. CVEs listed under several packages of the kernel are counted once.
+def count_unfixed(index, kernel):
+    packages = [index[name] for name in get_oval_names(kernel) if name in index]
+
+    if len(packages) == 0 or not kernel['pkg_version']:
+        return None
+
+    key = functools.cmp_to_key(apt_pkg.version_compare)(kernel['pkg_version'])
+    unfixed = set()
+
+    for data in packages:
+        unfixed.update(data['unfixed'])
+        unfixed.update(data['cves'][bisect.bisect_right(data['keys'], key):])
+
+    return len(unfixed)
+
+# Counts the CVEs not fixed for each kernel of the list once (e.g. after a refresh); returns a dictionary, which maps the
+# full package names to the counts (None if unknown)
+def count_unfixed_kernels(index, kernels):
+    return {kernel['fullname']: count_unfixed(index, kernel) for kernel in kernels}
+
+
+# Script file is run directly... then let's have some test outputs here; an OVAL file can be given
+if __name__ == '__main__':
+    print("Script was called directly. Testing...")
+
+    kittykecore.debugmode = True
+
+    for package, cves in parse_oval(sys.argv[1]).items():
+        print(package, len(cves), "CVEs,", len([fixed for fixed in cves.values() if fixed is None]), "not fixed")
@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+
+#  kittykernel
+#
+#  Copyright (C) 2017 by Sven Kochmann, available at Github:
+#  <https://www.github.com/Schallaven/kittykernel/>
+#
+#  This program is free software;  you can redistribute it and/or modify
+#  it under the terms of the  GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  This program is  distributed in the hope that it  will be useful, but
+#  WITHOUT  ANY   WARRANTY;  without   even  the  implied   warranty  of
+#  MERCHANTABILITY  or FITNESS FOR  A PARTICULAR  PURPOSE.  See  the GNU
+#  General Public License for more details.
+#
+#  You should  have received  a copy of  the GNU General  Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#  Downloads the packages of the newest kernel of each supported group
+#  into the APT archive cache in advance, so that installing a kernel
+#  later only has to unpack them
+#
+#
+#  Warning: Don't read this  source file if  you are annoyed by too many
+#           comments. Read source code  of other FOSS projects  instead.
+#
+
+import os
+import apt
+import apt_pkg
+
+import kittykecore
+
+
+# Returns the directory of the APT archive cache (usually /var/cache/apt/archives)
+def get_archive_dir():
+    return apt_pkg.config.find_dir("Dir::Cache::Archives")
+
+# Returns the kernels worth prefetching: the newest kernel of each group which is not known to be unsupported (groups
+# without support info are included), if it is neither installed nor downloaded (mainline kernels are not in the APT
+# archive); newest groups first
+def get_prefetch_kernels(kernels, support_times):
+    newest = {}
+
+    for kernel in kernels:
+        if kernel.get('mainline') or not kernel['pkg_version']:
+            continue
+
+        months = kittykecore.get_kernel_support_month(support_times, kernel)
+        if months is not None and months < 0:
+            continue
+
+        if kernel['version_major'] not in newest or kittykecore.kernel_version_key(kernel) > kittykecore.kernel_version_key(newest[kernel['version_major']]):
+            newest[kernel['version_major']] = kernel
+
+    candidates = [kernel for kernel in newest.values() if not kernel['installed'] and not kernel['downloaded']]
+
+    return sorted(candidates, key=kittykecore.kernel_version_key, reverse=True)
+
+# Downloads the packages of the kernels (see get_prefetch_kernels) with everything they depend on into the archive cache
+# (needs root for the default directory). APT's own acquire system does the downloads, so its proxy, authentication,
+# transports, and checksums apply and the archive cache is locked as for any other download. At most maxsize bytes are
+# downloaded in total, at rate bytes per second (0 for APT's own Dl-Limit), and reserve bytes are kept free in the
+# archive directory. A kernel, which does not fit anymore, is skipped. Returns the list of tuples (kernel, bytes
+# downloaded), the list of tuples (kernel, reason) for the kernels skipped, and an error message (None if there was no
+# error), if APT failed for all kernels (e.g. another program locks the archive cache). The APT cache is left unchanged.
+@kittykecore.with_cache_lock
+def prefetch_kernels(kernels, archives = None, rate = 0, maxsize = 1000000000, reserve = 500000000, dry_run = False):
+    cache = kittykecore.get_cache()
+
+    # The settings are only changed for this download
+    settings = {}
+
+    if archives is not None:
+        os.makedirs(os.path.join(archives, "partial"), exist_ok=True)
+        settings["Dir::Cache::Archives"] = archives
+
+    if rate > 0:
+        settings["Acquire::http::Dl-Limit"] = str(max(rate // 1024, 1))
+        settings["Acquire::https::Dl-Limit"] = str(max(rate // 1024, 1))
+
+    previous = {key: apt_pkg.config.find(key) for key in settings}
+
+    fetched = []
+    skipped = []
+    error = None
+    total = 0
+
+    try:
+        for key, value in settings.items():
+            apt_pkg.config.set(key, value)
+
+        for index, kernel in enumerate(kernels):
+            try:
+                with cache.actiongroup():
+                    for verb, name in kittykecore.get_kernel_operations([kernel['fullname']], 'install'):
+                        cache[name].mark_install()
+
+                # Bytes still to download; files already in the archive cache are not counted
+                size = cache.required_download
+
+                # Everything in the archive cache already?
+                if size == 0:
+                    continue
+
+                if total + size > maxsize:
+                    skipped.append((kernel, "size limit"))
+                    continue
+
+                stat = os.statvfs(get_archive_dir())
+                if stat.f_bavail * stat.f_frsize - size < reserve:
+                    skipped.append((kernel, "disk space"))
+                    continue
+
+                if not dry_run:
+                    cache.fetch_archives()
+
+                fetched.append((kernel, size))
+                total += size
+
+            except apt.cache.FetchFailedException as e:
+                if kittykecore.debugmode:
+                    print (e)
+                skipped.append((kernel, "download failed"))
+
+            # The archive cache is locked or APT failed otherwise; this is the same for the remaining kernels
+            except (apt.cache.LockFailedException, SystemError) as e:
+                if kittykecore.debugmode:
+                    print (e)
+                error = str(e)
+                skipped.extend([(remaining, "APT failed") for remaining in kernels[index:]])
+                break
+
+            finally:
+                cache.clear()
+
+    finally:
+        for key, value in previous.items():
+            apt_pkg.config.set(key, value)
+
+    return fetched, skipped, error
+
+
+# Script file is run directly... then let's have some test outputs here
+if __name__ == '__main__':
+    print("Script was called directly. Testing...")
+
+    kittykecore.debugmode = True
+
+    kernels = get_prefetch_kernels(kittykecore.get_kernels(), kittykecore.get_kernel_support_times())
+
+    for kernel, size in prefetch_kernels(kernels, dry_run = True)[0]:
+        print(kernel['package'], kittykecore.sizeof_fmt(size))
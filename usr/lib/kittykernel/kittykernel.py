@@ -32,6 +32,7 @@ import sys
 import gettext
 import setproctitle
 import subprocess
+import kittykecore
 from kittykemain import KittykeMainWindow
 
 # Check for another instance of kittykernel; if there is one, then just exit this process
@@ -52,6 +53,9 @@ setproctitle.setproctitle("kittykernel_main_proc")
 # Load the language-definitions (i18n) for kittykernel
 gettext.install("kittykernel", "/usr/share/kittykernel/locale")
 
+# Debug output (e.g. the time needed for starting up) is shown with --debug
+kittykecore.debugmode = ("--debug" in sys.argv[1:])
+
 # Starts the application
 KittykeMainWindow()
 
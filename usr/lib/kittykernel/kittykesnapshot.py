@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+
+#  kittykernel
+#
+#  Copyright (C) 2017 by Sven Kochmann, available at Github:
+#  <https://www.github.com/Schallaven/kittykernel/>
+#
+#  This program is free software;  you can redistribute it and/or modify
+#  it under the terms of the  GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  This program is  distributed in the hope that it  will be useful, but
+#  WITHOUT  ANY   WARRANTY;  without   even  the  implied   warranty  of
+#  MERCHANTABILITY  or FITNESS FOR  A PARTICULAR  PURPOSE.  See  the GNU
+#  General Public License for more details.
+#
+#  You should  have received  a copy of  the GNU General  Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#  Snapshots of the kernels of a system (exported as JSON Lines) and
+#  routines for aggregating the snapshots of many systems
+#
+#
+#  Warning: Don't read this  source file if  you are annoyed by too many
+#           comments. Read source code  of other FOSS projects  instead.
+#
+
+import os
+import json
+import socket
+import datetime
+
+import kittykecore
+
+
+# Format name and version of the snapshots; the version is increased whenever the records change incompatibly
+snapshot_format = "kittykernel-snapshot"
+snapshot_version = 2
+
+
+# Writes a snapshot to the (text) file f: the first line is a header with host, time, current kernel, and size of /boot
+# (free, total); each following line is one kernel. The state of a kernel is a string of the letters 'a' (active),
+# 'i' (installed), and 'd' (downloaded); 'boot' is the size of its files in /boot, 'support' the months it is still
+# supported (None if unknown), and 'retention' what the retention rules (see kittykecore.get_retention_rules; the rules
+# of the config file if not given) would do with it: 'keep', 'remove', or 'purge' (None for kernels not on the system).
+def export_snapshot(f, kernels, boot, boot_usage, support_times, host = None, rules = None):
+    if rules is None:
+        rules = kittykecore.get_retention_rules(kittykecore.load_config())
+
+    decision = kittykecore.evaluate_retention_policy(kernels, rules, support_times)
+    retention = {id(kernel): action for action in ['keep', 'remove', 'purge'] for kernel, reason in decision[action]}
+
+    header = {'format': snapshot_format, 'version': snapshot_version, 'host': host or socket.getfqdn(),
+              'time': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+              'current': kittykecore.get_current_kernel(), 'boot': list(boot)}
+
+    f.write(json.dumps(header, separators=(',', ':')) + "\n")
+
+    for kernel in kernels:
+        record = {'package': kernel['package'], 'pkg_version': kernel['pkg_version'], 'version_major': kernel['version_major'],
+                  'state': ('a' if kernel['active'] else '') + ('i' if kernel['installed'] else '') + ('d' if kernel['downloaded'] else ''),
+                  'boot': kittykecore.get_kernel_boot_size(boot_usage, kernel), 'installed_size': kernel['installed_size'],
+                  'support': kittykecore.get_kernel_support_month(support_times, kernel), 'retention': retention.get(id(kernel))}
+
+        f.write(json.dumps(record, separators=(',', ':')) + "\n")
+
+# Reads a snapshot file line by line; yields the header first and then each kernel record. Raises ValueError if the file
+# is not a snapshot or has a newer version.
+def read_snapshot(path):
+    with open(path, "r") as f:
+        header = json.loads(f.readline() or "{}")
+
+        if header.get('format') != snapshot_format or header.get('version', 0) > snapshot_version:
+            raise ValueError("%s: not a supported snapshot" % path)
+
+        yield header
+
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+# Reads all snapshots in a directory one after another and yields a summary for each host, i.e. only one snapshot is
+# in memory at a time. A summary has the host, the time of the snapshot, the active kernel and its group, the months
+# the active group is still supported (None if unknown), the number of installed kernels, the bytes in /boot which
+# could be freed by the retention rules of the host (i.e. of the kernels they would remove or purge; snapshots of
+# version 1 do not say, so nothing is counted for them), and the free space on /boot. Files which cannot be read are
+# yielded as {'file': ..., 'error': ...}.
+def summarize_snapshots(directory):
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            # Ignore snapshots, which are still being written
+            if not entry.is_file() or entry.name.endswith(".tmp"):
+                continue
+
+            try:
+                records = read_snapshot(entry.path)
+                header = next(records)
+
+                summary = {'host': header['host'], 'time': header['time'], 'active': None, 'version_major': None, 'support': None,
+                           'installed': 0, 'reclaimable': 0, 'boot_free': header['boot'][0]}
+
+                for record in records:
+                    if 'i' in record['state']:
+                        summary['installed'] += 1
+
+                    if 'a' in record['state']:
+                        summary['active'] = record['package']
+                        summary['version_major'] = record['version_major']
+                        summary['support'] = record['support']
+
+                    if record.get('retention') in ['remove', 'purge']:
+                        summary['reclaimable'] += record['boot']
+
+                yield summary
+
+            except Exception as e:
+                if kittykecore.debugmode:
+                    print (e)
+                yield {'file': entry.path, 'error': str(e)}
+
+# Aggregates all snapshots in a directory (see summarize_snapshots) in constant memory; returns the number of hosts,
+# the number of hosts whose active kernel is in a group with expired support, the total bytes reclaimable in /boot,
+# and the number of files which could not be read
+def aggregate_snapshots(directory):
+    fleet = {'hosts': 0, 'expired': 0, 'reclaimable': 0, 'errors': 0}
+
+    for summary in summarize_snapshots(directory):
+        if 'error' in summary:
+            fleet['errors'] += 1
+            continue
+
+        fleet['hosts'] += 1
+        fleet['reclaimable'] += summary['reclaimable']
+
+        if summary['support'] is not None and summary['support'] < 0:
+            fleet['expired'] += 1
+
+    return fleet
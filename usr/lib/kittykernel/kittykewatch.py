@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+
+#  kittykernel
+#
+#  Copyright (C) 2017 by Sven Kochmann, available at Github:
+#  <https://www.github.com/Schallaven/kittykernel/>
+#
+#  This program is free software;  you can redistribute it and/or modify
+#  it under the terms of the  GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or (at
+#  your option) any later version.
+#
+#  This program is  distributed in the hope that it  will be useful, but
+#  WITHOUT  ANY   WARRANTY;  without   even  the  implied   warranty  of
+#  MERCHANTABILITY  or FITNESS FOR  A PARTICULAR  PURPOSE.  See  the GNU
+#  General Public License for more details.
+#
+#  You should  have received  a copy of  the GNU General  Public License
+#  along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+#  Watches the dpkg status, the APT lists, and /boot with inotify, so that
+#  kittykernel notices when packages are changed by other programs
+#
+#
+#  Warning: Don't read this  source file if  you are annoyed by too many
+#           comments. Read source code  of other FOSS projects  instead.
+#
+
+import os
+import time
+import errno
+import struct
+import select
+import ctypes
+import ctypes.util
+import threading
+
+import kittykecore
+
+
+# inotify flags (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_CLOEXEC = 0o2000000
+
+# Header of each event: watch descriptor, mask, cookie, length of name
+event_header = struct.Struct("iIII")
+
+# What is watched: kind of change, directory, and the file names of interest (None for all). dpkg replaces its status
+# file by renaming, so the directory has to be watched instead of the file.
+watch_list = [('dpkg', "/var/lib/dpkg", ["status"]),
+              ('lists', "/var/lib/apt/lists", None),
+              ('boot', "/boot", None)]
+
+
+# Watches the directories of watch_list in a background thread; after a burst of changes, callback is called (from that
+# thread!) with the set of kinds that changed, e.g. {'dpkg', 'boot'}. The callback is only called when nothing changed
+# for delay seconds, but at the latest after maxdelay seconds.
+class KittykeWatcher(threading.Thread):
+
+    def __init__(self, callback, delay = 2.0, maxdelay = 30.0, watches = None):
+        threading.Thread.__init__(self, daemon=True)
+        self.callback = callback
+        self.delay = delay
+        self.maxdelay = maxdelay
+        self.watches = watches if watches is not None else watch_list
+        self.running = True
+
+        # Setup inotify
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+        # Watch descriptors mapped to kind and names of interest
+        self.descriptors = {}
+
+        for kind, path, names in self.watches:
+            wd = self.libc.inotify_add_watch(self.fd, path.encode(), IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE)
+
+            # Missing directories (e.g. in containers) are just not watched
+            if wd < 0:
+                if kittykecore.debugmode:
+                    print("Cannot watch %s: %s" % (path, os.strerror(ctypes.get_errno())))
+                continue
+
+            self.descriptors[wd] = (kind, names)
+
+    # Stops the thread
+    def stop(self):
+        self.running = False
+
+    # Reads the events and returns the set of kinds they belong to
+    def read_events(self):
+        kinds = set()
+
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as e:
+            if e.errno in [errno.EAGAIN, errno.EINTR]:
+                return kinds
+            raise
+
+        offset = 0
+        while offset + event_header.size <= len(data):
+            wd, mask, cookie, length = event_header.unpack_from(data, offset)
+            name = data[offset + event_header.size:offset + event_header.size + length].rstrip(b"\0").decode(errors="replace")
+            offset += event_header.size + length
+
+            if wd not in self.descriptors:
+                continue
+
+            kind, names = self.descriptors[wd]
+
+            # Ignore lock files, temporary files, etc.
+            if names is None or name in names:
+                kinds.add(kind)
+
+        return kinds
+
+    # Collects events and calls the callback once per burst
+    def run(self):
+        pending = set()
+        first = 0.0
+        last = 0.0
+
+        while self.running:
+            # Wait for events; wake up regularly to check whether a burst is over or the thread should stop
+            timeout = self.delay if pending else 1.0
+            readable, writable, exceptional = select.select([self.fd], [], [], timeout)
+
+            if readable:
+                kinds = self.read_events()
+
+                if kinds:
+                    now = time.monotonic()
+                    if not pending:
+                        first = now
+                    pending |= kinds
+                    last = now
+
+            # Burst over (or taking too long)? Then report it
+            if pending:
+                now = time.monotonic()
+                if now - last >= self.delay or now - first >= self.maxdelay:
+                    try:
+                        self.callback(pending)
+                    except Exception as e:
+                        if kittykecore.debugmode:
+                            print (e)
+                    pending = set()
+
+        os.close(self.fd)